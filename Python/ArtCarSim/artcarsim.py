@@ -1,14 +1,29 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import argparse
+import struct
+import time
 import pygame as pg
 import numpy as np
 import numpy.linalg as la
 import random
 import serial
+from functools import lru_cache
+import math
 from enum import IntEnum
 from enum import auto
 
+sys.path.append(os.path.join(
+  os.path.dirname(os.path.abspath(__file__)), os.pardir, "PQFController"
+))
+from qposctrl import QPosCtrl
+sys.path.append(os.path.join(
+  os.path.dirname(os.path.abspath(__file__)), os.pardir, "TurnRateLimiter"
+))
+from beziercurve import eval_bezier_linspace
+
 
 if not pg.image.get_extended():
   raise SystemExit("Extended pygame image module required.")
@@ -305,34 +320,160 @@ known_gamepads = [
   },
 ]
 
+
+def turn_rate_curve(v, mla, max_omega, ros, reverse_turns):
+  # The hardest turn rate at each speed v for the maximum lateral
+  # acceleration mla, the maximum turn rate max_omega and the reversing
+  # omega slope ros of TurnCaps. All arguments broadcast together.
+  # (tanh(x) is the sigmoid -1 + 2 / (1 + exp(-2 * x)).)
+  v = np.asarray(v, dtype=float)
+  a = mla * np.tanh(max_omega / mla * v)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    omega = np.where(
+      np.abs(v) >= 1e-15, np.clip(a / v, 0.0, max_omega), max_omega
+    )
+  # With reverse_turns, reversing the vehicle preserves the direction of
+  # the turning circle but reverses the sign of the rate of change of
+  # the heading. (The joystick is pointed towards the turning centre.)
+  # Otherwise, reversing preserves the sign of the rate of change of the
+  # heading but flips the side on which the turning circle appears.
+  # (RC toy tank, skid-steer. excavator, spacecraft, horse)
+  return omega * np.where(reverse_turns, np.tanh(ros * v), 1.0)
+
+
+def solve_max_body_speed(
+  max_wheel_speed,
+  axle_width,
+  mla, max_omega, ros, reverse_turns,
+  tolerance=1e-9,
+  max_iterations=40,
+):
+  # The highest body speed v at which the hardest turn still keeps the
+  # outer wheel within max_wheel_speed, the root of
+  #
+  #   f(v) = v + 0.5 * omega(v) * axle_width - max_wheel_speed
+  #
+  # where omega(v) is turn_rate_curve(). Since omega(v) <= max_omega,
+  # the root is bracketed by max_wheel_speed - 0.5 * max_omega *
+  # axle_width and max_wheel_speed. Newton steps which leave the bracket
+  # are replaced by the secant through its ends or by bisection. All
+  # arguments broadcast together, so many vehicles are solved at once
+  # within a fixed number of iterations.
+  W = np.asarray(max_wheel_speed, dtype=float)
+  hw = 0.5 * np.asarray(axle_width, dtype=float)
+  args = (mla, max_omega, ros, reverse_turns)
+  def f(v):
+    return v + hw * turn_rate_curve(v, *args) - W
+  tol = tolerance * np.maximum(W, 1.0)
+  h = 1e-7 * np.maximum(W, 1.0)
+  lo = np.maximum(0.0, W - hw * max_omega)
+  f_lo = f(lo)
+  # Where even the lower end is too fast, it is the answer.
+  hi = np.where(f_lo >= 0.0, lo, W)
+  f_hi = f(hi)
+  v = hi
+  fv = f_hi
+  for i in range(max_iterations):
+    if np.all((np.abs(fv) <= tol) | (hi - lo <= tol)):
+      break
+    dfdv = (f(v + h) - f(v - h)) / (2.0 * h)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      v_newton = v - fv / dfdv
+      v_secant = lo - f_lo * (hi - lo) / (f_hi - f_lo)
+    v = np.where(
+      (v_newton > lo) & (v_newton < hi),
+      v_newton,
+      np.where((v_secant > lo) & (v_secant < hi), v_secant, 0.5 * (lo + hi)),
+    )
+    fv = f(v)
+    lo = np.where(fv < 0.0, v, lo)
+    f_lo = np.where(fv < 0.0, fv, f_lo)
+    hi = np.where(fv > 0.0, v, hi)
+    f_hi = np.where(fv > 0.0, fv, f_hi)
+  return v
+
+
 class TurnCaps (object):
 
+  # The hardest turn rate allowed at each speed. The curve is sampled
+  # into a table whenever its parameters change, and lookups, of one
+  # speed or of an array of speeds, interpolate in the table.
+
+  table_size = 1025
+
   def __init__(self):
     self.max_lat_accel = 4.0  # (1.47m/s/s standard max. for highways)
     self.max_turn_rate = np.radians(90)
     self.reversing_omega_slope = 1.0  # For car-like stick-to-turn-centre mode
     self.reverse_turns = False  # Rev rate of change of heading for rev motion
+    self.table_key = None
+
+  def max_turn_rate_formula(self, v):
+    # The curve itself, from which the table is built
+    return turn_rate_curve(
+      v,
+      self.max_lat_accel,
+      self.max_turn_rate,
+      self.reversing_omega_slope,
+      self.reverse_turns,
+    )
+
+  def update_table(self):
+    key = (
+      self.max_lat_accel,
+      self.max_turn_rate,
+      self.reversing_omega_slope,
+      self.reverse_turns,
+    )
+    if key == self.table_key:
+      return
+    # The table is uniform in u = v / (|v| + c), which maps all speeds
+    # into -1..+1, finely around rest and coarsely at high speeds, where
+    # the curve flattens out. The ends are at infinite speeds.
+    c = self.max_lat_accel / self.max_turn_rate
+    u = np.linspace(-1.0, 1.0, self.table_size)
+    with np.errstate(divide='ignore'):
+      v = c * u / (1.0 - np.abs(u))
+    self.table_u = u
+    self.table = self.max_turn_rate_formula(v)
+    self.table_list = self.table.tolist()
+    self.table_c = c
+    self.table_scale = 0.5 * (self.table_size - 1)
+    self.table_key = key
+
+  def max_body_speed(self, max_wheel_speed, axle_width):
+    # The highest body speed at which the hardest turn keeps the outer
+    # wheel within max_wheel_speed, for one vehicle or arrays of them
+    return solve_max_body_speed(
+      max_wheel_speed,
+      axle_width,
+      self.max_lat_accel,
+      self.max_turn_rate,
+      self.reversing_omega_slope,
+      self.reverse_turns,
+    )
 
   def max_turn_rate_for_speed(self, v):
-    mla = self.max_lat_accel
-    max_omega = self.max_turn_rate
-    a = mla * (-1.0 + 2.0 / (1.0 + np.exp(-2.0 * max_omega / mla * v)))
-    if abs(v) >= 1e-15:
-      omega = max(0.0, min(max_omega, a / v))
+    self.update_table()
+    if isinstance(v, (np.ndarray, list, tuple)):
+      v = np.asarray(v, dtype=float)
+      with np.errstate(invalid='ignore'):
+        u = v / (np.abs(v) + self.table_c)
+      u = np.where(np.isinf(v), np.sign(v), u)
+      return np.interp(u, self.table_u, self.table)
+    # Infinite speeds map to the ends of the table and NaN passes through
+    if abs(v) < np.inf:
+      u = v / (abs(v) + self.table_c)
+    elif v > 0.0:
+      u = 1.0
+    elif v < 0.0:
+      u = -1.0
     else:
-      omega = max_omega
-    if self.reverse_turns:
-      # Reversing the vehicle preserves the direction of the turning
-      # circle but reverses the sign of the rate of change of the heading.
-      # (The joystick is pointed towards the turning centre.)
-      s = (-1.0 + 2.0 / (1.0 + np.exp(-2.0 * self.reversing_omega_slope * v)))
-      omega *= s
-    else:
-      # Reversing the vehicle preserves the sign of the rate of change
-      # of the heading but flips the side on which the turning circle
-      # appears. (RC toy tank, skid-steer. excavator, spacecraft, horse)
-      pass
-    return omega
+      return float('nan')
+    x = (u + 1.0) * self.table_scale
+    i = min(int(x), self.table_size - 2)
+    w = self.table_list
+    return w[i] + (x - i) * (w[i + 1] - w[i])
 
 
 class Blinkers (object):
@@ -405,6 +546,55 @@ VIEW_SENSE_SPACE_VEHICLE = np.array([
 VIEW_SENSE_OPENGL = np.eye(3)
 
 
+def edge_runs_to_segment_ixs(poly_edges):
+  # Vertex indices of the line segments in runs of connected edges,
+  # with the start and end of each segment interleaved
+  runs = [np.asarray(pe, dtype=int) for pe in poly_edges if len(pe) >= 2]
+  if len(runs) == 0:
+    return np.empty(0, dtype=int)
+  ixs = np.empty(2 * sum(len(run) - 1 for run in runs), dtype=int)
+  ixs[0::2] = np.concatenate([run[:-1] for run in runs])
+  ixs[1::2] = np.concatenate([run[1:] for run in runs])
+  return ixs
+
+
+def h4d_points(points):
+  r = np.asanyarray(points)
+  dim = r.shape[1]
+  if dim < 4:
+    h = np.zeros((len(r), 4))
+    h[:, :dim] = r
+    h[:, 3] = 1.0
+    r = h
+  return r
+
+
+def bounding_box_points(points):
+  # The corners of the axis-aligned bounding box of the points
+  P = np.asanyarray(points)
+  lo = np.min(P, axis=0)
+  hi = np.max(P, axis=0)
+  corners = np.meshgrid(*np.stack([lo, hi], axis=1), indexing='ij')
+  return np.stack(corners, axis=-1).reshape((-1, P.shape[1]))
+
+
+def compile_wfo(wfo):
+  # Replace the edge runs of each style group with segment indices
+  # so that draw_wfo() can expand them with a single fancy index.
+  # A missing bounding point cloud is made from the bounding box of
+  # the vertices so that draw_wfo() can cull the object cheaply. The
+  # vertices are stored in homogeneous coordinates, ready for the
+  # fused model-view-projection matrix.
+  bpc, vertices, groups = wfo
+  if bpc is None:
+    bpc = bounding_box_points(vertices)
+  vertices = h4d_points(np.asanyarray(vertices, dtype=float))
+  groups = tuple(
+    (style, edge_runs_to_segment_ixs(runs)) for style, runs in groups
+  )
+  return (bpc, vertices, groups)
+
+
 wfo_basis_vectors = (
   # Bounding point cloud or None
   None,
@@ -917,6 +1107,46 @@ wfo_sc5k_reversing_lamps = (
   ),
 )
 
+# The edge runs of the wireframe objects never change, so they are
+# expanded into segment vertex indices just once.
+wfo_basis_vectors = compile_wfo(wfo_basis_vectors)
+wfo_cylinder = compile_wfo(wfo_cylinder)
+wfo_artcar1_ref_box = compile_wfo(wfo_artcar1_ref_box)
+wfo_artcar1_body = compile_wfo(wfo_artcar1_body)
+wfo_artcar1_headlamps = compile_wfo(wfo_artcar1_headlamps)
+wfo_artcar1_left_di_lamps = compile_wfo(wfo_artcar1_left_di_lamps)
+wfo_artcar1_right_di_lamps = compile_wfo(wfo_artcar1_right_di_lamps)
+wfo_artcar1_stop_lamps = compile_wfo(wfo_artcar1_stop_lamps)
+wfo_artcar1_reversing_lamps = compile_wfo(wfo_artcar1_reversing_lamps)
+wfo_artcar_mcguffin = compile_wfo(wfo_artcar_mcguffin)
+wfo_sc5k_ref_box = compile_wfo(wfo_sc5k_ref_box)
+wfo_sc5k_body = compile_wfo(wfo_sc5k_body)
+wfo_sc5k_left_di_lamps = compile_wfo(wfo_sc5k_left_di_lamps)
+wfo_sc5k_right_di_lamps = compile_wfo(wfo_sc5k_right_di_lamps)
+wfo_sc5k_stop_lamps = compile_wfo(wfo_sc5k_stop_lamps)
+wfo_sc5k_reversing_lamps = compile_wfo(wfo_sc5k_reversing_lamps)
+
+# The bodies of whole vehicles are bounded too, so that a vehicle out
+# of view is culled with a single test rather than one for each part.
+bpc_artcar1_body = bounding_box_points(np.vstack([
+  wfo_artcar1_ref_box[1][:, :3],
+  wfo_artcar1_body[1][:, :3],
+  wfo_artcar1_headlamps[1][:, :3],
+  wfo_artcar1_left_di_lamps[1][:, :3],
+  wfo_artcar1_right_di_lamps[1][:, :3],
+  wfo_artcar1_stop_lamps[1][:, :3],
+  wfo_artcar1_reversing_lamps[1][:, :3],
+  1.3 * wfo_artcar_mcguffin[1][:, :3] + np.array([-1.5, 0.0, 0.9]),
+]))
+bpc_sc5k_body = bounding_box_points(np.vstack([
+  wfo_sc5k_ref_box[1][:, :3],
+  wfo_sc5k_body[1][:, :3],
+  wfo_sc5k_left_di_lamps[1][:, :3],
+  wfo_sc5k_right_di_lamps[1][:, :3],
+  wfo_sc5k_stop_lamps[1][:, :3],
+  wfo_sc5k_reversing_lamps[1][:, :3],
+]))
+
 
 def sloppy_joy(x, slop_hw=None):
   if slop_hw is None:
@@ -953,16 +1183,6 @@ seven_seg_runs = {
 }
 
 
-def h4d_points(points):
-  dw = 4 - points.shape[1]
-  r = np.asanyarray(points)
-  if dw > 0:
-    a = np.zeros(dw).reshape((1, dw))
-    a[0, -1] = 1.0
-    r = np.hstack([points, np.tile(a, (points.shape[0], 1))])
-  return r
-
-
 def mtx4d_from_bvt(bvs, translation):
   M = np.pad(np.vstack([bvs, translation]), ((0, 0), (0, 1)))
   M[-1, -1] = 1.0
@@ -978,21 +1198,6 @@ def look(direction, up, sense):
   return ori
 
 
-def mesh_to_segment_vertices(vertices, poly_edges):
-  n = sum(len(pe) - 1 for pe in poly_edges if len(pe) >= 2)
-  L = np.empty((2 * n, len(vertices[0])))
-  i = 0
-  for pe in poly_edges:
-    if len(pe) >= 2:
-      vix0 = pe[0]
-      for vix1 in pe[1:]:
-        L[i] = vertices[vix0]
-        L[i + 1] = vertices[vix1]
-        vix0 = vix1
-        i += 2
-  return L
-
-
 class PoV (object):
   def __init__(self):
     self.pos = np.zeros([3])
@@ -1002,25 +1207,41 @@ class PoV (object):
 
 class ModelviewMtxStack (object):
 
-  def __init__(self):
-    self.matrix = np.eye(4)
-    self.stack = list()
+  # The matrices of the stack live in one preallocated buffer of shape
+  # (depth, 4, 4) and the current matrix is a view of the slot at the
+  # top. With row vectors, each operation premultiplies the current
+  # matrix in place, touching only the rows that the operation changes.
+  # The matrix is therefore borrowed: It changes under any operation,
+  # push() or pop(), so a caller which keeps it must take a copy.
+
+  def __init__(self, max_depth=32):
+    self.buffer = np.empty((max_depth, 4, 4))
+    self.buffer[0] = np.eye(4)
+    self.depth = 0
+    self.matrix = self.buffer[0]
+    # Scratch space for the rotations and orient()
+    self.rot2 = np.empty((2, 2))
+    self.rows = np.empty((3, 4))
 
   def push(self):
-    self.stack.append(self.matrix)
-    self.matrix = np.array(self.stack[-1])
+    if self.depth + 1 >= len(self.buffer):
+      buffer = np.empty((2 * len(self.buffer), 4, 4))
+      buffer[:len(self.buffer)] = self.buffer
+      self.buffer = buffer
+    self.buffer[self.depth + 1] = self.buffer[self.depth]
+    self.depth += 1
+    self.matrix = self.buffer[self.depth]
 
   def pop(self):
-    if len(self.stack) > 0:
-      self.matrix = self.stack.pop()
+    if self.depth > 0:
+      self.depth -= 1
+      self.matrix = self.buffer[self.depth]
     else:
-      self.matrix = np.eye(4)
+      self.matrix[:] = np.eye(4)
 
   def translate(self, displ):
-    d = np.pad(displ, (0, 3 - len(displ)))
-    T = np.eye(4)
-    T[3, :3] = d
-    self.matrix = T @ self.matrix
+    M = self.matrix
+    M[3] += np.dot(displ, M[:len(displ)])
 
   def scale(self, scale_factor, sy=None, sz=None):
     if sy is None and sz is None:
@@ -1029,44 +1250,37 @@ class ModelviewMtxStack (object):
     else:
       if sy is None: sy = 1.0
       if sz is None: sz = 1.0
-    T = np.diag((scale_factor, sy, sz, 1.0), 0)
-    self.matrix = T @ self.matrix
+    M = self.matrix
+    M[0] *= scale_factor
+    M[1] *= sy
+    M[2] *= sz
+
+  def rotate_rows(self, i, j, c, s):
+    # Rows i and j become c * Mi + s * Mj and -s * Mi + c * Mj.
+    R = self.rot2
+    R[0, 0] = c
+    R[0, 1] = s
+    R[1, 0] = -s
+    R[1, 1] = c
+    rows = slice(i, j + 1, j - i)
+    np.matmul(R, self.matrix[rows], out=self.rows[:2])
+    self.matrix[rows] = self.rows[:2]
 
   def rotate_x(self, angle_rad):
-    c = np.cos(angle_rad)
-    s = np.sin(angle_rad)
-    R = np.eye(4)
-    R[1:3, 1:3] = [
-      [c, s],
-      [-s, c],
-    ]
-    self.matrix = R @ self.matrix
+    self.rotate_rows(1, 2, math.cos(angle_rad), math.sin(angle_rad))
 
   def rotate_y(self, angle_rad):
-    c = np.cos(angle_rad)
-    s = np.sin(angle_rad)
-    R = np.eye(4)
-    R[:3, :3] = [
-      [c, 0.0, -s],
-      [0.0, 1.0, 0.0],
-      [s, 0.0, c],
-    ]
-    self.matrix = R @ self.matrix
+    self.rotate_rows(0, 2, math.cos(angle_rad), -math.sin(angle_rad))
 
   def rotate_z(self, angle_rad):
-    c = np.cos(angle_rad)
-    s = np.sin(angle_rad)
-    R = np.eye(4)
-    R[:2, :2] = [
-      [c, s],
-      [-s, c],
-    ]
-    self.matrix = R @ self.matrix
+    self.rotate_rows(0, 1, math.cos(angle_rad), math.sin(angle_rad))
 
   def orient(self, ori):
-    M = np.eye(4)
-    M[:3, :3] = ori
-    self.matrix = M @ self.matrix
+    np.matmul(ori, self.matrix[:3], out=self.rows)
+    self.matrix[:3] = self.rows
+
+  def transform(self, M):
+    self.matrix[:] = M @ self.matrix
 
 
 class Perspective (object):
@@ -1100,6 +1314,35 @@ class Perspective (object):
     self.phi = np.arctan(tan_phi)
     k = s / tan_theta
     self.screen_mtx2d = k * np.array([[1.0, 0.0], [0.0, -1.0]])
+    # Pixels on the screen per unit of eye-space x / z or y / z
+    self.focal_length_px = k
+    # The screen-homogeneous coordinates (u, v, q, d) of a homogeneous
+    # eye-space point are linear in it. The screen position is
+    # (u / q, v / q), where q = -z is the depth, and d = q - near * w
+    # is negative for points nearer than the near plane. Clipping
+    # happens in these coordinates, before the only divide.
+    cx, cy = self.screen_centre
+    self.screen_proj = np.array([
+      [k, 0.0, 0.0, 0.0],
+      [0.0, -k, 0.0, 0.0],
+      [-cx, -cy, -1.0, -1.0],
+      [0.0, 0.0, 0.0, -self.near],
+    ])
+    # The planes of the view frustum as columns acting on screen-
+    # homogeneous points, which are outside a plane where the product
+    # is positive. The near plane is followed by the four sides of the
+    # screen, widened by a few pixels so that thick lines at the edges
+    # survive culling. The same planes act on eye-space points as
+    # frustum_planes.
+    margin = 8.0
+    w, h = self.screen_size
+    self.screen_planes = np.array([
+      [0.0, 1.0, -1.0, 0.0, 0.0],
+      [0.0, 0.0, 0.0, 1.0, -1.0],
+      [0.0, -(w + margin), -margin, -(h + margin), -margin],
+      [-1.0, 0.0, 0.0, 0.0, 0.0],
+    ])
+    self.frustum_planes = self.screen_proj @ self.screen_planes
     T_trans = np.eye(4)
     T_trans[3, :3] = -self.pos
     T_orient = np.eye(4)
@@ -1107,34 +1350,7 @@ class Perspective (object):
     T_sense = np.eye(4)
     T_sense[:3, :3] = self.sense.T
     self.matrix = T_trans @ T_orient @ T_sense
-
-  def project_to_eye_space(self, points, model_view_mtx=None):
-    if len(points) > 0:
-      # Eye-space, homogeneous coordinates
-      M = self.matrix
-      if model_view_mtx is not None:
-        M = model_view_mtx @ M
-      points_hes = h4d_points(points) @ M
-      # Divide by w.
-      inv_w = ((1.0) / points_hes[:, 3]).reshape((len(points_hes), 1))
-      # Eye-space, 3d coordinates (with +<z> behind camera)
-      points_es = points_hes[:, :3] * inv_w
-    else:
-      points_es = np.array([])
-    return points_es
-
-  def project_es_to_screen(self, points_es):
-    if len(points_es) > 0:
-      # Divide by z.
-      V = np.asanyarray(points_es)
-      inv_z = (-1.0 / V[:, 2]).reshape(len(V), 1)
-      # Eye-space, 2d coordinates
-      points_es2d = V[:, :2] * inv_z
-      # Display coordinates
-      points_px = (points_es2d @ self.screen_mtx2d) + self.screen_centre
-    else:
-      points_px = np.array([])
-    return points_px
+    self.world_to_screen = self.matrix @ self.screen_proj
 
   def project_noclip(self, points, model_view_mtx=None):
     if len(points) > 0:
@@ -1154,37 +1370,122 @@ class Perspective (object):
       points_px = np.array([])
     return points_px
 
-  def clipped_edge_run_vertices(self, points_es, edge_runs):
-    V = list()
-    lsvs = mesh_to_segment_vertices(points_es, edge_runs)
-    for i in range(0, len(lsvs), 2):
-      A, B = lsvs[i : i + 2]
-      a = A[2] + self.near
-      b = B[2] + self.near
-      if (a < 0) != (b < 0):
-        A1 = A
-        B1 = B
-        t = a / (a - b)
-        C = (A + (B - A) * t)
-        C[2] = -self.near
-        if a <= 0.0:
-          B1 = C
-        else:
-          A1 = C
-        V.append(A1)
-        V.append(B1)
+  def culled_point_sets(self, point_sets, model_view_mtx=None):
+    # point_sets has the shape (n, k, 2 or 3) and holds n sets of k
+    # points. A set is culled if all of its points lie outside the same
+    # plane of the view frustum, in which case nothing within its convex
+    # hull can be seen.
+    P = np.asanyarray(point_sets)
+    M = self.matrix
+    if model_view_mtx is not None:
+      M = model_view_mtx @ M
+    M = M @ self.frustum_planes
+    D = P.reshape((-1, P.shape[-1])) @ M[:P.shape[-1]] + M[3]
+    outside = (D > 0.0).reshape(P.shape[:-1] + (5,))
+    return np.any(np.all(outside, axis=-2), axis=-1)
+
+  def is_culled(self, bpc, model_view_mtx=None):
+    # True if nothing within the bounding point cloud can be seen
+    if bpc is None:
+      return False
+    bpc = np.asanyarray(bpc)
+    return bool(self.culled_point_sets(bpc[np.newaxis], model_view_mtx)[0])
+
+  def project_to_screen_hom(self, points, model_view_mtx=None):
+    # Screen-homogeneous coordinates of points in model space by one
+    # fused model-view-projection product
+    M = self.world_to_screen
+    if model_view_mtx is not None:
+      M = model_view_mtx @ M
+    return h4d_points(points) @ M
+
+  def clipped_screen_segments(self, H):
+    # H holds screen-homogeneous end points of line segments in pairs.
+    # Segments lying wholly outside one plane of the view frustum are
+    # dropped, the rest are clipped against the near plane and the
+    # screen positions of their ends are returned in pairs.
+    if len(H) == 0:
+      return np.empty((0, 2))
+    D = H @ self.screen_planes
+    inside = np.minimum(D[0::2], D[1::2]) <= 0.0
+    keep = np.flatnonzero(np.logical_and.reduce(inside, axis=1))
+    A = H[0::2][keep]
+    B = H[1::2][keep]
+    a = A[:, 3]
+    b = B[:, 3]
+    ix = np.flatnonzero((a < 0.0) | (b < 0.0))
+    if len(ix) > 0:
+      a = a[ix]
+      b = b[ix]
+      t = (a / (a - b)).reshape((len(ix), 1))
+      C = A[ix] + (B[ix] - A[ix]) * t
+      a_visible = a >= 0.0
+      B[ix[a_visible]] = C[a_visible]
+      A[ix[~a_visible]] = C[~a_visible]
+    # The perspective divide, straight into the output
+    S = np.empty((2 * len(keep), 2))
+    np.divide(A[:, :2], A[:, 2:3], out=S[0::2])
+    np.divide(B[:, :2], B[:, 2:3], out=S[1::2])
+    return S
+
+
+class LineBatch (object):
+
+  # Collects the screen-space line segments of a frame so that they
+  # reach the backend in as few calls as possible. A LineBatch may be
+  # passed to the 3D drawing functions in place of a surface.
+  # Consecutive segments of the same colour and width are merged, so
+  # that everything is still drawn in the order it was submitted, and
+  # segments which join end to end are drawn as single pg.draw.lines()
+  # runs.
+
+  def __init__(self, surface):
+    self.surface = surface
+    self.batches = []
+
+  def add(self, col, lw, S):
+    if len(S) > 0:
+      if isinstance(col, pg.Color):
+        col = tuple(col)
+      if self.batches and self.batches[-1][0] == (col, lw):
+        self.batches[-1][1].append(S)
       else:
-        if a <= 0:
-          V.append(A)
-          V.append(B)
-    return V
+        self.batches.append(((col, lw), [S]))
+
+  def flush(self):
+    for (col, lw), parts in self.batches:
+      self.draw_runs(col, lw, np.concatenate(parts))
+    self.batches.clear()
+
+  def draw_runs(self, col, lw, S):
+    joined = np.all(S[1:-1:2] == S[2::2], axis=1)
+    breaks = (np.flatnonzero(~joined) + 1).tolist()
+    points = S.tolist()
+    for i, j in zip([0] + breaks, breaks + [len(points) // 2]):
+      if j - i == 1:
+        pg.draw.line(self.surface, col, points[2 * i], points[2 * i + 1], lw)
+      else:
+        run = points[2 * i : 2 * i + 1] + points[2 * i + 1 : 2 * j : 2]
+        pg.draw.lines(self.surface, col, False, run, lw)
+
+
+def draw_segments(surface, col, lw, S):
+  # S holds the screen positions of line segment end points in pairs.
+  if isinstance(surface, LineBatch):
+    surface.add(col, lw, S)
+  else:
+    batch = LineBatch(surface)
+    batch.add(col, lw, S)
+    batch.flush()
 
 
 def draw_wfo(surface, view, mvm, wfo, styles=None):
   bpc, vertices, groups = wfo
+  if view.is_culled(bpc, mvm.matrix):
+    return
   group = groups[0]
   style, runs = group
-  pe = view.project_to_eye_space(vertices, mvm.matrix)
+  H = view.project_to_screen_hom(vertices, mvm.matrix)
   col = 0x0099ff
   lw = 1
   if styles is not None:
@@ -1195,53 +1496,223 @@ def draw_wfo(surface, view, mvm, wfo, styles=None):
     gs[:min(len(style), len(gs))] = style
     gcol = col if gs[0] is None else gs[0]
     glw = lw if gs[1] is None else gs[1]
-    C = view.clipped_edge_run_vertices(pe, runs)
-    S = view.project_es_to_screen(C)
-    for i in range(0, len(S), 2):
-      pg.draw.line(surface, gcol, S[i], S[i + 1], width=glw)
+    if isinstance(runs, np.ndarray):
+      ixs = runs
+    else:
+      ixs = edge_runs_to_segment_ixs(runs)
+    S = view.clipped_screen_segments(H[ixs])
+    draw_segments(surface, gcol, glw, S)
+
+
+class GroundGridMesh (object):
+
+  # The static geometry of a square ground grid with 2 * hw + 1 lines
+  # in each direction. The lines parallel to the y axis come first,
+  # then those parallel to the x axis, with their start and end points
+  # interleaved. The vertices are stored in homogeneous coordinates so
+  # that they are ready for the view matrix.
+  #
+  # The lines are grouped into chunks, each a strip of parallel lines,
+  # which are culled before the vertices of their lines are transformed.
+  # A strip is bounded by the end points of its first and last lines.
+
+  def __init__(self, hw, spacing, lines_per_chunk=16):
+    self.hw = hw
+    self.spacing = spacing
+    n = 2 * hw + 1
+    L = np.linspace(-hw * spacing, hw * spacing, n)
+    E = np.full(n, hw * spacing)
+    vertices = np.empty((4 * n, 2))
+    vertices[0 : 2 * n : 2] = np.column_stack([L, -E])
+    vertices[1 : 2 * n : 2] = np.column_stack([L, E])
+    vertices[2 * n :: 2] = np.column_stack([E, L])
+    vertices[2 * n + 1 :: 2] = np.column_stack([-E, L])
+    self.vertices = h4d_points(vertices)
+    first = np.arange(0, n, lines_per_chunk)
+    last = np.minimum(first + lines_per_chunk, n) - 1
+    first = np.concatenate([first, n + first])
+    last = np.concatenate([last, n + last])
+    corner_ixs = np.stack([2 * first, 2 * first + 1, 2 * last, 2 * last + 1])
+    self.chunk_corners = vertices[corner_ixs.T]
+    self.line_chunk_ixs = np.concatenate([
+      np.arange(n) // lines_per_chunk,
+      len(first) // 2 + np.arange(n) // lines_per_chunk,
+    ])
+
+  def visible_segments(self, view, model_view_mtx=None, hole=None,
+                       bounds=None):
+    # Screen positions in pairs of the ends of the visible parts of the
+    # lines.
+    # If hole is given as the lower and upper corners of a rectangle in
+    # the plane of the mesh, the parts of lines within it are omitted.
+    # If bounds is given in the same way, only the parts of lines within
+    # it are kept.
+    visible = ~view.culled_point_sets(self.chunk_corners, model_view_mtx)
+    if not np.any(visible):
+      return np.empty((0, 2))
+    lines = self.vertices.reshape((-1, 2, 4))[visible[self.line_chunk_ixs]]
+    if bounds is not None:
+      lines = clipped_grid_lines(lines, bounds[0], bounds[1])
+    if hole is not None:
+      lines = punched_grid_lines(lines, hole[0], hole[1])
+    H = view.project_to_screen_hom(lines.reshape((-1, 4)), model_view_mtx)
+    return view.clipped_screen_segments(H)
+
+
+def clipped_grid_lines(lines, lo, hi):
+  # lines has the shape (n, 2, 4) and holds the homogeneous end points
+  # of axis-aligned lines on the ground. The lines are cut to the
+  # rectangle with the corners lo and hi and those outside it dropped.
+  P0 = lines[:, 0, :2]
+  P1 = lines[:, 1, :2]
+  # Index of the axis along each line, the other being constant
+  along = (P0[:, 0] == P1[:, 0]).astype(int)
+  across = 1 - along
+  ix = np.arange(len(lines))
+  c = P0[ix, across]
+  a0 = P0[ix, along]
+  a1 = P1[ix, along]
+  lo_a = lo[along]
+  hi_a = hi[along]
+  keep = (
+    (c >= lo[across]) & (c <= hi[across])
+    & (np.maximum(a0, a1) > lo_a) & (np.minimum(a0, a1) < hi_a)
+  )
+  L = np.array(lines[keep])
+  ix = ix[:len(L)]
+  along = along[keep]
+  L[ix, 0, along] = np.clip(a0[keep], lo_a[keep], hi_a[keep])
+  L[ix, 1, along] = np.clip(a1[keep], lo_a[keep], hi_a[keep])
+  return L
+
+
+def punched_grid_lines(lines, lo, hi):
+  # lines has the shape (n, 2, 4) and holds the homogeneous end points
+  # of axis-aligned lines on the ground. Lines which cross the rectangle
+  # with the corners lo and hi are split into the pieces outside it.
+  P0 = lines[:, 0, :2]
+  P1 = lines[:, 1, :2]
+  # Index of the axis along each line, the other being constant
+  along = (P0[:, 0] == P1[:, 0]).astype(int)
+  across = 1 - along
+  ix = np.arange(len(lines))
+  c = P0[ix, across]
+  hit = (c >= lo[across]) & (c <= hi[across])
+  H = lines[hit]
+  if len(H) == 0:
+    return lines
+  ix = ix[:len(H)]
+  along = along[hit]
+  a0 = H[ix, 0, along]
+  a1 = H[ix, 1, along]
+  fwd = a1 > a0
+  # The piece from the start of a line ends at the nearer edge of the
+  # rectangle and the piece to the end starts at the further edge.
+  e1 = np.where(fwd, lo[along], hi[along])
+  s2 = np.where(fwd, hi[along], lo[along])
+  piece1 = np.array(H)
+  piece1[ix, 1, along] = e1
+  piece2 = np.array(H)
+  piece2[ix, 0, along] = s2
+  ok1 = np.where(fwd, e1 > a0, e1 < a0)
+  ok2 = np.where(fwd, a1 > s2, a1 < s2)
+  return np.concatenate([lines[~hit], piece1[ok1], piece2[ok2]])
+
+
+# Half-width (in lines) and spacing of the ground grid for each grid mode
+ground_grid_modes = {
+  1: (10, 1.0),
+  2: (10, 10.0),
+  3: (30, 10.0),
+  4: (100, 10.0),
+  5: (1000, 1.0),
+}
+
+# Grids with more than ground_grid_lod_min_hw lines either side of the
+# centre are drawn as nested square rings under the camera, with the
+# spacing of the lines growing with distance. A ring reaches out to
+# where its lines are ground_grid_lod_px apart on the screen (at right
+# angles to the line of sight). Beyond the last but one ring, the
+# coarsest ring covers the rest of the grid. All rings are clipped to
+# the square of the grid about the vehicle, so the number of lines
+# stays bounded however far the camera is from the vehicle.
+ground_grid_lod_min_hw = 50
+ground_grid_lod_spacings = (1.0, 10.0, 100.0)
+ground_grid_lod_px = 16.0
+
+# The meshes are built once for each half-width and spacing in use.
+ground_grid_meshes = {}
+
+
+def ground_grid_mesh(hw, spacing):
+  mesh = ground_grid_meshes.get((hw, spacing))
+  if mesh is None:
+    mesh = GroundGridMesh(hw, spacing)
+    ground_grid_meshes[(hw, spacing)] = mesh
+  return mesh
+
+
+def ground_grid_lod_rings(view, hw, spacing, centre, lines_per_chunk=16):
+  # The half-width (in lines), spacing and centre of each ring, finest
+  # first, for a grid of hw lines either side of centre. Each ring is
+  # centred under the camera, snapped to the spacing of the next ring
+  # so that it only moves in coarse steps. The half-widths are rounded
+  # up to whole chunks so that only a few distinct meshes are ever
+  # built.
+  if hw <= ground_grid_lod_min_hw:
+    return [(hw, spacing, centre)]
+  extent = hw * spacing
+  spacings = [spacing] + [s for s in ground_grid_lod_spacings if s > spacing]
+  height = abs(view.pos[2])
+  rings = []
+  for s, next_s in zip(spacings[:-1], spacings[1:]):
+    dist = view.focal_length_px * s / ground_grid_lod_px
+    r = np.sqrt(max(0.0, dist * dist - height * height))
+    if r <= 0.0:
+      continue
+    ring_centre = next_s * np.round(view.pos[:2] / next_s)
+    ring_hw = int(np.ceil((r + 0.5 * next_s) / (s * lines_per_chunk)))
+    ring_hw *= lines_per_chunk
+    rings.append((ring_hw, s, ring_centre))
+    if np.all(np.abs(ring_centre - centre) + extent <= ring_hw * s):
+      # This ring covers the whole grid.
+      return rings
+  s = spacings[-1]
+  rings.append((int(np.ceil(extent / s)) + 1, s, s * np.round(centre / s)))
+  return rings
 
 
 def draw_ground_grid(surface, view, mvm, pos=None, grid_mode=None):
   if grid_mode is None: grid_mode = 3
-  if grid_mode == 1:
-    hw = 10
-    spacing = 1.0
-  elif grid_mode == 2:
-    hw = 10
-    spacing = 10.0
-  elif grid_mode == 3:
-    hw = 30
-    spacing = 10.0
-  elif grid_mode == 4:
-    hw = 100
-    spacing = 10.0
-  elif grid_mode == 5:
-    hw = 1000
-    spacing = 1.0
-  else:
+  if grid_mode not in ground_grid_modes:
     return
-  n = 2 * hw + 1
+  hw, spacing = ground_grid_modes[grid_mode]
   inv_spacing = 1.0 / spacing
-  L = np.atleast_2d(np.linspace(-hw * spacing, hw * spacing, n)).T
-  L1 = np.hstack([L, np.full((n, 1), -hw * spacing)])
-  L2 = np.hstack([L, np.full((n, 1), +hw * spacing)])
-  vertices = np.vstack([L1, L2])
-  for axis in range(2):
+  qpos = np.zeros(2)
+  if pos is not None:
+    qpos[0] = spacing * round(inv_spacing * pos[0])
+    qpos[1] = spacing * round(inv_spacing * pos[1])
+  rings = ground_grid_lod_rings(view, hw, spacing, qpos)
+  clip = None
+  if len(rings) > 1:
+    r = hw * spacing
+    clip = (qpos - r, qpos + r)
+  S = []
+  hole = None
+  for ring_hw, spacing, centre in rings:
+    mesh = ground_grid_mesh(ring_hw, spacing)
     mvm.push()
-    if pos is not None:
-      qpos = np.array(pos[:2])
-      qpos[0] = spacing * round(inv_spacing * qpos[0])
-      qpos[1] = spacing * round(inv_spacing * qpos[1])
-      mvm.translate(qpos)
-    if axis == 1:
-      mvm.orient([[0, 1, 0], [-1, 0, 0], [0, 0, 1]])
-    pe = view.project_to_eye_space(vertices, mvm.matrix)
-    runs = [(i, i + n) for i in range(n)]
-    C = view.clipped_edge_run_vertices(pe, runs)
-    S = view.project_es_to_screen(C)
-    for i in range(0, len(S), 2):
-      pg.draw.line(surface, 0x336699, S[i], S[i + 1])
+    mvm.translate(centre)
+    S.append(mesh.visible_segments(
+      view, mvm.matrix,
+      None if hole is None else (hole[0] - centre, hole[1] - centre),
+      None if clip is None else (clip[0] - centre, clip[1] - centre),
+    ))
     mvm.pop()
+    # The next ring leaves out the area covered by this one.
+    r = ring_hw * spacing
+    hole = (centre - r, centre + r)
+  draw_segments(surface, 0x336699, 1, np.concatenate(S))
 
 
 def draw_world_basis_vectors(surface, view, mvm):
@@ -1329,6 +1800,8 @@ def draw_artcar1(surface, view, mvm, auxstates=None, styles=None):
   ldil_styles = di_styles[ldi & 1]
   rdil_styles = di_styles[rdi & 1]
   draw_robomouse_wheels(surface, view, mvm, auxstates)
+  if view.is_culled(bpc_artcar1_body, mvm.matrix):
+    return
   draw_wfo(surface, view, mvm, wfo_artcar1_body, styles)
   draw_wfo(surface, view, mvm, wfo_artcar1_headlamps, hl_styles)
   draw_wfo(surface, view, mvm, wfo_artcar1_stop_lamps, sl_styles)
@@ -1354,6 +1827,8 @@ def draw_sinclair_c5000(surface, view, mvm, auxstates=None, styles=None):
   ldil_styles = di_styles[ldi & 1]
   rdil_styles = di_styles[rdi & 1]
   draw_robomouse_wheels(surface, view, mvm, auxstates)
+  if view.is_culled(bpc_sc5k_body, mvm.matrix):
+    return
   draw_wfo(surface, view, mvm, wfo_sc5k_body, styles)
   draw_wfo(surface, view, mvm, wfo_sc5k_stop_lamps, sl_styles)
   draw_wfo(surface, view, mvm, wfo_sc5k_reversing_lamps, rl_styles)
@@ -1361,192 +1836,6 @@ def draw_sinclair_c5000(surface, view, mvm, auxstates=None, styles=None):
   draw_wfo(surface, view, mvm, wfo_sc5k_right_di_lamps, rdil_styles)
 
 
-class QPosCtrl (object):
-
-  def __init__(self):
-    self.x = 0.0
-    self.v = 0.0
-    self.target_x = 0.0
-    self.max_fwd_v = 1e6
-    self.max_rev_v = 1e6
-    self.max_a = 1e6
-    self.integral = 0.0
-
-  def advance(self, delta_time):
-
-    # There are five segments of the piecewise quadratic kinematic function:
-    #
-    # Rein - Correct any overspeeding
-    # Turn - Quadratic (required to correct overshoot)
-    # Lurch - Quadratic (may be projected to have a past starting point)
-    # Cruise - Linear
-    # Brake - Quadratic
-    #
-    # A dummy "Rest" piece is appended to maintain consistent execution time.
-    #
-    # Each function curve piece is defined by a tuple of four values:
-    #   * Time (relative to "now") at the beginning of the curve;
-    #   * position (x) at the beginning of the curve;
-    #   * velocity, the derivative of x, at the beginning of the curve and
-    #   * acceleration, the second derivative of x. for the curve.
-    #
-    # In general, x(t) = x0 + v0 * (t - t0) + 0.5 * a * (t - t0)**2
-
-    rein = np.zeros([4])
-    turn = np.zeros([4])
-    lurch = np.zeros([4])
-    cruise = np.zeros([4])
-    brake = np.zeros([4])
-    rest = np.zeros([4])
-
-    TIME = 0
-    POS = 1
-    VEL = 2
-    ACC = 3
-
-    accel = np.copysign(self.max_a, self.v)
-    decel = -accel
-
-    # Rein in the current velocity if it is
-    # larger than the maximum velocity.
-    dv_rein = 0.0
-    if self.v > self.max_fwd_v:
-      dv_rein = self.max_fwd_v - self.v
-    elif self.v < -self.max_rev_v:
-      dv_rein = -self.max_rev_v - self.v
-    dt_rein = abs(dv_rein) / self.max_a
-    dx_rein = (self.v + 0.5 * decel * dt_rein) * dt_rein
-    rein[TIME] = 0.0
-    rein[POS] = self.x
-    rein[VEL] = self.v
-    rein[ACC] = decel
-    turn[TIME] = rein[TIME] + dt_rein
-    turn[POS] = rein[POS] + dx_rein
-    turn[VEL] = rein[VEL] + dv_rein
-    turn[ACC] = decel
-
-    # Now that any overspeeding has been corrected, consider
-    # (turn[TIME], turn[POS], turn[VEL]) to be the initial state.
-
-    # Find the minimum stopping time and the displacement
-    # at that time if full deceleration were applied.
-    dt_msd = abs(turn[VEL]) / self.max_a
-    dx_msd = dt_msd * (turn[VEL] + 0.5 * dt_msd * decel)
-    t_at_msd = turn[TIME] + dt_msd
-    x_at_msd = turn[POS] + dx_msd
-
-    HeadingWrongWay = (self.target_x < turn[POS]) != (turn[VEL] < 0)
-    WillOvershootAnyway = (self.target_x < x_at_msd) != (dx_msd < 0.0)
-
-    if HeadingWrongWay or WillOvershootAnyway:
-      # Decelerate to a stop and prepare to lurch
-      # in the other direction.
-      lurch[TIME] = turn[TIME] + dt_msd
-      lurch[POS] = turn[POS] + dx_msd
-      lurch[VEL] = 0.0
-      # The back-projected time of initial rest for the
-      # lurch is the same as for the beginning of the
-      # lurch segment.
-      t_bplurch = lurch[TIME]
-      x_bplurch = lurch[POS]
-    else:
-      # No turning is necessary.
-      # Proceed to lurch (or lurch even more).
-      lurch[TIME] = turn[TIME]
-      lurch[POS] = turn[POS]
-      lurch[VEL] = turn[VEL]
-      t_bplurch = lurch[TIME] - dt_msd
-      x_bplurch = lurch[POS] - dx_msd
-
-    # From here on, the position is a monotonic function.
-    # It is convenient to pretend that it is constant
-    # or monotonically increasing.
-    dx = self.target_x - x_bplurch
-    adx = abs(dx)
-    accel = np.copysign(self.max_a, dx)
-    decel = -accel
-    max_v = self.max_rev_v if dx <= 0.0 else self.max_fwd_v
-    max_dx_for_triangular_v = (max_v * max_v) / self.max_a
-
-    if adx <= max_dx_for_triangular_v:
-      # Maximum speed not required
-      dt_vramp = np.sqrt(adx / self.max_a)
-      dx_for_triangular_v = adx
-      lsd = 0.0
-      lst = 0.0
-      inflection_v = self.max_a * dt_vramp
-    else:
-      # Linear segment where maximum speed is sustained
-      dt_vramp = max_v / self.max_a
-      dx_for_triangular_v = max_dx_for_triangular_v
-      lsd = adx - max_dx_for_triangular_v
-      lst = lsd / max(1e-12, max_v)
-      inflection_v = max_v
-
-    # Acceleration
-    lurch[ACC] = accel
-
-    # Linear segment
-    cruise[TIME] = t_bplurch + dt_vramp
-    cruise[POS] = x_bplurch + 0.5 * np.copysign(dx_for_triangular_v, dx)
-    cruise[VEL] = brake[VEL] = np.copysign(inflection_v, dx)
-    cruise[ACC] = 0.0
-
-    # Deceleration
-    brake[TIME] = cruise[TIME] + lst
-    brake[POS] = cruise[POS] + np.copysign(lsd, dx)
-    brake[ACC] = decel
-
-    # Rest
-    rest[TIME] = brake[TIME] + dt_vramp
-    rest[POS] = self.target_x
-    rest[VEL] = 0.0
-    rest[ACC] = 0.0
-
-    qkfs = (rein, turn, lurch, cruise, brake, rest)
-
-    # Evaluate the piecewise quadratic function at t = dt.
-    if delta_time < lurch[TIME]:
-      if delta_time < turn[TIME]:
-        qkf_ix = 0  # rein
-      else:
-        qkf_ix = 1  # turn
-    elif delta_time < brake[TIME]:
-      if delta_time < cruise[TIME]:
-        qkf_ix = 2  # lurch
-      else:
-        qkf_ix = 3  # cruise
-    else:
-      if delta_time < rest[TIME]:
-        qkf_ix = 4  # brake
-      else:
-        qkf_ix = 5  # rest
-
-    # Bonus feature: x is integrated.
-    for i in range(0, qkf_ix + 1):
-      t1 = qkfs[i + 1][TIME] if i + 1 < len(qkfs) else t0 + delta_time
-      if t1 >= 0.0:
-        qkf = qkfs[i]
-        t0 = qkf[TIME]
-        x0 = qkf[POS]
-        v0 = qkf[VEL]
-        a = qkf[ACC]
-        if t0 < 0:
-          x0 += (0.5 * a * t0 - v0) * t0
-          v0 -= a * t0
-        sdt = min(delta_time, t1) - t0
-        self.integral += sdt * (x0 + sdt * (0.5 * v0 + sdt * (1.0/6.0) * a))
-
-    qkf = qkfs[qkf_ix]
-
-    t = delta_time - qkf[TIME]
-    # Horner's method avoids raising small numbers to high powers
-    # and halves the number of multiplications needed to evaluate
-    # a polynomial.
-    self.x = qkf[POS] + t * (qkf[VEL] + 0.5 * t * qkf[ACC])
-    self.v = qkf[VEL] + t * qkf[ACC]
-
-
 class MotorAccLimits (object):
 
   def __init__(self, accel, jerk):
@@ -1680,9 +1969,45 @@ class WheelState (object):
     self.angle = 0.0
     self.linspeed = 0.0
     self.ls_integral = 0.0
+    # Optionally, the planned linear speed over the step (a QTrajectory,
+    # scaled by ls_plan_factor), which replaces ls_integral.
+    self.ls_plan = None
+    self.ls_plan_factor = 1.0
     self.twist = 0.0   # Scrubbing from -1..0..+1
 
 
+def arc_step(xy, hdg, ld, rd, axle_width):
+  # Move a traction centre at xy with the heading hdg along a circular
+  # arc for the wheel displacements ld and rd. Returns the new position
+  # and heading and the radius of the turn (to the left), which is None
+  # for very straight motion.
+  a = 0.5 * (rd + ld)
+  b = (rd - ld)
+  r = None
+  if abs(b) > 1e-6:
+    r = axle_width * a / b
+    if abs(r) > 1e-6:
+      # Normal turn
+      beta = a / r
+      dx = r * math.sin(beta)
+      dy = r * (1.0 - math.cos(beta))
+    else:
+      # Turning on the spot
+      r = 0.0
+      dx = 0.0
+      dy = 0.0
+      beta = b / axle_width
+  else:
+    # Very straight
+    beta = b / axle_width
+    dx = a
+    dy = 0.0
+  c = math.cos(hdg)
+  s = math.sin(hdg)
+  xy = (xy[0] + dx * c - dy * s, xy[1] + dx * s + dy * c)
+  return xy, hdg + beta, r
+
+
 class RoboMouse (object):
 
   def __init__(self):
@@ -1701,9 +2026,13 @@ class RoboMouse (object):
     self.instr_accel = np.zeros(3)
     self.instr_omega = 0.0
     self.instr_last_vel = np.zeros(3)
+    self.instr_step_error = 0.0  # Estimated position error, m
+    self.max_step_error = 1e-4  # m, for steps with wheel plans
+    self.max_arc_depth = 8
     self.stop_lamp_lit = False
     self.draw_fn = draw_sinclair_c5000
     self.draw_fn_styles = None
+    self.scene_node = SceneNode()
 
   def plonk(self, pos, heading):
     if heading is not None:
@@ -1726,39 +2055,49 @@ class RoboMouse (object):
     for ws in (self.lw_state, self.rw_state):
       ws.angle += delta_time * ws.linspeed / ws.radius
       ws.angle %= (2.0 * np.pi)
-    #ld = self.lw_state.linspeed * delta_time
-    #rd = self.rw_state.linspeed * delta_time
-    ld = self.lw_state.ls_integral
-    rd = self.rw_state.ls_integral
-    a = 0.5 * (rd + ld)
-    b = (rd - ld)
-    r = None
-    if abs(b) > 1e-6:
-      r = self.axle_width * a / b
-      if abs(r) > 1e-6:
-        # Normal turn
-        beta = a / r
-        dx = r * np.sin(beta)
-        dy = r * (np.cos(beta) - 1.0)
-      else:
-        # Turning on the spot
-        r = 0.0
-        dx = 0.0
-        dy = 0.0
-        beta = b / self.axle_width
-    else:
-      # Very straight
-      beta = b / self.axle_width
-      dx = a
-      dy = 0.0
+    lws = self.lw_state
+    rws = self.rw_state
     tc = self.pos + self.traction_offset @ self.ori
-    tc += dx * self.ori[0] + dy * self.ori[1]
-    hdg = np.arctan2(self.ori[0][1], self.ori[0][0])
-    hdg += beta
-    self.ori[0] = [np.cos(hdg), np.sin(hdg), 0.0]
-    self.ori[2] = [0.0, 0.0, 1.0]
-    self.ori[0] / la.norm(self.ori[0])
-    self.ori[1] = np.cross(self.ori[2], self.ori[0])
+    hdg = math.atan2(self.ori[0][1], self.ori[0][0])
+    if lws.ls_plan is None or rws.ls_plan is None:
+      # One arc for the whole step. Its error is estimated against two
+      # arcs as in exact_arcs(), with the wheel travels at the middle
+      # of the step taken from the speeds at its start and constant
+      # accelerations. Here the single arc is kept, which has four
+      # times the error of the two.
+      aw = self.axle_width
+      l1 = lws.ls_integral
+      r1 = rws.ls_integral
+      lm = 0.25 * (l1 + delta_time * lws.linspeed)
+      rm = 0.25 * (r1 + delta_time * rws.linspeed)
+      xym, hdgm, r = arc_step(tc, hdg, lm, rm, aw)
+      xy2, hdg2, r = arc_step(xym, hdgm, l1 - lm, r1 - rm, aw)
+      xy, hdg, r = arc_step(tc, hdg, l1, r1, aw)
+      self.instr_step_error = math.hypot(
+        xy2[0] - xy[0], xy2[1] - xy[1]
+      ) * (4.0 / 3.0)
+    else:
+      # One or more arcs for each interval in which neither wheel
+      # changes its piece of the plan
+      T = np.concatenate(([0.0, delta_time], lws.ls_plan.t, rws.ls_plan.t))
+      T = np.unique(np.clip(T, 0.0, delta_time))
+      L = lws.ls_plan_factor * lws.ls_plan.integral(T)
+      R = rws.ls_plan_factor * rws.ls_plan.integral(T)
+      xy = tc
+      self.instr_step_error = 0.0
+      for i in range(len(T) - 1):
+        xy, hdg, r, err = self.exact_arcs(
+          xy, hdg, (T[i], L[i], R[i]), (T[i + 1], L[i + 1], R[i + 1])
+        )
+        self.instr_step_error += err
+    tc[:2] = xy
+    c = math.cos(hdg)
+    s = math.sin(hdg)
+    self.ori[:] = [
+      [c, s, 0.0],
+      [-s, c, 0.0],
+      [0.0, 0.0, 1.0],
+    ]
     self.pos = tc - self.traction_offset @ self.ori
     self.instr_lat_accel = np.zeros(3)
     self.instr_omega = 0.0
@@ -1769,10 +2108,38 @@ class RoboMouse (object):
       self.instr_omega = diff_speed / self.axle_width
       self.instr_lat_accel = (self.instr_omega ** 2) * r_vect
 
-  def draw(self, screen, view, mvm, aux_overrides=None):
+  def exact_arcs(self, xy, hdg, start, end, depth=0):
+    # start and end are the times and wheel travels (t, l, r) of an
+    # interval within a single piece of each wheel plan. The curvature
+    # varies smoothly within it, so the error of a single arc is
+    # estimated by comparing it with two arcs split at the middle. The
+    # halves are integrated in the same way until the estimate falls
+    # below max_step_error. Returns the new position, heading, turn
+    # radius and the estimated error of the position.
+    t0, l0, r0 = start
+    t1, l1, r1 = end
+    aw = self.axle_width
+    tm = 0.5 * (t0 + t1)
+    lm = self.lw_state.ls_plan_factor * self.lw_state.ls_plan.integral(tm)
+    rm = self.rw_state.ls_plan_factor * self.rw_state.ls_plan.integral(tm)
+    xy1, hdg1, r = arc_step(xy, hdg, l1 - l0, r1 - r0, aw)
+    xym, hdgm, r = arc_step(xy, hdg, lm - l0, rm - r0, aw)
+    xy2, hdg2, r = arc_step(xym, hdgm, l1 - lm, r1 - rm, aw)
+    # The error of one arc falls with the cube of its length, so two
+    # arcs have a quarter of the error of one.
+    err = math.hypot(xy2[0] - xy1[0], xy2[1] - xy1[1]) / 3.0
+    if err > self.max_step_error and depth < self.max_arc_depth:
+      mid = (tm, lm, rm)
+      xym, hdgm, r, err0 = self.exact_arcs(xy, hdg, start, mid, depth + 1)
+      xy2, hdg2, r, err1 = self.exact_arcs(xym, hdgm, mid, end, depth + 1)
+      err = err0 + err1
+    return xy2, hdg2, r, err
+
+  def draw(self, screen, view, mvm, aux_overrides=None, pose=None):
+    pos, ori = (self.pos, self.ori) if pose is None else pose
+    self.scene_node.set_pose(pos, ori)
     mvm.push()
-    mvm.translate(self.pos)
-    mvm.orient(self.ori)
+    mvm.transform(self.scene_node.matrix)
     speed = 0.5 * (self.rw_state.linspeed + self.lw_state.linspeed)
     aux = dict()
     aux['lwa'] = self.lw_state.angle
@@ -1794,6 +2161,194 @@ class RoboMouse (object):
     mvm.pop()
 
 
+# Cars of a fleet shorter than this on the screen are drawn as boxes.
+fleet_lod_px = 40.0
+
+
+def vehicle_bpc(props):
+  # A bounding point cloud of a vehicle, body and wheels, in the frame
+  # of its RoboMouse
+  body_bpcs = {
+    draw_artcar1: bpc_artcar1_body,
+    draw_sinclair_c5000: bpc_sc5k_body,
+  }
+  wr = props['wheel_radius']
+  hw = 0.5 * props['axle_width']
+  P = [props['traction_offset'] + np.array([
+    [-wr, -hw, 0.0],
+    [wr, hw, 2.0 * wr],
+  ])]
+  body_bpc = body_bpcs.get(props['draw_fn'])
+  if body_bpc is not None:
+    P.append(body_bpc)
+  return bounding_box_points(np.vstack(P))
+
+
+class RoboMouseFleet (object):
+
+  # Many RoboMice of one kind with their states held in arrays of one
+  # element per car, so that a convoy of hundreds is advanced by a few
+  # array operations per frame. The cars drive their wheels at the
+  # speeds in lw_speed and rw_speed, which follow() sets so that each
+  # car pursues the one ahead of it.
+
+  def __init__(self, num_cars, props):
+    n = num_cars
+    self.pos = np.zeros((n, 3))
+    self.hdg = np.zeros(n)
+    self.axle_width = np.full(n, float(props['axle_width']))
+    self.wheel_radius = props['wheel_radius']
+    self.traction_offset = np.array(props['traction_offset'], dtype=float)
+    self.lw_speed = np.zeros(n)
+    self.rw_speed = np.zeros(n)
+    self.lw_angle = np.zeros(n)
+    self.rw_angle = np.zeros(n)
+    self.stop_lamp_lit = np.zeros(n, dtype=bool)
+    self.max_speed = props['max_wheel_speed']
+    self.max_accel = props['cruise_mal'].max_fwd_accel
+    self.max_decel = props['braking_mal'].max_fwd_decel
+    self.max_turn_rate = props['max_turn_rate']
+    self.pursuit_gain = 0.5  # Speed per metre of excess gap, 1/s
+    self.bpc = vehicle_bpc(props)
+    self.length = np.ptp(self.bpc[:, 0])
+    self.gap = self.length + 2.0
+    # The edges of the bounding box join corners which differ in one
+    # coordinate only.
+    B = self.bpc
+    one_diff = np.count_nonzero(B[:, np.newaxis] != B[np.newaxis], axis=2)
+    i, j = np.nonzero(np.triu(one_diff == 1))
+    self.box_segment_vertices = B[np.stack([i, j], axis=1).ravel()]
+    # All of the cars are drawn by this one.
+    self.car = RoboMouse()
+    self.car.draw_fn = props['draw_fn']
+    self.car.draw_fn_styles = props['draw_fn_styles']
+    self.car.traction_offset = self.traction_offset
+    self.car.axle_width = props['axle_width']
+    self.car.lw_state.radius = self.car.rw_state.radius = self.wheel_radius
+    self.car.lw_state.width = props['wheel_width']
+    self.car.rw_state.width = props['wheel_width']
+
+  def line_up(self, pos, heading, gap=None):
+    # Single file behind pos, at rest and facing along heading
+    if gap is None:
+      gap = self.gap
+    d = gap * np.arange(1, len(self.hdg) + 1)
+    self.hdg[:] = heading
+    self.pos[:, 0] = pos[0] - d * np.cos(heading)
+    self.pos[:, 1] = pos[1] - d * np.sin(heading)
+    self.pos[:, 2] = -self.traction_offset[2]
+    self.lw_speed[:] = 0.0
+    self.rw_speed[:] = 0.0
+
+  def ori(self, i):
+    c = np.cos(self.hdg[i])
+    s = np.sin(self.hdg[i])
+    return np.array([
+      [c, s, 0.0],
+      [-s, c, 0.0],
+      [0.0, 0.0, 1.0],
+    ])
+
+  def follow(self, leader_pos, delta_time):
+    # Pure pursuit: Each car steers along the arc through the car ahead
+    # of it, the first car through leader_pos, and slows down as it
+    # closes up to the gap. A car which has overtaken its target turns
+    # on the spot to face it again.
+    targets = np.empty((len(self.hdg), 2))
+    targets[0] = leader_pos[:2]
+    targets[1:] = self.pos[:-1, :2]
+    d = targets - self.pos[:, :2]
+    c = np.cos(self.hdg)
+    s = np.sin(self.hdg)
+    ahead = d[:, 0] * c + d[:, 1] * s
+    left = d[:, 1] * c - d[:, 0] * s
+    dist = np.hypot(ahead, left)
+    target_speed = np.clip(
+      self.pursuit_gain * (dist - self.gap), 0.0, self.max_speed
+    )
+    target_speed *= np.clip(ahead / np.maximum(dist, 1e-6), 0.0, 1.0)
+    speed = 0.5 * (self.lw_speed + self.rw_speed)
+    new_speed = np.clip(
+      target_speed,
+      speed - self.max_decel * delta_time,
+      speed + self.max_accel * delta_time,
+    )
+    self.stop_lamp_lit = new_speed < speed - 0.1 * self.max_decel * delta_time
+    curvature = 2.0 * left / np.maximum(dist ** 2, 1e-6)
+    omega = np.where(
+      ahead > 0.0,
+      new_speed * curvature,
+      np.copysign(self.max_turn_rate, left),
+    )
+    omega = np.clip(omega, -self.max_turn_rate, self.max_turn_rate)
+    half_diff_speed = 0.5 * omega * self.axle_width
+    self.lw_speed = new_speed - half_diff_speed
+    self.rw_speed = new_speed + half_diff_speed
+
+  def advance(self, delta_time):
+    # The same arcs as RoboMouse.advance() for wheel speeds which are
+    # constant over the step, for all cars at once
+    ld = self.lw_speed * delta_time
+    rd = self.rw_speed * delta_time
+    self.lw_angle = (self.lw_angle + ld / self.wheel_radius) % (2.0 * np.pi)
+    self.rw_angle = (self.rw_angle + rd / self.wheel_radius) % (2.0 * np.pi)
+    a = 0.5 * (rd + ld)
+    b = rd - ld
+    beta = b / self.axle_width
+    straight = np.abs(b) <= 1e-6
+    r = self.axle_width * a / np.where(straight, 1.0, b)
+    # Normal turns, as opposed to very straight runs and turns on the
+    # spot, which do not move the traction centre sideways
+    turning = ~straight & (np.abs(r) > 1e-6)
+    dx = np.where(turning, r * np.sin(beta), np.where(straight, a, 0.0))
+    dy = np.where(turning, r * (1.0 - np.cos(beta)), 0.0)
+    ox, oy = self.traction_offset[:2]
+    c = np.cos(self.hdg)
+    s = np.sin(self.hdg)
+    tx = self.pos[:, 0] + (ox + dx) * c - (oy + dy) * s
+    ty = self.pos[:, 1] + (ox + dx) * s + (oy + dy) * c
+    self.hdg = (self.hdg + beta + np.pi) % (2.0 * np.pi) - np.pi
+    c = np.cos(self.hdg)
+    s = np.sin(self.hdg)
+    self.pos[:, 0] = tx - ox * c + oy * s
+    self.pos[:, 1] = ty - ox * s - oy * c
+
+  def world_points(self, ixs, points):
+    # The points, given in the frame of a car, for each of the cars
+    c = np.cos(self.hdg[ixs])[:, np.newaxis]
+    s = np.sin(self.hdg[ixs])[:, np.newaxis]
+    x, y, z = np.asanyarray(points).T
+    pos = self.pos[ixs]
+    P = np.empty((len(pos), len(x), 3))
+    P[:, :, 0] = pos[:, 0:1] + c * x - s * y
+    P[:, :, 1] = pos[:, 1:2] + s * x + c * y
+    P[:, :, 2] = pos[:, 2:3] + z
+    return P
+
+  def draw(self, screen, view, mvm):
+    # Cars wholly outside the view frustum are culled together by their
+    # bounding point clouds in world space. Distant cars are drawn as
+    # their bounding boxes, all in one batch.
+    ixs = np.arange(len(self.hdg))
+    culled = view.culled_point_sets(self.world_points(ixs, self.bpc),
+                                    mvm.matrix)
+    ixs = ixs[~culled]
+    dist = la.norm(self.pos[ixs] - view.pos, axis=1)
+    is_far = view.focal_length_px * self.length < fleet_lod_px * dist
+    far_ixs = ixs[is_far]
+    if len(far_ixs) > 0:
+      P = self.world_points(far_ixs, self.box_segment_vertices)
+      H = view.project_to_screen_hom(P.reshape((-1, 3)), mvm.matrix)
+      S = view.clipped_screen_segments(H)
+      draw_segments(screen, self.car.draw_fn_styles[0], 1, S)
+    for i in ixs[~is_far]:
+      aux = dict()
+      aux['lwa'] = self.lw_angle[i]
+      aux['rwa'] = self.rw_angle[i]
+      aux['stop'] = bool(self.stop_lamp_lit[i])
+      self.car.draw(screen, view, mvm, aux, (self.pos[i], self.ori(i)))
+
+
 def draw_digit_7seg(surface, stdrect, col, ch, skew=None, segwidth=1):
   if skew is None: skew = 0.17632698  # tan(10 degrees)
   M = np.array([
@@ -2346,29 +2901,34 @@ def draw_battery(surface, dest_rect, level):
     draw_rect(R, rot270, level_col)
 
 
-def eval_bezier(C, t):
-  while len(C) > 1:
-    A = C[:-1]
-    B = C[1:]
-    C = (A + np.subtract(B, A) * t)
-  return C[0]
+PORTAL_THICKNESS = 0.3
 
 
-def draw_portal(surface, view, mvm, radius=1.5, styles=None):
+@lru_cache(maxsize=16)
+def portal_bpc(radius):
+  # The outer arcs have a radius of 1.3 * radius and stand on the ground.
+  centre_z = radius * np.cos(4.0 / 6.0 * np.pi)
+  return bounding_box_points(np.array([
+    (-0.5 * PORTAL_THICKNESS, -1.3 * radius, 0.0),
+    (0.5 * PORTAL_THICKNESS, 1.3 * radius, 1.3 * radius - centre_z),
+  ]))
 
-  dist = la.norm(mvm.matrix[3, :3] - view.pos)
-  num_subdivs = int(round(max(5, min(20, 200 * radius / dist))))
-  thickness = 0.3
+
+@lru_cache(maxsize=256)
+def portal_segment_vertices(radius, num_subdivs):
+  # Homogeneous end points in pairs of the line segments of the four
+  # arcs of a portal, which are projected and clipped together. The
+  # result is shared between callers and so is made read-only.
+  thickness = PORTAL_THICKNESS
   main_half_sweep = 4.0 / 6.0 * np.pi
   centre_z = radius * np.cos(main_half_sweep)
-  mvm.push()
-  mvm.translate((0.0, 0.0, -centre_z))
   arc_adjs = (
     (1.0, -0.5 * thickness),
     (1.0, 0.5 * thickness),
     (1.3, -0.5 * thickness),
     (1.3, 0.5 * thickness),
   )
+  arcs = []
   for rf, x in arc_adjs:
     r = rf * radius
     half_sweep = np.pi - np.arccos(-centre_z / r)
@@ -2387,29 +2947,174 @@ def draw_portal(surface, view, mvm, radius=1.5, styles=None):
     w = np.atleast_2d(rat_curve[:, 3]).T
     homo_rat_curve = np.array(rat_curve)
     homo_rat_curve[:, :3] *= w
+    num_samples = max(1, 1 + num_subdivs//2)
     if num_subdivs & 1:
       top_vertex = np.empty((0, 4))
-      ls = np.linspace(0.0, 1.0 - 1 / num_subdivs, endpoint=True,
-          num=max(1, 1 + num_subdivs//2))
+      vertices1 = eval_bezier_linspace(homo_rat_curve, num_samples,
+          stop=1.0 - 1 / num_subdivs, endpoint=True)
     else:
       top_vertex = np.array([x, 0.0, r, 1.0])
-      ls = np.linspace(0.0, 1.0, endpoint=False,
-          num=max(1, 1 + num_subdivs//2))
-    vertices1 = np.array([eval_bezier(homo_rat_curve, t) for t in ls])
+      vertices1 = eval_bezier_linspace(homo_rat_curve, num_samples,
+          stop=1.0, endpoint=False)
     vertices2 = np.flip(vertices1 @ np.diag((1, -1, 1, 1)), (0,))
     vertices = np.vstack((vertices1, top_vertex, vertices2))
-    col = 0xFFAA00
-    lw = 1
-    if styles is not None:
-      if styles[0] is not None: col = styles[0]
-      if styles[1] is not None: lw = styles[1]
-    pe = view.project_to_eye_space(vertices, mvm.matrix)
-    edge_run = tuple(range(len(pe)))
-    C = view.clipped_edge_run_vertices(pe, [edge_run])
-    S = view.project_es_to_screen(C)
-    for i in range(0, len(S), 2):
-      pg.draw.line(surface, col, S[i], S[i + 1], width=lw)
-  mvm.pop()
+    arcs.append(np.stack([vertices[:-1], vertices[1:]], axis=1))
+  segment_vertices = np.vstack(arcs).reshape((-1, 4))
+  # Lift the portal so that its feet are on the ground.
+  segment_vertices[:, 2] -= centre_z * segment_vertices[:, 3]
+  segment_vertices.flags.writeable = False
+  return segment_vertices
+
+
+def portal_num_subdivs(radius, dist):
+  return int(round(max(5, min(20, 200 * radius / dist))))
+
+
+def portal_styles(styles):
+  col = 0xFFAA00
+  lw = 1
+  if styles is not None:
+    if styles[0] is not None: col = styles[0]
+    if styles[1] is not None: lw = styles[1]
+  return (col, lw)
+
+
+class SceneNode (object):
+
+  # An object placed in the world by its model-to-world matrix, which
+  # is only recomputed when the pose of the node changes. A node with
+  # a bounding point cloud (in model space) also keeps it in world
+  # space for culling without the modelview stack.
+
+  def __init__(self, pos=None, ori=None, bpc=None):
+    self.pos = None
+    self.ori = None
+    self.matrix = np.eye(4)
+    self.bpc = bpc
+    self.world_bpc = bpc
+    self.set_pose(np.zeros(3) if pos is None else pos,
+                  np.eye(3) if ori is None else ori)
+
+  def set_pose(self, pos, ori):
+    pos = np.pad(pos, (0, 3 - len(pos)))
+    if (self.pos is not None and np.array_equal(pos, self.pos)
+        and np.array_equal(ori, self.ori)):
+      return False
+    self.pos = np.array(pos)
+    self.ori = np.array(ori)
+    self.matrix = mtx4d_from_bvt(self.ori, self.pos)
+    if self.bpc is not None:
+      self.world_bpc = (h4d_points(self.bpc) @ self.matrix)[:, :3]
+    return True
+
+
+class PortalNode (SceneNode):
+
+  # A static portal whose arcs are kept in world space for each level
+  # of detail in use, so that drawing it needs no matrix work of its
+  # own.
+
+  def __init__(self, pos, naut_hdg, radius, styles=None):
+    a = np.radians(90 - naut_hdg)
+    c = np.cos(a)
+    s = np.sin(a)
+    ori = np.array([
+      [c, s, 0.0],
+      [-s, c, 0.0],
+      [0.0, 0.0, 1.0],
+    ])
+    SceneNode.__init__(self, pos, ori, portal_bpc(radius))
+    self.radius = radius
+    self.styles = portal_styles(styles)
+    self.world_segment_vertices = dict()
+
+  def segment_vertices(self, num_subdivs):
+    V = self.world_segment_vertices.get(num_subdivs)
+    if V is None:
+      V = portal_segment_vertices(self.radius, num_subdivs) @ self.matrix
+      V.flags.writeable = False
+      self.world_segment_vertices[num_subdivs] = V
+    return V
+
+
+class SceneGraph (object):
+
+  # The static props of the playground, pre-transformed to world space.
+  # The visible props of each style are gathered into one array which
+  # takes a single view transformation per frame.
+
+  def __init__(self):
+    self.portals = []
+    self.portal_bpcs = np.empty((0, 8, 3))
+    self.portal_positions = np.empty((0, 3))
+
+  def add_portal(self, node):
+    self.portals.append(node)
+    self.portal_bpcs = np.array([P.world_bpc for P in self.portals])
+    self.portal_positions = np.array([P.pos for P in self.portals])
+
+  def draw_portals(self, surface, view, num_portals=None):
+    n = len(self.portals) if num_portals is None else num_portals
+    if n <= 0:
+      return
+    visible = ~view.culled_point_sets(self.portal_bpcs[:n])
+    ixs = np.flatnonzero(visible)
+    dists = la.norm(self.portal_positions[ixs] - view.pos, axis=1)
+    # Keep the portals in order, merging only consecutive runs of the
+    # same style into one batch so that overlaps are drawn as before.
+    runs = []
+    for i, dist in zip(ixs, dists):
+      P = self.portals[i]
+      num_subdivs = portal_num_subdivs(P.radius, dist)
+      V = P.segment_vertices(num_subdivs)
+      if runs and runs[-1][0] == P.styles:
+        runs[-1][1].append(V)
+      else:
+        runs.append((P.styles, [V]))
+    for (col, lw), parts in runs:
+      H = view.project_to_screen_hom(np.concatenate(parts))
+      S = view.clipped_screen_segments(H)
+      draw_segments(surface, col, lw, S)
+
+
+# Position, nautical heading (degrees), radius and styles of the
+# portals in the playground, of which playground level 1 shows the
+# first 15 and level 2 shows all
+playground_portals = (
+  ((0, 4), 0, 4.0, (0xFFCC00, 1)),
+  ((6, 0), -45, 1.5, (0x00CC99, 1)),
+  ((4.5, -3.5), 87, 1.0, (0xFF7777, 1)),
+  ((12, -3.5), 90, 1.0, (0xFF7777, 1)),
+  ((15, -6.5), 180, 1.0, (0xFF7777, 1)),
+  ((15, -15), 180, 1.0, (0xFF7777, 1)),
+  ((12, -18), 270, 1.0, (0xFF7777, 1)),
+  ((4, -18), 270, 1.0, (0xFF7777, 1)),
+  ((-4, -18), 270, 1.0, (0xFF7777, 1)),
+  ((-7, -21), 180, 1.0, (0xFF7777, 1)),
+  ((-15, 0), 0, 1.4, (0xFF0000, 1)),
+  ((-15, 3), 0, 1.4, (0xFF7700, 1)),
+  ((-15, 6), 0, 1.4, (0xFFEE00, 1)),
+  ((-15, 9), 0, 1.4, (0x00AA00, 1)),
+  ((-15, 12), 0, 1.4, (0x0000FF, 1)),
+  ((-8, -15), 350, 2.0, (0xFFFF00, 1)),
+  ((-7, 18), 80, 2.0, (0x0088FF, 1)),
+  ((-0, 18), 100, 2.0, (0x0088FF, 1)),
+  ((0, -30), 0, 1.5, (0xFF00DD, 1)),
+  ((0, -30), 60, 1.5, (0xFF00DD, 1)),
+  ((0, -30), 120, 1.5, (0xFF00DD, 1)),
+  ((30, 20), 45, 0.8, (0xFF4400, 1)),
+  ((30, 30), 350, 0.8, (0xFF4400, 1)),
+  ((-4, -25), 0, 1.5, (0x00FFAA, 1)),
+  ((-4, -25), 60, 1.5, (0x00FFAA, 1)),
+  ((-4, -25), 120, 1.5, (0x00FFAA, 1)),
+)
+
+
+def build_playground():
+  playground = SceneGraph()
+  for pos, naut_hdg, radius, styles in playground_portals:
+    playground.add_portal(PortalNode(pos, naut_hdg, radius, styles))
+  return playground
 
 
 sinclair_c5000_props = {
@@ -2533,10 +3238,514 @@ vehicles_props = [
 ]
 
 
+class SimInputs (object):
+
+  # Driver inputs for one simulation step, already read from the mouse,
+  # gamepad or serial port and resolved into logical controls.
+
+  def __init__(self):
+    self.joystick = np.zeros(2)  # x: -1..+1 left to right, y: rev to fwd
+    self.l_trigger = 0.0  # 0..1
+    self.r_trigger = 0.0  # 0..1
+    self.trim_btn = False  # Triggers adjust the trim while held.
+    self.dpad = (0, 0)  # (x, y), each -1, 0 or +1, for jogging
+    self.blinker_btns = 0  # Bit 1 = Left, bit 0 = Right
+    self.ser_override = False  # Wheel speeds are commanded by the ESP32.
+    self.ser_lm = 0.0  # -1..+1 fraction of maximum wheel speed
+    self.ser_rm = 0.0
+    self.ser_lamps = 0x00
+
+
+class Simulation (object):
+
+  # The vehicle model of ArtCarSim without any display, clock or input
+  # devices. Each step resolves the driver inputs into wheel speed
+  # targets (control) and then integrates the motion over the given
+  # time (advance). The main loop renders between the two halves.
+
+  def __init__(self, props=None):
+    self.input_mode = InputDeviceMode.MOUSE
+    self.reverse_turns = False
+    self.limit_turn_rate = True
+    self.enable_joy_brake = False
+    self.soften_speed = True
+    self.soften_turns = True
+    self.enable_throttle = True
+    self.motors_are_magic = False
+    self.use_experimental_ctrl = False
+    # The wheel speed plans within each step may be integrated piecewise
+    # exactly rather than as one arc, so that long steps stay accurate,
+    # at several times the cost of a step.
+    self.use_exact_arcs = False
+    self.max_trim = 0.05
+    self.mistrim = 0.0
+    self.trim = 0.0
+    self.trim_v = 0.0
+    self.zeroing_trim = False
+    self.trimming = False
+    self.verbose = False
+    self.time = 0.0
+    # Physics runs in fixed steps, independently of the render rate.
+    self.physics_rate = 100.0  # Hz
+    self.max_frame_time = 0.25  # Longer frames run in slow motion.
+    self.accumulator = 0.0
+    dummy_mal = MotorAccLimits(0.1, jerk=1.0)
+    self.speed_ctrl = CarSpeedCtrl(dummy_mal, dummy_mal)
+    self.turn_ctrl = QPosCtrl()
+    self.turn_caps = TurnCaps()
+    self.lw_ctrl = SpeedCtrl(dummy_mal)
+    self.rw_ctrl = SpeedCtrl(dummy_mal)
+    self.pv = RoboMouse()
+    self.pv.plonk([2.5, -0.25, 0.0], np.radians(30.0))
+    # Results of the most recent control step, kept for the instruments
+    self.joystick = np.zeros(2)
+    self.soft_joy = np.zeros(2)
+    self.max_ctrl_speed = 0.0
+    self.max_omega = 0.0
+    self.max_omega_for_speed = 0.0
+    self.mbztj_left = 0.0
+    self.mbztj_right = 0.0
+    self.bf = 0.0
+    self.lw_trim_factor = 1.0
+    self.rw_trim_factor = 1.0
+    self.select_vehicle(vehicles_props[0] if props is None else props)
+
+  def reset_interpolation(self):
+    # Call after teleporting the vehicle so it is not drawn sliding.
+    self.prev_pos = np.array(self.pv.pos)
+    self.prev_ori = np.array(self.pv.ori)
+
+  def select_vehicle(self, props):
+    pv = self.pv
+    self.props = props
+    self.max_wheel_speed = props['max_wheel_speed']
+    self.throttle_factor = props['throttle_factor']
+    self.jog_factor = props['jog_factor']
+    self.turn_jog_factor = props['turn_jog_factor']
+    self.speed_ctrl.cruise_mal = props['cruise_mal']
+    self.speed_ctrl.braking_mal = props['braking_mal']
+    self.speed_ctrl.throttle_factor = (
+      self.throttle_factor if self.enable_throttle else 1.0
+    )
+    self.turn_ctrl.max_fwd_v = props['max_tc_knob_vel']
+    self.turn_ctrl.max_rev_v = props['max_tc_knob_vel']
+    self.turn_ctrl.max_a = props['max_tc_knob_acc']
+    pv.axle_width = props['axle_width']
+    self.max_bzt_omega = 2.0 * self.max_wheel_speed / pv.axle_width
+    turn_caps = self.turn_caps
+    turn_caps.max_lat_accel = props['max_lat_accel']
+    turn_caps.max_turn_rate = props['max_turn_rate']
+    turn_caps.reversing_omega_slope = props['reversing_omega_slope']
+    turn_caps.max_turn_rate = min(turn_caps.max_turn_rate, self.max_bzt_omega)
+    self.max_body_speed = float(
+      turn_caps.max_body_speed(self.max_wheel_speed, pv.axle_width)
+    )
+    if self.verbose:
+      print("New max body speed = {} m/s".format(self.max_body_speed))
+    self.lw_ctrl.mal = self.rw_ctrl.mal = props['wheel_mal']
+    pv.draw_fn = props['draw_fn']
+    pv.draw_fn_styles = props['draw_fn_styles']
+    pv.traction_offset = props['traction_offset']
+    pv.driver_offset = props['driver_offset']
+    pv.lw_state.radius = pv.rw_state.radius = props['wheel_radius']
+    pv.lw_state.width = pv.rw_state.width = props['wheel_width']
+    pv.plonk(pv.pos, None)
+    self.reset_interpolation()
+
+  def control(self, inputs):
+
+    idm = self.input_mode
+    speed_ctrl = self.speed_ctrl
+    turn_ctrl = self.turn_ctrl
+    turn_caps = self.turn_caps
+    lw_ctrl = self.lw_ctrl
+    rw_ctrl = self.rw_ctrl
+    pv = self.pv
+
+    if speed_ctrl.enable_joy_brake != self.enable_joy_brake:
+      # Toggling the joystick brake cancels any braking in progress.
+      speed_ctrl.joy_braking_state = 0
+    speed_ctrl.enable_joy_brake = self.enable_joy_brake
+    turn_caps.reverse_turns = self.reverse_turns
+    max_ctrl_speed = self.max_body_speed
+    max_omega = turn_caps.max_turn_rate
+    if idm == InputDeviceMode.JOYSTICKS_HPAT and not self.limit_turn_rate:
+      max_ctrl_speed = self.max_wheel_speed
+      max_omega = self.max_bzt_omega
+    max_omega_for_speed = max_omega
+
+    l_trigger = inputs.l_trigger
+    r_trigger = inputs.r_trigger
+    if idm != InputDeviceMode.MOUSE:
+      was_trimming = self.trimming
+      trim_btn_pressed = inputs.trim_btn
+      if trim_btn_pressed or self.zeroing_trim:
+        self.trimming = True
+      if self.trimming:
+        if self.zeroing_trim:
+          if self.trim == 0.0 and self.trim_v == 0.0:
+            if l_trigger == 0.0 and r_trigger == 0.0:
+              self.zeroing_trim = False
+        else:
+          self.trim_v = 0.005 * (l_trigger - r_trigger)
+          if l_trigger >= 0.8 and r_trigger >= 0.8:
+            self.zeroing_trim = True
+          if l_trigger == 0.0 and r_trigger == 0.0 and not trim_btn_pressed:
+            self.trimming = False
+        l_trigger = 0.0
+        r_trigger = 0.0
+      else:
+        self.trim_v = 0.0
+      if self.trimming != was_trimming and self.verbose:
+        if self.trimming:
+          print("(Circle/B) Triggers adjust trim.")
+        else:
+          print("Triggers apply breakes.")
+
+    joystick = np.array(inputs.joystick, dtype=float)
+    if idm == InputDeviceMode.JOYSTICKS_HPAT:
+      turn_caps.reverse_turns = False
+
+    speed_ctrl.throttle_factor = (
+      self.throttle_factor if self.enable_throttle else 1.0
+    )
+    is_jogging = False
+    hx, hy = inputs.dpad
+    if (hx, hy) != (0, 0):
+      # Jog mode via hat/D-pad
+      turn_caps.reverse_turns = False
+      speed_ctrl.enable_joy_brake = False
+      speed_ctrl.joy_braking_state = 0
+      joystick[0] = hx * self.turn_jog_factor
+      joystick[1] = hy * self.jog_factor
+      is_jogging = True
+    if self.use_experimental_ctrl and not is_jogging:
+      trig_jog_thres = 0.1
+      lt1 = l_trigger
+      rt1 = r_trigger
+      if True:
+        lt1 = 1.0 - lt1
+        rt1 = 1.0 - rt1
+      lt2 = (lt1 - trig_jog_thres) * (1.0 / (1.0 - trig_jog_thres))
+      rt2 = (rt1 - trig_jog_thres) * (1.0 / (1.0 - trig_jog_thres))
+      if lt2 > 0.0:
+        joystick[1] *= (1.0 - (1.0 - self.jog_factor) * lt2)
+      if rt2 > 0.0:
+        joystick[0] *= (1.0 - (1.0 - self.turn_jog_factor) * rt2)
+
+    soft_joy = np.array(joystick)
+    turn_ctrl.target_x = joystick[0]
+    if not self.soften_turns:
+      turn_ctrl.x = turn_ctrl.target_x
+      turn_ctrl.v = 0.0
+    soft_joy[0] = turn_ctrl.x
+
+    actual_speed = 0.5 * (lw_ctrl.current_speed + rw_ctrl.current_speed)
+
+    cmd_speed = max_ctrl_speed * soft_joy[1]
+    if self.limit_turn_rate:
+      max_omega_for_speed = turn_caps.max_turn_rate_for_speed(actual_speed)
+    omega = -max_omega_for_speed * soft_joy[0]
+    half_diff_speed = 0.5 * omega * pv.axle_width
+    mbztj_left = (cmd_speed - half_diff_speed) / self.max_wheel_speed
+    mbztj_right = (cmd_speed + half_diff_speed) / self.max_wheel_speed
+    self.mbztj_left = np.clip(mbztj_left, -1.0, +1.0)
+    self.mbztj_right = np.clip(mbztj_right, -1.0, +1.0)
+
+    if not self.use_experimental_ctrl:
+      self.bf = max(l_trigger, r_trigger)
+    bf = self.bf
+    speed_ctrl.input_braking_factor = bf
+    speed_ctrl.lever_pos = soft_joy[1]
+    speed_ctrl.max_speed = max_ctrl_speed
+    speed_ctrl.animate()
+    if not self.soften_speed:
+      speed_ctrl.target_speed = soft_joy[1] * max_ctrl_speed * (1.0 - bf)
+      speed_ctrl.current_speed = speed_ctrl.target_speed
+      speed_ctrl.v_pos_ctrl.x = speed_ctrl.target_speed
+      speed_ctrl.v_pos_ctrl.target_x = speed_ctrl.target_speed
+      speed_ctrl.v_pos_ctrl.v = 0.0
+    half_diff_speed = 0.5 * pv.axle_width * omega  #<<< redundant?
+    lw_ctrl.target_speed = speed_ctrl.current_speed - half_diff_speed
+    rw_ctrl.target_speed = speed_ctrl.current_speed + half_diff_speed
+    if inputs.ser_override:
+      lw_ctrl.target_speed = inputs.ser_lm * self.max_wheel_speed
+      rw_ctrl.target_speed = inputs.ser_rm * self.max_wheel_speed
+    lw_ctrl.animate()
+    rw_ctrl.animate()
+
+    a = speed_ctrl.current_accel
+    bf_thres = 0.05
+    if actual_speed < 0.0: a = -a
+    if a < -0.5 or speed_ctrl.joy_braking_state != 0 or bf >= bf_thres:
+      pv.stop_lamp_lit = True
+    if a >= -0.01 and speed_ctrl.joy_braking_state == 0 and bf < bf_thres:
+      pv.stop_lamp_lit = False
+
+    pv.blinkers.input = inputs.blinker_btns
+    pv.blinkers.animate()
+
+    self.lw_trim_factor = max(0.0, min(1.0, 1.0 - (self.mistrim + self.trim)))
+    self.rw_trim_factor = max(0.0, min(1.0, 1.0 + (self.mistrim + self.trim)))
+
+    self.joystick = joystick
+    self.soft_joy = soft_joy
+    self.max_ctrl_speed = max_ctrl_speed
+    self.max_omega = max_omega
+    self.max_omega_for_speed = max_omega_for_speed
+
+  def advance(self, delta_time):
+
+    lw_ctrl = self.lw_ctrl
+    rw_ctrl = self.rw_ctrl
+    pv = self.pv
+
+    self.turn_ctrl.advance(delta_time)
+
+    speed = 0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed)
+    pv.instr_last_vel = pv.ori[0] * speed
+
+    self.speed_ctrl.advance(delta_time)
+    # A single arc is exact when neither wheel changes its speed.
+    lq = lw_ctrl.v_pos_ctrl
+    rq = rw_ctrl.v_pos_ctrl
+    steady = (lq.v == 0.0 and lq.x == lq.target_x
+              and rq.v == 0.0 and rq.x == rq.target_x)
+    if self.use_exact_arcs and not steady:
+      pv.lw_state.ls_plan = lw_ctrl.v_pos_ctrl.plan()
+      pv.rw_state.ls_plan = rw_ctrl.v_pos_ctrl.plan()
+      pv.lw_state.ls_plan_factor = self.lw_trim_factor
+      pv.rw_state.ls_plan_factor = self.rw_trim_factor
+    else:
+      pv.lw_state.ls_plan = None
+      pv.rw_state.ls_plan = None
+    lw_ctrl.v_pos_ctrl.integral = 0.0
+    rw_ctrl.v_pos_ctrl.integral = 0.0
+    lw_ctrl.advance(delta_time)
+    rw_ctrl.advance(delta_time)
+    if self.motors_are_magic:
+      lw_ctrl.current_speed = lw_ctrl.target_speed
+      rw_ctrl.current_speed = rw_ctrl.target_speed
+    pv.lw_state.ls_integral = self.lw_trim_factor * lw_ctrl.v_pos_ctrl.integral
+    pv.rw_state.ls_integral = self.rw_trim_factor * rw_ctrl.v_pos_ctrl.integral
+    pv.advance(delta_time)
+    pv.lw_state.linspeed = self.lw_trim_factor * lw_ctrl.current_speed
+    pv.rw_state.linspeed = self.rw_trim_factor * rw_ctrl.current_speed
+    speed = 0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed)
+    vel = pv.ori[0] * speed
+    pv.instr_accel = (vel - pv.instr_last_vel) / delta_time
+
+    # Roughly model the scrubbing stress on the tires.
+    twist = 5.0 * pv.instr_omega * delta_time
+    f = 15.0
+    pv.lw_state.twist += twist
+    pv.rw_state.twist += twist
+    pv.lw_state.twist *= np.exp(-f * abs(pv.lw_state.linspeed) * delta_time)
+    pv.rw_state.twist *= np.exp(-f * abs(pv.rw_state.linspeed) * delta_time)
+    pv.lw_state.twist = np.clip(pv.lw_state.twist, -1.0, +1.0)
+    pv.rw_state.twist = np.clip(pv.rw_state.twist, -1.0, +1.0)
+
+    if self.zeroing_trim:
+      self.trim_v = 0.05
+      abs_delta_trim = self.trim_v * delta_time
+      if self.trim > 0.0:
+        self.trim = max(0.0, self.trim - abs_delta_trim)
+      elif self.trim < 0.0:
+        self.trim = min(0.0, self.trim + abs_delta_trim)
+      if self.trim == 0.0:
+        self.trim_v = 0.0
+    else:
+      self.trim += delta_time * self.trim_v
+      self.trim = np.clip(self.trim, -self.max_trim, +self.max_trim)
+
+    pv.blinkers.advance(delta_time)
+    self.time += delta_time
+
+  def step(self, inputs, delta_time):
+    self.control(inputs)
+    self.advance(delta_time)
+
+  def run(self, inputs, frame_time):
+    # Consume the real time taken by one rendered frame in whole physics
+    # steps, all with the same inputs. The remainder is carried over to
+    # the next frame and returned as a fraction of a step, with which
+    # render_pose() interpolates between the last two physics states.
+    step_time = 1.0 / self.physics_rate
+    self.accumulator += min(frame_time, self.max_frame_time)
+    while self.accumulator >= step_time:
+      self.reset_interpolation()
+      self.step(inputs, step_time)
+      self.accumulator -= step_time
+    return self.accumulator / step_time
+
+  def render_pose(self, alpha):
+    pos = self.prev_pos + alpha * (self.pv.pos - self.prev_pos)
+    h0 = np.arctan2(self.prev_ori[0][1], self.prev_ori[0][0])
+    h1 = np.arctan2(self.pv.ori[0][1], self.pv.ori[0][0])
+    dh = (h1 - h0 + np.pi) % (2.0 * np.pi) - np.pi
+    c = np.cos(alpha * dh)
+    s = np.sin(alpha * dh)
+    rot = np.array([
+      [c, s, 0.0],
+      [-s, c, 0.0],
+      [0.0, 0.0, 1.0],
+    ])
+    ori = self.prev_ori @ rot
+    return pos, ori
+
+
+# Input recordings hold a header followed by one record per rendered
+# frame with everything that Simulation.run() consumed in that frame.
+# Values are stored at full precision so that a replay reproduces the
+# recorded session exactly.
+
+REC_MAGIC = b"ACSR"
+REC_VERSION = 1
+REC_HEADER = struct.Struct("<4sHd")  # Magic, version, physics rate
+REC_FRAME = struct.Struct("<dHBBbbBBddddddd")
+
+# Bits 0..7 of the flags field of a record
+REC_SETTINGS = (
+  'reverse_turns',
+  'limit_turn_rate',
+  'enable_joy_brake',
+  'soften_speed',
+  'soften_turns',
+  'enable_throttle',
+  'motors_are_magic',
+  'use_experimental_ctrl',
+)
+REC_TRIM_BTN = 1 << 8
+REC_SER_OVERRIDE = 1 << 9
+REC_HOMED = 1 << 10  # The vehicle was returned home before this frame.
+REC_EXACT_ARCS = 1 << 11
+
+
+class SimRecorder (object):
+
+  def __init__(self, f, physics_rate):
+    self.f = f
+    self.num_frames = 0
+    f.write(REC_HEADER.pack(REC_MAGIC, REC_VERSION, physics_rate))
+
+  def write_frame(self, sim, inputs, vehicle_ix, frame_time, homed=False):
+    flags = 0
+    for i, name in enumerate(REC_SETTINGS):
+      if getattr(sim, name):
+        flags |= 1 << i
+    if inputs.trim_btn: flags |= REC_TRIM_BTN
+    if inputs.ser_override: flags |= REC_SER_OVERRIDE
+    if homed: flags |= REC_HOMED
+    if sim.use_exact_arcs: flags |= REC_EXACT_ARCS
+    self.f.write(REC_FRAME.pack(
+      frame_time,
+      flags,
+      int(sim.input_mode),
+      vehicle_ix,
+      inputs.dpad[0],
+      inputs.dpad[1],
+      inputs.blinker_btns,
+      inputs.ser_lamps,
+      sim.mistrim,
+      inputs.joystick[0],
+      inputs.joystick[1],
+      inputs.l_trigger,
+      inputs.r_trigger,
+      inputs.ser_lm,
+      inputs.ser_rm,
+    ))
+    self.num_frames += 1
+
+
+def replay_sim_recording(f):
+
+  # Run a recorded session through a fresh Simulation as fast as
+  # possible and return the Simulation and the number of frames.
+
+  magic, version, physics_rate = REC_HEADER.unpack(f.read(REC_HEADER.size))
+  if magic != REC_MAGIC or version != REC_VERSION:
+    raise ValueError("Not an ArtCarSim input recording (version {})"
+      .format(REC_VERSION))
+
+  sim = Simulation()
+  sim.physics_rate = physics_rate
+  inputs = SimInputs()
+  current_vehicle_ix = -1
+  num_frames = 0
+
+  while True:
+    buf = f.read(REC_FRAME.size)
+    if len(buf) < REC_FRAME.size:
+      break
+    (
+      frame_time, flags, idm, vehicle_ix, hx, hy, blinker_btns, ser_lamps,
+      mistrim, jx, jy, l_trigger, r_trigger, ser_lm, ser_rm,
+    ) = REC_FRAME.unpack(buf)
+    if flags & REC_HOMED:
+      sim.pv.plonk([0, 0], np.radians(90.0))
+      sim.reset_interpolation()
+    if vehicle_ix != current_vehicle_ix:
+      sim.select_vehicle(vehicles_props[vehicle_ix])
+      current_vehicle_ix = vehicle_ix
+    for i, name in enumerate(REC_SETTINGS):
+      setattr(sim, name, bool((flags >> i) & 1))
+    sim.use_exact_arcs = bool(flags & REC_EXACT_ARCS)
+    sim.input_mode = InputDeviceMode(idm)
+    sim.mistrim = mistrim
+    inputs.joystick = np.array([jx, jy])
+    inputs.l_trigger = l_trigger
+    inputs.r_trigger = r_trigger
+    inputs.trim_btn = bool(flags & REC_TRIM_BTN)
+    inputs.dpad = (hx, hy)
+    inputs.blinker_btns = blinker_btns
+    inputs.ser_override = bool(flags & REC_SER_OVERRIDE)
+    inputs.ser_lm = ser_lm
+    inputs.ser_rm = ser_rm
+    inputs.ser_lamps = ser_lamps
+    sim.run(inputs, frame_time)
+    num_frames += 1
+
+  return sim, num_frames
+
+
 def main():
 
   #prog_dir = os.path.split(os.path.abspath(__file__))[0]
 
+  parser = argparse.ArgumentParser(
+    description="Simulate a differentially steered art car."
+  )
+  parser.add_argument("--record", metavar="FILE",
+      help="record the driver inputs of every frame to FILE")
+  parser.add_argument("--replay", metavar="FILE",
+      help="replay recorded inputs without a display and print the final pose")
+  parser.add_argument("--physics-rate", metavar="HZ", type=float,
+      default=100.0,
+      help="fixed rate of the physics steps, independent of the frame rate"
+           " (default: %(default)s, the ESP32 runs at 1000)")
+  parser.add_argument("--exact-arcs", action="store_true",
+      help="integrate the wheel speed plans within each physics step"
+           " piecewise exactly (slower)")
+  args = parser.parse_args()
+  if not args.physics_rate > 0.0:
+    parser.error("--physics-rate must be positive")
+
+  if args.replay is not None:
+    t0 = time.perf_counter()
+    with open(args.replay, "rb") as f:
+      sim, num_frames = replay_sim_recording(f)
+    wall_time = time.perf_counter() - t0
+    pv = sim.pv
+    hdg = np.degrees(np.arctan2(pv.ori[0][1], pv.ori[0][0]))
+    speed = 0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed)
+    print("Replayed {} frames ({:.2f} s) in {:.2f} s".format(
+        num_frames, sim.time, wall_time))
+    print("Vehicle: {}".format(sim.props.get('name', "Untitled")))
+    print("Position: ({:.6f}, {:.6f}) m".format(pv.pos[0], pv.pos[1]))
+    print("Heading: {:.6f} deg".format(hdg))
+    print("Speed: {:.6f} m/s".format(speed))
+    return
+
   ser = None
   ser_dev_name = "/dev/ttyUSB0"
   try:
@@ -2567,33 +3776,24 @@ def main():
   current_vehicle_ix = -1
   requested_vehicle_ix = 0
   playground_level = 1
+  playground = build_playground()
+  convoy_sizes = (0, 10, 100, 400)
+  convoy_size_ix = 0
+  convoy = None
   grid_mode = 3
-  reverse_turns = False
-  limit_turn_rate = True
-  enable_joy_brake = False
-  soften_speed = True
-  soften_turns = True
-  enable_throttle = True
-  motors_are_magic = False
-  max_trim = 0.05
-  mistrim = 0.0
-  trim = 0.0
-  trim_v = 0.0
-  zeroing_trim = False
-  trimming = False
-  use_experimental_ctrl = False
   joydump = False
 
   fixed_cam_pos = np.array([0.0, -3.0, 1.2])
 
-  dummy_mal = MotorAccLimits(0.1, jerk=1.0)
-  speed_ctrl = CarSpeedCtrl(dummy_mal, dummy_mal)
-  turn_ctrl = QPosCtrl()
-  turn_caps = TurnCaps()
-  lw_ctrl = SpeedCtrl(dummy_mal)
-  rw_ctrl = SpeedCtrl(dummy_mal)
-  pv = RoboMouse()
-  pv.plonk([2.5, -0.25, 0.0], np.radians(30.0))
+  sim = Simulation()
+  sim.verbose = True
+  sim.use_exact_arcs = args.exact_arcs
+  speed_ctrl = sim.speed_ctrl
+  turn_caps = sim.turn_caps
+  lw_ctrl = sim.lw_ctrl
+  rw_ctrl = sim.rw_ctrl
+  pv = sim.pv
+  sim_inputs = SimInputs()
 
   avail_idms_set = {InputDeviceMode.MOUSE}
   default_idm = InputDeviceMode.MOUSE
@@ -2778,899 +3978,719 @@ def main():
   max_fps = 100
   dampened_fps = max_fps
   delta_time = 1.0 / max_fps
+  sim.physics_rate = args.physics_rate
 
-  do_exit = False
-
-  while not do_exit:
-
-    for event in pg.event.get():
-      if event.type == pg.QUIT:
-        do_exit = True
-        print("[Quit]")
-      elif event.type == pg.KEYUP and event.key == pg.K_ESCAPE:
-        do_exit = True
-        print("[ESC] Quit")
-      elif event.type == pg.KEYUP:
-        if event.key == pg.K_q:
-          do_exit = True
-          print("[Q] Quit")
-      elif event.type == pg.KEYDOWN:
-        if event.key == pg.K_h:
-          pv.plonk([0, 0], np.radians(90.0))
-          print("[H] Home")
-        elif event.key == pg.K_p:
-          playground_level = (playground_level + 1) % 3
-          print("[P] Playground level {}".format(playground_level))
-        elif event.key == pg.K_v or event.key == pg.K_f:
-          dx = 2.0 * std_view_dist
-          dy = random.randrange(-1, 4, 1) * 0.2 * std_view_dist
-          dz = (0.04, 0.2, 0.5)[random.randrange(3)] * std_view_dist
-          fixed_cam_pos = np.array(pv.pos)
-          fixed_cam_pos += np.array([dx, dy, dz]) @ pv.ori
-          if event.key == pg.K_f:
-            pov_mode = ViewMode.REMOTE
-          else:
-            pov_mode = ViewMode((pov_mode + 1) % len(ViewMode))
-            vd_ctrl.x = vd_ctrl.target_x = 1.0 / std_view_dist
-          print("[V] View: {}".format(pov_mode.name))
-        elif event.key == pg.K_i:
-          idm_ix = (idm_ix + 1) % len(avail_idms)
-          print("[I] Input method: {}".format(avail_idms[idm_ix].name))
-        elif event.key == pg.K_g:
-          grid_mode = (grid_mode + 1) % 6
-          if grid_mode:
-            print("[G] Grid {}".format(grid_mode))
-          else:
-            print("[G] No grid")
-        elif event.key == pg.K_w:
-          reverse_turns = not reverse_turns
-          if reverse_turns:
-            print("[W] Steering wheel mode: Stick towards centre of turn")
-          else:
-            print("[W] ISO steering mode")
-        elif event.key == pg.K_a:
-          limit_turn_rate = not limit_turn_rate
-          if limit_turn_rate:
-            print("[A] Turn rate is limited according to g-force.")
-          else:
-            print("[A] Turn rate limit disregards lateral g-force.")
-        elif event.key == pg.K_s:
-          soften_speed = not soften_speed
-          if soften_speed:
-            print("[S] Using speed controller")
-          else:
-            print("[S] Bypassing speed controller")
-        elif event.key == pg.K_d:
-          soften_turns = not soften_turns
-          if soften_turns:
-            print("[D] Turn damper enabled")
-          else:
-            print("[D] Turns damper disabled: Only motors dampen turns.")
-        elif event.key == pg.K_j:
-          enable_joy_brake = not enable_joy_brake
-          speed_ctrl.enable_joy_brake = enable_joy_brake
-          speed_ctrl.joy_braking_state = 0
-          if enable_joy_brake:
-            print("[J] Reversing joystick activates brake")
-          else:
-            print("[J] Joystick brake disabled: Use trigger.")
-        elif event.key == pg.K_t:
-          enable_throttle = not enable_throttle
-          if enable_throttle:
-            print("[T] Throttle enabled for speed controller.")
-          else:
-            print("[T] Speed controller operates without throttle.")
-        elif event.key == pg.K_m:
-          motors_are_magic = not motors_are_magic
-          if motors_are_magic:
-            print("[M] Motors are magic.")
-          else:
-            print("[M] Motors have acceleration limits.")
-        elif event.key == pg.K_l:
-          if mistrim:
-            mistrim = 0.0
-            print("[L] Tyres are equally inflated.")
-          else:
-            x = random.choice((10, 20, 30))
-            s = random.choice((-1, 1))
-            mistrim = 0.001 * s * x
-            print("[L] Flat tyre: Mistrim =", mistrim)
-        elif event.key == pg.K_y and gamepad is not None:
-          joydump = not joydump
-          if joydump:
-            print("[Y] Joystick dump:")
-          else:
-            print("[Y] Joystick dump disabled")
-        elif event.key == pg.K_x:
-          use_experimental_ctrl = not use_experimental_ctrl
-          if use_experimental_ctrl:
-            print("[X] Experimental control layout active")
-          else:
-            print("[X] Normal control layout active")
-        elif event.key == pg.K_c:
-          requested_vehicle_ix += 1
-          print("[C] Fetching new car...")
-
-    requested_vehicle_ix = requested_vehicle_ix % len(vehicles_props)
-    if requested_vehicle_ix != current_vehicle_ix:
-      props = vehicles_props[requested_vehicle_ix]
-      name = props.get('name', "Untitled")
-      print("New vehicle:", name)
-      max_wheel_speed = props['max_wheel_speed']
-      max_body_speed = max_wheel_speed  # Will be automatically limited.
-      throttle_factor = props['throttle_factor']
-      jog_factor = props['jog_factor']
-      turn_jog_factor = props['turn_jog_factor']
-      speed_ctrl.cruise_mal = props['cruise_mal']
-      speed_ctrl.braking_mal = props['braking_mal']
-      speed_ctrl.throttle_factor = throttle_factor if enable_throttle else 1.0
-      turn_ctrl.max_fwd_v = turn_ctrl.max_rev_v = props['max_tc_knob_vel']
-      turn_ctrl.max_a = props['max_tc_knob_acc']
-      pv.axle_width = props['axle_width']
-      max_bzt_omega = 2.0 * max_wheel_speed / pv.axle_width
-      turn_caps.max_lat_accel = props['max_lat_accel']
-      turn_caps.max_turn_rate = props['max_turn_rate']
-      turn_caps.reversing_omega_slope = props['reversing_omega_slope']
-      turn_caps.max_turn_rate = min(turn_caps.max_turn_rate, max_bzt_omega)
-      mbs_too_high = True
-      while mbs_too_high:
-        mbs_too_high = False
-        omega = turn_caps.max_turn_rate_for_speed(max_body_speed)
-        hds = 0.5 * omega * pv.axle_width
-        if max_body_speed + hds > max_wheel_speed:
-          new_max_body_speed = max_wheel_speed - hds
-          if new_max_body_speed < max_body_speed:
-            max_body_speed = new_max_body_speed
-            mbs_too_high = True
-          print("New max body speed = {} m/s".format(max_body_speed))
-      #max_body_speed = 0.6 * max_wheel_speed; print("Overriden!") #<<<<<<<<<<<
-      lw_ctrl.mal = rw_ctrl.mal = props['wheel_mal']
-      pv.draw_fn = props['draw_fn']
-      pv.draw_fn_styles = props['draw_fn_styles']
-      pv.traction_offset = props['traction_offset']
-      pv.driver_offset = props['driver_offset']
-      pv.lw_state.radius = pv.rw_state.radius = props['wheel_radius']
-      pv.lw_state.width = pv.rw_state.width = props['wheel_width']
-      pv.plonk(pv.pos, None)
-      std_view_dist = props['std_view_dist']
-      vd_ctrl.target_x = 1.0 / std_view_dist
-      current_vehicle_ix = requested_vehicle_ix
+  recorder = None
+  if args.record is not None:
+    recorder = SimRecorder(open(args.record, "wb"), sim.physics_rate)
+    print("Recording inputs to \"{}\"".format(args.record))
 
-    if ser is not None:
-      if ser.in_waiting > 0:
-        serbuf += ser.read(ser.in_waiting)
-        lines = serbuf.split(b"\n")
-        if len(lines) >= 2:
-          for line in lines[:-1]:
-            L = line.strip().decode('ascii')
-            a = 0
-            for c in L:
-              x = -1
-              if 'A' <= c <= 'Z':
-                x = ord(c) - ord('A')
-              elif 'a' <= c <= 'z':
-                x = ord(c) - ord('a') + 26
-              elif '0' <= c <= '9':
-                x = ord(c) - ord('0') + 52
-              elif c == '+':
-                x = 62
-              elif c == '/':
-                x = 63
-              if x >= 0:
-                a = (a << 6) + x
-              else:
-                a = -1
-                break
-            if a >= 0:
-              x = ((a >> 12) & 0xFFF)
-              if x >= 0x800: x -= 0x1000
-              ser_lm = np.clip(float(x) / 2047.0, -1.0, +1.0)
-              x = ((a >> 0) & 0xFFF)
-              if x >= 0x800: x -= 0x1000
-              ser_rm = np.clip(float(x) / 2047.0, -1.0, +1.0)
-              ser_lamps = (a >> 24) & 0x3F
-              ser_buttons = (a >> 30) & 0x3FFFF
-            #BBBILLRR
-            print("{}: {:018b} {:06b} {:7.3f} {:7.3f}"
-              .format(L, ser_buttons, ser_lamps, ser_lm, ser_rm))
-          serbuf = lines[-1]
-
-    keystate = pg.key.get_pressed()
-    mouse_pos = pg.mouse.get_pos()
-    aspect = (screen_size[0] - 1) / (screen_size[1] - 1)
-    mx = (mouse_pos[0] / (screen_size[0] - 1))
-    my = (mouse_pos[1] / (screen_size[1] - 1))
-
-    idm = avail_idms[idm_ix]
-    num_js_axes = 0
-    num_js_buttons = 0
-    if gamepad is not None:
-      num_js_axes = gamepad.get_numaxes()
-      num_js_buttons = gamepad.get_numbuttons()
-
-    speed_ctrl.enable_joy_brake = enable_joy_brake
-    turn_caps.reverse_turns = reverse_turns
-    max_ctrl_speed = max_body_speed
-    max_omega = turn_caps.max_turn_rate
-    if idm == InputDeviceMode.JOYSTICKS_HPAT and not limit_turn_rate:
-      max_ctrl_speed = max_wheel_speed
-      max_omega = max_bzt_omega
-    max_omega_for_speed = max_omega
+  do_exit = False
 
-    real_joy_slop_hw = 0.043
-    joystick = np.zeros(2)
-    bztj_left = 0.0
-    bztj_right = 0.0
-    mbztj_left = 0.0
-    mbztj_right = 0.0
+  try:
+    while not do_exit:
 
-    l_trigger = 0.0
-    r_trigger = 0.0
-    if idm != InputDeviceMode.MOUSE:
-      l_trigger = 0.5 * (gpmap.axis(gamepad, GamepadAxis.LEFTTRIGGER) + 1.0)
-      r_trigger = 0.5 * (gpmap.axis(gamepad, GamepadAxis.RIGHTTRIGGER) + 1.0)
-      l_trigger = np.clip(1.05 * l_trigger - 0.05, 0.0, 1.0)
-      r_trigger = np.clip(1.05 * r_trigger - 0.05, 0.0, 1.0)
-    if idm != InputDeviceMode.MOUSE:
-      was_trimming = trimming
-      trim_btn_pressed = gpmap.btn(gamepad, GamepadBtn.B)
-      if trim_btn_pressed or zeroing_trim:
-        trimming = True
-      if trimming:
-        if zeroing_trim:
-          if trim == 0.0 and trim_v == 0.0:
-            if l_trigger == 0.0 and r_trigger == 0.0:
-              zeroing_trim = False
-        else:
-          trim_v = 0.005 * (l_trigger - r_trigger)
-          if l_trigger >= 0.8 and r_trigger >= 0.8:
-            zeroing_trim = True
-          if l_trigger == 0.0 and r_trigger == 0.0 and not trim_btn_pressed:
-            trimming = False
-        l_trigger = 0.0
-        r_trigger = 0.0
-      else:
-        trim_v = 0.0
-      if trimming != was_trimming:
-        if trimming:
-          print("(Circle/B) Triggers adjust trim.")
-        else:
-          print("Triggers apply breakes.")
+      homed = False
+      for event in pg.event.get():
+        if event.type == pg.QUIT:
+          do_exit = True
+          print("[Quit]")
+        elif event.type == pg.KEYUP and event.key == pg.K_ESCAPE:
+          do_exit = True
+          print("[ESC] Quit")
+        elif event.type == pg.KEYUP:
+          if event.key == pg.K_q:
+            do_exit = True
+            print("[Q] Quit")
+        elif event.type == pg.KEYDOWN:
+          if event.key == pg.K_h:
+            pv.plonk([0, 0], np.radians(90.0))
+            sim.reset_interpolation()
+            homed = True
+            print("[H] Home")
+          elif event.key == pg.K_p:
+            playground_level = (playground_level + 1) % 3
+            print("[P] Playground level {}".format(playground_level))
+          elif event.key == pg.K_v or event.key == pg.K_f:
+            dx = 2.0 * std_view_dist
+            dy = random.randrange(-1, 4, 1) * 0.2 * std_view_dist
+            dz = (0.04, 0.2, 0.5)[random.randrange(3)] * std_view_dist
+            fixed_cam_pos = np.array(pv.pos)
+            fixed_cam_pos += np.array([dx, dy, dz]) @ pv.ori
+            if event.key == pg.K_f:
+              pov_mode = ViewMode.REMOTE
+            else:
+              pov_mode = ViewMode((pov_mode + 1) % len(ViewMode))
+              vd_ctrl.x = vd_ctrl.target_x = 1.0 / std_view_dist
+            print("[V] View: {}".format(pov_mode.name))
+          elif event.key == pg.K_i:
+            idm_ix = (idm_ix + 1) % len(avail_idms)
+            print("[I] Input method: {}".format(avail_idms[idm_ix].name))
+          elif event.key == pg.K_g:
+            grid_mode = (grid_mode + 1) % 6
+            if grid_mode:
+              print("[G] Grid {}".format(grid_mode))
+            else:
+              print("[G] No grid")
+          elif event.key == pg.K_w:
+            sim.reverse_turns = not sim.reverse_turns
+            if sim.reverse_turns:
+              print("[W] Steering wheel mode: Stick towards centre of turn")
+            else:
+              print("[W] ISO steering mode")
+          elif event.key == pg.K_a:
+            sim.limit_turn_rate = not sim.limit_turn_rate
+            if sim.limit_turn_rate:
+              print("[A] Turn rate is limited according to g-force.")
+            else:
+              print("[A] Turn rate limit disregards lateral g-force.")
+          elif event.key == pg.K_s:
+            sim.soften_speed = not sim.soften_speed
+            if sim.soften_speed:
+              print("[S] Using speed controller")
+            else:
+              print("[S] Bypassing speed controller")
+          elif event.key == pg.K_d:
+            sim.soften_turns = not sim.soften_turns
+            if sim.soften_turns:
+              print("[D] Turn damper enabled")
+            else:
+              print("[D] Turns damper disabled: Only motors dampen turns.")
+          elif event.key == pg.K_j:
+            sim.enable_joy_brake = not sim.enable_joy_brake
+            if sim.enable_joy_brake:
+              print("[J] Reversing joystick activates brake")
+            else:
+              print("[J] Joystick brake disabled: Use trigger.")
+          elif event.key == pg.K_t:
+            sim.enable_throttle = not sim.enable_throttle
+            if sim.enable_throttle:
+              print("[T] Throttle enabled for speed controller.")
+            else:
+              print("[T] Speed controller operates without throttle.")
+          elif event.key == pg.K_m:
+            sim.motors_are_magic = not sim.motors_are_magic
+            if sim.motors_are_magic:
+              print("[M] Motors are magic.")
+            else:
+              print("[M] Motors have acceleration limits.")
+          elif event.key == pg.K_l:
+            if sim.mistrim:
+              sim.mistrim = 0.0
+              print("[L] Tyres are equally inflated.")
+            else:
+              x = random.choice((10, 20, 30))
+              s = random.choice((-1, 1))
+              sim.mistrim = 0.001 * s * x
+              print("[L] Flat tyre: Mistrim =", sim.mistrim)
+          elif event.key == pg.K_y and gamepad is not None:
+            joydump = not joydump
+            if joydump:
+              print("[Y] Joystick dump:")
+            else:
+              print("[Y] Joystick dump disabled")
+          elif event.key == pg.K_x:
+            sim.use_experimental_ctrl = not sim.use_experimental_ctrl
+            if sim.use_experimental_ctrl:
+              print("[X] Experimental control layout active")
+            else:
+              print("[X] Normal control layout active")
+          elif event.key == pg.K_c:
+            requested_vehicle_ix += 1
+            print("[C] Fetching new car...")
+          elif event.key == pg.K_n:
+            convoy_size_ix = (convoy_size_ix + 1) % len(convoy_sizes)
+            convoy = None
+            num_cars = convoy_sizes[convoy_size_ix]
+            print("[N] Convoy of {} cars".format(num_cars))
+
+      requested_vehicle_ix = requested_vehicle_ix % len(vehicles_props)
+      if requested_vehicle_ix != current_vehicle_ix:
+        props = vehicles_props[requested_vehicle_ix]
+        name = props.get('name', "Untitled")
+        print("New vehicle:", name)
+        sim.select_vehicle(props)
+        std_view_dist = props['std_view_dist']
+        vd_ctrl.target_x = 1.0 / std_view_dist
+        current_vehicle_ix = requested_vehicle_ix
+        convoy = None
+      if convoy is None and convoy_sizes[convoy_size_ix] > 0:
+        convoy = RoboMouseFleet(convoy_sizes[convoy_size_ix], sim.props)
+        convoy.line_up(pv.pos, np.arctan2(pv.ori[0][1], pv.ori[0][0]))
+
+      if ser is not None:
+        if ser.in_waiting > 0:
+          serbuf += ser.read(ser.in_waiting)
+          lines = serbuf.split(b"\n")
+          if len(lines) >= 2:
+            for line in lines[:-1]:
+              L = line.strip().decode('ascii')
+              a = 0
+              for c in L:
+                x = -1
+                if 'A' <= c <= 'Z':
+                  x = ord(c) - ord('A')
+                elif 'a' <= c <= 'z':
+                  x = ord(c) - ord('a') + 26
+                elif '0' <= c <= '9':
+                  x = ord(c) - ord('0') + 52
+                elif c == '+':
+                  x = 62
+                elif c == '/':
+                  x = 63
+                if x >= 0:
+                  a = (a << 6) + x
+                else:
+                  a = -1
+                  break
+              if a >= 0:
+                x = ((a >> 12) & 0xFFF)
+                if x >= 0x800: x -= 0x1000
+                ser_lm = np.clip(float(x) / 2047.0, -1.0, +1.0)
+                x = ((a >> 0) & 0xFFF)
+                if x >= 0x800: x -= 0x1000
+                ser_rm = np.clip(float(x) / 2047.0, -1.0, +1.0)
+                ser_lamps = (a >> 24) & 0x3F
+                ser_buttons = (a >> 30) & 0x3FFFF
+              #BBBILLRR
+              print("{}: {:018b} {:06b} {:7.3f} {:7.3f}"
+                .format(L, ser_buttons, ser_lamps, ser_lm, ser_rm))
+            serbuf = lines[-1]
+
+      keystate = pg.key.get_pressed()
+      mouse_pos = pg.mouse.get_pos()
+      aspect = (screen_size[0] - 1) / (screen_size[1] - 1)
+      mx = (mouse_pos[0] / (screen_size[0] - 1))
+      my = (mouse_pos[1] / (screen_size[1] - 1))
+
+      idm = avail_idms[idm_ix]
+      num_js_axes = 0
+      num_js_buttons = 0
+      if gamepad is not None:
+        num_js_axes = gamepad.get_numaxes()
+        num_js_buttons = gamepad.get_numbuttons()
+
+      sim.input_mode = idm
+
+      real_joy_slop_hw = 0.043
+      joystick = np.zeros(2)
+      bztj_left = 0.0
+      bztj_right = 0.0
+
+      l_trigger = 0.0
+      r_trigger = 0.0
+      if idm != InputDeviceMode.MOUSE:
+        l_trigger = 0.5 * (gpmap.axis(gamepad, GamepadAxis.LEFTTRIGGER) + 1.0)
+        r_trigger = 0.5 * (gpmap.axis(gamepad, GamepadAxis.RIGHTTRIGGER) + 1.0)
+        l_trigger = np.clip(1.05 * l_trigger - 0.05, 0.0, 1.0)
+        r_trigger = np.clip(1.05 * r_trigger - 0.05, 0.0, 1.0)
+        sim_inputs.trim_btn = gpmap.btn(gamepad, GamepadBtn.B)
+      sim_inputs.l_trigger = l_trigger
+      sim_inputs.r_trigger = r_trigger
 
-    if idm == InputDeviceMode.JOYSTICKS_HPAT:
-      bztj_left = sloppy_joy(
-        -gpmap.axis(gamepad, GamepadAxis.LEFTY),
-        real_joy_slop_hw,
-      )
-      bztj_right = sloppy_joy(
-        -gpmap.axis(gamepad, GamepadAxis.RIGHTY),
-        real_joy_slop_hw,
-      )
-      joystick[:] = joy_vv2xy(bztj_left, bztj_right)
-      #print('BZT', bztj_left, bztj_right)
-      #print('Joy0 {:<5.3f} {:<5.3f}'.format(*joystick))
-      if limit_turn_rate:
-        k = 1.0 # max_bzt_omega / max_omega
-        joystick[0] = np.clip(k * joystick[0], -1.0, +1.0)
-      turn_caps.reverse_turns = False
-      #print('Joy1 {:<5.3f} {:<5.3f}'.format(*joystick))
-    elif idm == InputDeviceMode.JOYSTICK_ISO:
-      joystick = np.array([
-        sloppy_joy(
-          gpmap.axis(gamepad, GamepadAxis.LEFTX),
-          real_joy_slop_hw,
-        ),
-        sloppy_joy(
+      if idm == InputDeviceMode.JOYSTICKS_HPAT:
+        bztj_left = sloppy_joy(
           -gpmap.axis(gamepad, GamepadAxis.LEFTY),
           real_joy_slop_hw,
-        ),
-      ])
-    elif idm == InputDeviceMode.JOYSTICKS_VH:
-      joystick = np.array([
-        sloppy_joy(
-          gpmap.axis(gamepad, GamepadAxis.RIGHTX),
-          real_joy_slop_hw,
-        ),
-        sloppy_joy(
-          -gpmap.axis(gamepad, GamepadAxis.LEFTY),
+        )
+        bztj_right = sloppy_joy(
+          -gpmap.axis(gamepad, GamepadAxis.RIGHTY),
           real_joy_slop_hw,
-        ),
-      ])
-    else:
-      # Fall back to InputDeviceMode.MOUSE
-      joystick = np.array((-1.0 + 2.0 * mx, 1.0 - 2.0 * my))
-      if aspect > 1.0: joystick[0] *= aspect
-      if aspect < 1.0: joystick[1] /= aspect
-      joystick[0] = sloppy_joy(joystick[0])
-      joystick[1] = sloppy_joy(joystick[1])
-      joystick = np.clip(mouse_joy_gain * joystick, -1.0, +1.0)
-
-    speed_ctrl.throttle_factor = throttle_factor if enable_throttle else 1.0
-    is_jogging = False
-    if gpmap is not None:
-      dup = gpmap.btn(gamepad, GamepadBtn.DPAD_UP)
-      ddn = gpmap.btn(gamepad, GamepadBtn.DPAD_DOWN)
-      dle = gpmap.btn(gamepad, GamepadBtn.DPAD_LEFT)
-      dri = gpmap.btn(gamepad, GamepadBtn.DPAD_RIGHT)
-      hy = (0, 1)[dup] - (0, 1)[ddn]
-      hx = (0, 1)[dri] - (0, 1)[dle]
-      if (hx, hy) != (0, 0):
-        # Jog mode via hat/D-pad
-        turn_caps.reverse_turns = False
-        speed_ctrl.enable_joy_brake = False
-        speed_ctrl.joy_braking_state = 0
-        joystick[0] = hx * turn_jog_factor
-        joystick[1] = hy * jog_factor
-        is_jogging = True
-    if use_experimental_ctrl and not is_jogging:
-      trig_jog_thres = 0.1
-      lt1 = l_trigger
-      rt1 = r_trigger
-      if True:
-        lt1 = 1.0 - lt1
-        rt1 = 1.0 - rt1
-      lt2 = (lt1 - trig_jog_thres) * (1.0 / (1.0 - trig_jog_thres))
-      rt2 = (rt1 - trig_jog_thres) * (1.0 / (1.0 - trig_jog_thres))
-      if lt2 > 0.0:
-        joystick[1] *= (1.0 - (1.0 - jog_factor) * lt2)
-      if rt2 > 0.0:
-        joystick[0] *= (1.0 - (1.0 - turn_jog_factor) * rt2)
-
-    soft_joy = np.array(joystick)
-    turn_ctrl.target_x = joystick[0]
-    if not soften_turns:
-      turn_ctrl.x = turn_ctrl.target_x
-      turn_ctrl.v = 0.0
-    soft_joy[0] = turn_ctrl.x
-
-    actual_speed = speed_ctrl.current_speed  # <<< Honest, Guv!
-    actual_speed = 0.5 * (lw_ctrl.current_speed + rw_ctrl.current_speed)
-
-    cmd_speed = max_ctrl_speed * soft_joy[1]
-    if limit_turn_rate:
-      max_omega_for_speed = turn_caps.max_turn_rate_for_speed(actual_speed)
-    omega = -max_omega_for_speed * soft_joy[0]
-    half_diff_speed = 0.5 * omega * pv.axle_width
-    mbztj_left = (cmd_speed - half_diff_speed) / max_wheel_speed
-    mbztj_right = (cmd_speed + half_diff_speed) / max_wheel_speed
-    mbztj_left = np.clip(mbztj_left, -1.0, +1.0)
-    mbztj_right = np.clip(mbztj_right, -1.0, +1.0)
-    # ~ ql = int(round(12 * 0.5 * (mbztj_left + 1.0)))
-    # ~ sl = "#" * ql + "-" * (12 - ql)
-    # ~ qr = int(round(12 * 0.5 * (mbztj_right + 1.0)))
-    # ~ sr = "#" * qr + "-" * (12 - qr)
-    # ~ print(sl, sr)
-    # ~ print(mbztj_left, mbztj_right)
-
-    if not use_experimental_ctrl:
-      bf = max(l_trigger, r_trigger)
-    speed_ctrl.input_braking_factor = bf
-    speed_ctrl.lever_pos = soft_joy[1]
-    speed_ctrl.max_speed = max_ctrl_speed
-    #speed_ctrl.current_speed = actual_speed
-    speed_ctrl.animate()
-    if not soften_speed:
-      speed_ctrl.target_speed = soft_joy[1] * max_ctrl_speed * (1.0 - bf)
-      speed_ctrl.current_speed = speed_ctrl.target_speed
-      speed_ctrl.v_pos_ctrl.x = speed_ctrl.target_speed
-      speed_ctrl.v_pos_ctrl.target_x = speed_ctrl.target_speed
-      speed_ctrl.v_pos_ctrl.v = 0.0
-    half_diff_speed = 0.5 * pv.axle_width * omega  #<<< redundant?
-    lw_ctrl.target_speed = speed_ctrl.current_speed - half_diff_speed
-    rw_ctrl.target_speed = speed_ctrl.current_speed + half_diff_speed
-    if ser is not None:
-      lw_ctrl.target_speed = ser_lm * max_wheel_speed
-      rw_ctrl.target_speed = ser_rm * max_wheel_speed
-    lw_ctrl.animate()
-    rw_ctrl.animate()
-
-    a = speed_ctrl.current_accel;
-    bf_thres = 0.05
-    if actual_speed < 0.0: a = -a
-    if a < -0.5 or speed_ctrl.joy_braking_state != 0 or bf >= bf_thres:
-      pv.stop_lamp_lit = True
-    if a >= -0.01 and speed_ctrl.joy_braking_state == 0 and bf < bf_thres:
-      pv.stop_lamp_lit = False
-
-    if num_js_buttons >= 6:
-      ldi = gpmap.btn(gamepad, GamepadBtn.LEFTSHOULDER)
-      rdi = gpmap.btn(gamepad, GamepadBtn.RIGHTSHOULDER)
-      pv.blinkers.input = (ldi << 1) + rdi
-    pv.blinkers.animate()
-
-    lw_trim_factor = max(0.0, min(1.0, 1.0 - (mistrim + trim)))
-    rw_trim_factor = max(0.0, min(1.0, 1.0 + (mistrim + trim)))
-
-    # Render stuff
-
-    screen.fill((0, 0, 0))
-    C = pv.pos + np.array([0.0, 0.0, 0.5])
-    d = 1.0 / vd_ctrl.x
-    if pov_mode == ViewMode.HIGH_LOOK_N:
-      view.pos = C + np.array([0.0, 0.0, 2 * d])
-      view.look_at(pv.pos, np.array([0.0, 1.0, 0.0]))
-    elif pov_mode == ViewMode.ARSE:
-      phi = np.radians(26)
-      dx = -d * np.cos(phi)
-      dz = d * np.sin(phi)
-      view.pos = C + dx * pv.ori[0] + np.array([0.0, 0.0, dz])
-      view.look_at(pv.pos, np.array([0, 0, 1.0]))
-    elif pov_mode == ViewMode.DRIVER:
-      view.pos = pv.pos + pv.driver_offset @ pv.ori
-      view.ori = pv.ori
-    elif pov_mode == ViewMode.REMOTE:
-      view.pos = fixed_cam_pos
-      view.look_at(C, np.array([0.0, 0.0, 1.0]))
-    else:
-      phi = np.radians(26)
-      view.pos = C + np.array([0.0, -d * np.cos(phi), d * np.sin(phi)])
-      view.look_at(pv.pos, np.array([0.0, 0.0, 1.0]))
-    view.update()
-
-    draw_ground_grid(screen, view, mvm, C, grid_mode)
-    draw_world_basis_vectors(screen, view, mvm)
-
-    portals = (
-     ((0, 4), 0, 4.0, (0xFFCC00, 1)),
-     ((6, 0), -45, 1.5, (0x00CC99, 1)),
-     ((4.5, -3.5), 87, 1.0, (0xFF7777, 1)),
-     ((12, -3.5), 90, 1.0, (0xFF7777, 1)),
-     ((15, -6.5), 180, 1.0, (0xFF7777, 1)),
-     ((15, -15), 180, 1.0, (0xFF7777, 1)),
-     ((12, -18), 270, 1.0, (0xFF7777, 1)),
-     ((4, -18), 270, 1.0, (0xFF7777, 1)),
-     ((-4, -18), 270, 1.0, (0xFF7777, 1)),
-     ((-7, -21), 180, 1.0, (0xFF7777, 1)),
-     ((-15, 0), 0, 1.4, (0xFF0000, 1)),
-     ((-15, 3), 0, 1.4, (0xFF7700, 1)),
-     ((-15, 6), 0, 1.4, (0xFFEE00, 1)),
-     ((-15, 9), 0, 1.4, (0x00AA00, 1)),
-     ((-15, 12), 0, 1.4, (0x0000FF, 1)),
-     ((-8, -15), 350, 2.0, (0xFFFF00, 1)),
-     ((-7, 18), 80, 2.0, (0x0088FF, 1)),
-     ((-0, 18), 100, 2.0, (0x0088FF, 1)),
-     ((0, -30), 0, 1.5, (0xFF00DD, 1)),
-     ((0, -30), 60, 1.5, (0xFF00DD, 1)),
-     ((0, -30), 120, 1.5, (0xFF00DD, 1)),
-     ((30, 20), 45, 0.8, (0xFF4400, 1)),
-     ((30, 30), 350, 0.8, (0xFF4400, 1)),
-     ((-4, -25), 0, 1.5, (0x00FFAA, 1)),
-     ((-4, -25), 60, 1.5, (0x00FFAA, 1)),
-     ((-4, -25), 120, 1.5, (0x00FFAA, 1)),
-    )
-    num_portals = [0, 15, len(portals)][playground_level]
-    for pos, naut_hdg, radius, styles in portals[:num_portals]:
-      mvm.push()
-      mvm.translate(pos)
-      mvm.rotate_z(np.radians(90 - naut_hdg))
-      draw_portal(screen, view, mvm, radius=radius, styles=styles)
-      mvm.pop()
+        )
+        joystick[:] = joy_vv2xy(bztj_left, bztj_right)
+        #print('BZT', bztj_left, bztj_right)
+        #print('Joy0 {:<5.3f} {:<5.3f}'.format(*joystick))
+        if sim.limit_turn_rate:
+          k = 1.0 # max_bzt_omega / max_omega
+          joystick[0] = np.clip(k * joystick[0], -1.0, +1.0)
+        #print('Joy1 {:<5.3f} {:<5.3f}'.format(*joystick))
+      elif idm == InputDeviceMode.JOYSTICK_ISO:
+        joystick = np.array([
+          sloppy_joy(
+            gpmap.axis(gamepad, GamepadAxis.LEFTX),
+            real_joy_slop_hw,
+          ),
+          sloppy_joy(
+            -gpmap.axis(gamepad, GamepadAxis.LEFTY),
+            real_joy_slop_hw,
+          ),
+        ])
+      elif idm == InputDeviceMode.JOYSTICKS_VH:
+        joystick = np.array([
+          sloppy_joy(
+            gpmap.axis(gamepad, GamepadAxis.RIGHTX),
+            real_joy_slop_hw,
+          ),
+          sloppy_joy(
+            -gpmap.axis(gamepad, GamepadAxis.LEFTY),
+            real_joy_slop_hw,
+          ),
+        ])
+      else:
+        # Fall back to InputDeviceMode.MOUSE
+        joystick = np.array((-1.0 + 2.0 * mx, 1.0 - 2.0 * my))
+        if aspect > 1.0: joystick[0] *= aspect
+        if aspect < 1.0: joystick[1] /= aspect
+        joystick[0] = sloppy_joy(joystick[0])
+        joystick[1] = sloppy_joy(joystick[1])
+        joystick = np.clip(mouse_joy_gain * joystick, -1.0, +1.0)
+
+      sim_inputs.joystick = joystick
+
+      sim_inputs.dpad = (0, 0)
+      if gpmap is not None:
+        dup = gpmap.btn(gamepad, GamepadBtn.DPAD_UP)
+        ddn = gpmap.btn(gamepad, GamepadBtn.DPAD_DOWN)
+        dle = gpmap.btn(gamepad, GamepadBtn.DPAD_LEFT)
+        dri = gpmap.btn(gamepad, GamepadBtn.DPAD_RIGHT)
+        hy = (0, 1)[dup] - (0, 1)[ddn]
+        hx = (0, 1)[dri] - (0, 1)[dle]
+        sim_inputs.dpad = (hx, hy)
+
+      if num_js_buttons >= 6:
+        ldi = gpmap.btn(gamepad, GamepadBtn.LEFTSHOULDER)
+        rdi = gpmap.btn(gamepad, GamepadBtn.RIGHTSHOULDER)
+        sim_inputs.blinker_btns = (ldi << 1) + rdi
+
+      sim_inputs.ser_override = ser is not None
+      sim_inputs.ser_lm = ser_lm
+      sim_inputs.ser_rm = ser_rm
+      sim_inputs.ser_lamps = ser_lamps
+
+      if recorder is not None:
+        recorder.write_frame(
+          sim, sim_inputs, current_vehicle_ix, delta_time, homed
+        )
+      alpha = sim.run(sim_inputs, delta_time)
+      if convoy is not None:
+        convoy_dt = min(delta_time, sim.max_frame_time)
+        convoy.follow(pv.pos, convoy_dt)
+        convoy.advance(convoy_dt)
+      joystick = sim.joystick
+      rpos, rori = sim.render_pose(alpha)
+
+      # Render stuff
+
+      screen.fill((0, 0, 0))
+      C = rpos + np.array([0.0, 0.0, 0.5])
+      d = 1.0 / vd_ctrl.x
+      if pov_mode == ViewMode.HIGH_LOOK_N:
+        view.pos = C + np.array([0.0, 0.0, 2 * d])
+        view.look_at(rpos, np.array([0.0, 1.0, 0.0]))
+      elif pov_mode == ViewMode.ARSE:
+        phi = np.radians(26)
+        dx = -d * np.cos(phi)
+        dz = d * np.sin(phi)
+        view.pos = C + dx * rori[0] + np.array([0.0, 0.0, dz])
+        view.look_at(rpos, np.array([0, 0, 1.0]))
+      elif pov_mode == ViewMode.DRIVER:
+        view.pos = rpos + pv.driver_offset @ rori
+        view.ori = rori
+      elif pov_mode == ViewMode.REMOTE:
+        view.pos = fixed_cam_pos
+        view.look_at(C, np.array([0.0, 0.0, 1.0]))
+      else:
+        phi = np.radians(26)
+        view.pos = C + np.array([0.0, -d * np.cos(phi), d * np.sin(phi)])
+        view.look_at(rpos, np.array([0.0, 0.0, 1.0]))
+      view.update()
+
+      # The 3D scene is drawn into a batch which is flushed before the
+      # instruments are drawn over it.
+      scene = LineBatch(screen)
+      draw_ground_grid(scene, view, mvm, C, grid_mode)
+      draw_world_basis_vectors(scene, view, mvm)
+
+      num_portals = [0, 15, len(playground.portals)][playground_level]
+      playground.draw_portals(scene, view, num_portals)
+
+      aux = dict()
+      if ser is not None:
+        aux['reversing'] = (ser_lamps >> 3) & 1;
+        aux['stop'] = (ser_lamps >> 2) & 1;
+        aux['ldi'] = (ser_lamps >> 1) & 1;
+        aux['rdi'] = (ser_lamps >> 0) & 1;
+      pv.draw(scene, view, mvm, aux, (rpos, rori))
+      if convoy is not None:
+        convoy.draw(scene, view, mvm)
+      if 0:
+        mvm.push()
+        mvm.translate(pv.pos[:2])
+        mvm.orient(pv.ori)
+        #draw_wfo(scene, view, mvm, wfo_sc5k_ref_box)
+        draw_wfo(scene, view, mvm, wfo_artcar1_ref_box)
+        mvm.pop()
+
+      # Draw the turning circle centre and the lateral acceleration vector.
+      turn_c = pv.instr_turn_centre
+      trac_c = rpos + pv.traction_offset @ rori
+
+      if turn_c is not None:
+        ir2 = 0.5 * np.sqrt(2.0)
+        points = np.array([
+          [0.0, 0.0], [0.0, 0.0],
+          [1.0, 0.0], [ir2, ir2], [0.0, 1.0], [-ir2, ir2],
+          [-1.0, 0.0], [-ir2, -ir2], [0.0, -1.0], [ir2, -ir2],
+        ]) + turn_c[:2].reshape((1, 2))
+        points[1] = trac_c[:2]
+        points = np.pad(points, ((0, 0), (0, 1)))
+        runs = ((0, 1), (3, 7), (5, 9), (2, 3, 4, 5, 6, 7, 8, 9, 2))
+        wfo_turn = (
+          None,
+          points,
+          (((0x009900, 1), runs),)
+        )
+        draw_wfo(scene, view, mvm, wfo_turn)
 
-    aux = dict()
-    if ser is not None:
-      aux['reversing'] = (ser_lamps >> 3) & 1;
-      aux['stop'] = (ser_lamps >> 2) & 1;
-      aux['ldi'] = (ser_lamps >> 1) & 1;
-      aux['rdi'] = (ser_lamps >> 0) & 1;
-    pv.draw(screen, view, mvm, aux)
-    if 0:
-      mvm.push()
-      mvm.translate(pv.pos[:2])
-      mvm.orient(pv.ori)
-      #draw_wfo(screen, view, mvm, wfo_sc5k_ref_box)
-      draw_wfo(screen, view, mvm, wfo_artcar1_ref_box)
-      mvm.pop()
-
-    # Draw the turning circle centre and the lateral acceleration vector.
-    turn_c = pv.instr_turn_centre
-    trac_c = pv.pos + pv.traction_offset @ pv.ori
-
-    if turn_c is not None:
-      ir2 = 0.5 * np.sqrt(2.0)
-      points = np.array([
-        [0.0, 0.0], [0.0, 0.0],
-        [1.0, 0.0], [ir2, ir2], [0.0, 1.0], [-ir2, ir2],
-        [-1.0, 0.0], [-ir2, -ir2], [0.0, -1.0], [ir2, -ir2],
-      ]) + turn_c[:2].reshape((1, 2))
-      points[1] = trac_c[:2]
-      points = np.pad(points, ((0, 0), (0, 1)))
-      runs = ((0, 1), (3, 7), (5, 9), (2, 3, 4, 5, 6, 7, 8, 9, 2))
-      wfo_turn = (
-        None,
-        points,
-        (((0x009900, 1), runs),)
+      draw_flat_vector(
+        scene, view, mvm,
+        trac_c, trac_c + pv.instr_lat_accel,
+        0xFF0000, 2
       )
-      draw_wfo(screen, view, mvm, wfo_turn)
 
-    draw_flat_vector(
-      screen, view, mvm,
-      trac_c, trac_c + pv.instr_lat_accel,
-      0xFF0000, 2
-    )
+      draw_flat_vector(
+        scene, view, mvm,
+        trac_c, trac_c + pv.instr_accel,
+        0xCC5500, 2
+      )
+      scene.flush()
 
-    draw_flat_vector(
-      screen, view, mvm,
-      trac_c, trac_c + pv.instr_accel,
-      0xCC5500, 2
-    )
+      knob_col = pg.Color(192, 240, 0)
+      margin = int(0.1 * round(joy_surface.get_width()))
+      bat_rect = pg.Rect((scr_margin, scr_margin), (16, 40))
+      swi_rect.right = joy_rect.right - margin
+      swi_rect.bottom = joy_rect.top - gutter
+      if ser is None:
+        if idm == InputDeviceMode.JOYSTICKS_HPAT:
+          # BZT levers
+          knob_col = (0, 190, 110)
+          lcol = rcol = knob_col
+          llev_surface.fill(instr_bg_col)
+          draw_lever(llev_surface, bztj_left, True, margin, knob_col=lcol)
+          screen.blit(llev_surface, llev_rect)
+          rlev_surface.fill(instr_bg_col)
+          draw_lever(rlev_surface, bztj_right, True, margin, knob_col=rcol)
+          screen.blit(rlev_surface, rlev_rect)
+          bat_rect.bottom = llev_rect.bottom
+          swi_rect.bottom = llev_rect.bottom - margin
+        elif idm == InputDeviceMode.JOYSTICKS_VH:
+          # 2-channel RC car-style separate-axes levers
+          knob_col = pg.Color(255, 96, 0)
+          vlev_surface.fill(instr_bg_col)
+          draw_lever(vlev_surface, joystick[1], True, margin,
+              knob_col=knob_col)
+          screen.blit(vlev_surface, vlev_rect)
+          hlev_surface.fill(instr_bg_col)
+          draw_lever(hlev_surface, joystick[0], True, margin,
+              knob_col=knob_col, horizontal=True)
+          screen.blit(hlev_surface, hlev_rect)
+          bat_rect.bottom = vlev_rect.top - gutter
+          swi_rect.bottom = hlev_rect.top - gutter
+        else:
+          # Single 2-axis joystick (or mouse)
+          joy_surface.fill(instr_bg_col)
+          if idm == InputDeviceMode.JOYSTICK_ISO:
+            knob_col = pg.Color(240, 0, 0)
+            draw_joystick(joy_surface, joystick, margin, knob_col=knob_col)
+          else:
+            knob_col = pg.Color(240, 0, 180)
+            draw_joystick(joy_surface, joystick, margin, knob_col=knob_col,
+                mouse=True)
+          screen.blit(joy_surface, joy_rect)
+          bat_rect.bottom = joy_rect.top - gutter
+          swi_rect.bottom = joy_rect.top - gutter
 
-    knob_col = pg.Color(192, 240, 0)
-    margin = int(0.1 * round(joy_surface.get_width()))
-    bat_rect = pg.Rect((scr_margin, scr_margin), (16, 40))
-    swi_rect.right = joy_rect.right - margin
-    swi_rect.bottom = joy_rect.top - gutter
-    if ser is None:
-      if idm == InputDeviceMode.JOYSTICKS_HPAT:
-        # BZT levers
-        knob_col = (0, 190, 110)
-        lcol = rcol = knob_col
-        llev_surface.fill(instr_bg_col)
-        draw_lever(llev_surface, bztj_left, True, margin, knob_col=lcol)
-        screen.blit(llev_surface, llev_rect)
-        rlev_surface.fill(instr_bg_col)
-        draw_lever(rlev_surface, bztj_right, True, margin, knob_col=rcol)
-        screen.blit(rlev_surface, rlev_rect)
-        bat_rect.bottom = llev_rect.bottom
-        swi_rect.bottom = llev_rect.bottom - margin
-      elif idm == InputDeviceMode.JOYSTICKS_VH:
-        # 2-channel RC car-style separate-axes levers
-        knob_col = pg.Color(255, 96, 0)
-        vlev_surface.fill(instr_bg_col)
-        draw_lever(vlev_surface, joystick[1], True, margin,
-            knob_col=knob_col)
-        screen.blit(vlev_surface, vlev_rect)
-        hlev_surface.fill(instr_bg_col)
-        draw_lever(hlev_surface, joystick[0], True, margin,
-            knob_col=knob_col, horizontal=True)
-        screen.blit(hlev_surface, hlev_rect)
-        bat_rect.bottom = vlev_rect.top - gutter
-        swi_rect.bottom = hlev_rect.top - gutter
-      else:
-        # Single 2-axis joystick (or mouse)
-        joy_surface.fill(instr_bg_col)
-        if idm == InputDeviceMode.JOYSTICK_ISO:
-          knob_col = pg.Color(240, 0, 0)
-          draw_joystick(joy_surface, joystick, margin, knob_col=knob_col)
+      if ser is None:
+        if not sim.limit_turn_rate:
+          s = im0i_surface
         else:
-          knob_col = pg.Color(240, 0, 180)
-          draw_joystick(joy_surface, joystick, margin, knob_col=knob_col,
-              mouse=True)
-        screen.blit(joy_surface, joy_rect)
-        bat_rect.bottom = joy_rect.top - gutter
-        swi_rect.bottom = joy_rect.top - gutter
-
-    if ser is None:
-      if not limit_turn_rate:
-        s = im0i_surface
-      else:
-        s = im2i_surface if turn_caps.reverse_turns else im1i_surface
-      screen.blit(s, imi_rect)
-
-    # Soft controller gauges
-    scgauges_surface.fill(instr_bg_col)
-    mcol = pg.Color(255, 255, 255)
-    ccol = pg.Color(255, 255, 255)
-    if motors_are_magic: mcol = knob_col
-    if not soften_speed: ccol = knob_col
-    inv_max_ws = 1.0 / max_wheel_speed
-    #lmtr_defl = lw_ctrl.current_speed * inv_max_ws
-    #rmtr_defl = rw_ctrl.current_speed * inv_max_ws
-    lmtr_defl = pv.lw_state.linspeed * inv_max_ws
-    rmtr_defl = pv.rw_state.linspeed * inv_max_ws
-    lcmd_defl = lw_ctrl.target_speed * inv_max_ws
-    rcmd_defl = rw_ctrl.target_speed * inv_max_ws
-    draw_lr_gauges(
-      scgauges_surface,
-      (lmtr_defl, rmtr_defl),
-      (lcmd_defl, rcmd_defl),
-      (mbztj_left, mbztj_right) if ser is None else (None, None),
-      (mcol, mcol),
-      (ccol, ccol),
-      (knob_col, knob_col),
-      margin,
-    )
-    screen.blit(scgauges_surface, scgauges_rect)
+          s = im2i_surface if turn_caps.reverse_turns else im1i_surface
+        screen.blit(s, imi_rect)
 
-    if ser is None:
-      # Turn rate gauge
-      tr_surface.fill(instr_bg_col)
+      # Soft controller gauges
+      scgauges_surface.fill(instr_bg_col)
       mcol = pg.Color(255, 255, 255)
       ccol = pg.Color(255, 255, 255)
-      inv_max_omega = 1.0 / max_omega
-      tdefl = joystick[0] * max_omega_for_speed * inv_max_omega
-      cdefl = soft_joy[0] * max_omega_for_speed * inv_max_omega
-      mdefl = -pv.instr_omega * inv_max_omega
-      if motors_are_magic:
-        mcol = knob_col
-      if not soften_turns:
-        ccol = knob_col
-      im = int(round(margin))
-      gh = (tr_rect.size[1] - 2 * im) * 0.75
-      igrect = pg.Rect((im, im), (tr_rect.size[0] - 2 * im, gh))
-      draw_gauge(
-        tr_surface,
-        igrect,
-        mdefl,
-        cdefl,
-        tdefl,
-        mtr_defl_col=mcol,
-        cmd_defl_col=ccol,
-        target_col=knob_col,
-        signed=True,
-        mirrored=False,
-        horizontal=True,
+      if sim.motors_are_magic: mcol = knob_col
+      if not sim.soften_speed: ccol = knob_col
+      inv_max_ws = 1.0 / sim.max_wheel_speed
+      #lmtr_defl = lw_ctrl.current_speed * inv_max_ws
+      #rmtr_defl = rw_ctrl.current_speed * inv_max_ws
+      lmtr_defl = pv.lw_state.linspeed * inv_max_ws
+      rmtr_defl = pv.rw_state.linspeed * inv_max_ws
+      lcmd_defl = lw_ctrl.target_speed * inv_max_ws
+      rcmd_defl = rw_ctrl.target_speed * inv_max_ws
+      draw_lr_gauges(
+        scgauges_surface,
+        (lmtr_defl, rmtr_defl),
+        (lcmd_defl, rcmd_defl),
+        (sim.mbztj_left, sim.mbztj_right) if ser is None else (None, None),
+        (mcol, mcol),
+        (ccol, ccol),
+        (knob_col, knob_col),
+        margin,
       )
-      screen.blit(tr_surface, tr_rect)
-
-    if trim != 0.0 or mistrim != 0.0 or trimming or zeroing_trim:
-      # Wheel trim gauge
-      wt_surface.fill(instr_bg_col)
-      k = -1.0 / max_trim
-      inv_max_omega = 1.0 / max_omega
-      im = int(round(margin))
-      gh = (wt_rect.size[1] - 2 * im) * 0.75
-      igrect = pg.Rect((im, im), (wt_rect.size[0] - 2 * im, gh))
+      screen.blit(scgauges_surface, scgauges_rect)
+
       if ser is None:
+        # Turn rate gauge
+        tr_surface.fill(instr_bg_col)
+        mcol = pg.Color(255, 255, 255)
+        ccol = pg.Color(255, 255, 255)
+        inv_max_omega = 1.0 / sim.max_omega
+        tdefl = joystick[0] * sim.max_omega_for_speed * inv_max_omega
+        cdefl = sim.soft_joy[0] * sim.max_omega_for_speed * inv_max_omega
+        mdefl = -pv.instr_omega * inv_max_omega
+        if sim.motors_are_magic:
+          mcol = knob_col
+        if not sim.soften_turns:
+          ccol = knob_col
+        im = int(round(margin))
+        gh = (tr_rect.size[1] - 2 * im) * 0.75
+        igrect = pg.Rect((im, im), (tr_rect.size[0] - 2 * im, gh))
         draw_gauge(
-          wt_surface,
+          tr_surface,
           igrect,
-          k * (mistrim + trim),
-          k * mistrim,
-          k * trim,
+          mdefl,
+          cdefl,
+          tdefl,
+          mtr_defl_col=mcol,
+          cmd_defl_col=ccol,
+          target_col=knob_col,
           signed=True,
-          mirrored=True,
+          mirrored=False,
           horizontal=True,
         )
-      else:
+        screen.blit(tr_surface, tr_rect)
+
+      if (sim.trim != 0.0 or sim.mistrim != 0.0
+          or sim.trimming or sim.zeroing_trim):
+        # Wheel trim gauge
+        wt_surface.fill(instr_bg_col)
+        k = -1.0 / sim.max_trim
+        inv_max_omega = 1.0 / sim.max_omega
+        im = int(round(margin))
+        gh = (wt_rect.size[1] - 2 * im) * 0.75
+        igrect = pg.Rect((im, im), (wt_rect.size[0] - 2 * im, gh))
+        if ser is None:
+          draw_gauge(
+            wt_surface,
+            igrect,
+            k * (sim.mistrim + sim.trim),
+            k * sim.mistrim,
+            k * sim.trim,
+            signed=True,
+            mirrored=True,
+            horizontal=True,
+          )
+        else:
+          draw_gauge(
+            wt_surface,
+            igrect,
+            None,
+            k * sim.mistrim,
+            None,
+            signed=True,
+            mirrored=True,
+            horizontal=True,
+          )
+        screen.blit(wt_surface, wt_rect)
+
+      if ser is None:
+        # Brake gauge
+        brake_surface.fill(instr_bg_col)
+        defl = speed_ctrl.effective_braking_factor
+        ccol = pg.Color(0, 0, 204)
+        if speed_ctrl.joy_braking_state != 0:
+          ccol = knob_col
+        im = int(round(margin))
+        gw = (brake_rect.size[0] - 2 * im) * 0.75
+        igrect = pg.Rect((im, im), (gw, brake_rect.size[1] - 2 * im))
         draw_gauge(
-          wt_surface,
+          brake_surface,
           igrect,
           None,
-          k * mistrim,
+          None if sim.trimming else defl,
           None,
-          signed=True,
+          mtr_defl_col=knob_col,
+          cmd_defl_col=ccol,
+          target_col=knob_col,
+          signed=False,
           mirrored=True,
-          horizontal=True,
+          horizontal=False,
         )
-      screen.blit(wt_surface, wt_rect)
-
-    if ser is None:
-      # Brake gauge
-      brake_surface.fill(instr_bg_col)
-      defl = speed_ctrl.effective_braking_factor
-      ccol = pg.Color(0, 0, 204)
-      if speed_ctrl.joy_braking_state != 0:
-        ccol = knob_col
-      im = int(round(margin))
-      gw = (brake_rect.size[0] - 2 * im) * 0.75
-      igrect = pg.Rect((im, im), (gw, brake_rect.size[1] - 2 * im))
-      draw_gauge(
-        brake_surface,
-        igrect,
-        None,
-        None if trimming else defl,
-        None,
-        mtr_defl_col=knob_col,
-        cmd_defl_col=ccol,
-        target_col=knob_col,
-        signed=False,
-        mirrored=True,
-        horizontal=False,
-      )
-      screen.blit(brake_surface, brake_rect)
-
-    if ser is None:
-      # Steering wheel indicator
-      if turn_caps.reverse_turns:
-        effective = limit_turn_rate and idm != InputDeviceMode.JOYSTICKS_HPAT
-        swi_surface.set_alpha(instr_icon_alphas[effective])
-        screen.blit(swi_surface, swi_rect)
-
-      # Magic motor indicator
-      if motors_are_magic:
-        screen.blit(mmi_surface, mmi_rect)
-
-      # Joy brake indicator
-      if speed_ctrl.enable_joy_brake:
-        effective = soften_speed
-        jbi_surface.set_alpha(instr_icon_alphas[effective])
-        screen.blit(jbi_surface, jbi_rect)
-
-      # Throttle indicator
-      if enable_throttle:
-        effective = soften_speed
-        ti_surface.set_alpha(instr_icon_alphas[effective])
-        screen.blit(ti_surface, ti_rect)
-
-    # Flat tyre indicator
-    if mistrim != 0.0:
-      effective = True
-      fti_surface.set_alpha(instr_icon_alphas[effective])
-      screen.blit(fti_surface, fti_rect)
-
-    # Battery indicator
-    if gamepad is not None:
-      if anim_counter & ((1 << 12) - 1) == 0:
-        s = gamepad.get_power_level()
-        levels = {
-          'empty': 0.0,
-          'low': 0.25,
-          'medium': 0.50,
-          'high': 0.75,
-          'full': 0.95,
-          'max': 1.0,
-        }
-        gamepad_bat_level = levels.get(s, -1.0)
-    if gamepad_bat_level >= 0.0:
-      draw_battery(screen, bat_rect, gamepad_bat_level)
-
-    # Numeric displays
-
-    w = screen.get_width()
-    std_digit_width = int(round(w * 20.0 / 1280.0))
-
-    # Speedometer (km/h)
-    digit_width = 3 * std_digit_width // 2
-    digit_height = 2 * digit_width
-    cx = 0.5 * w
-    x = cx - 4 * 1.6 * digit_width
-    speedo_rect = pg.Rect((x, 10), (digit_width, digit_height))
-    speed = 3.6 * (0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed))
-    nstr = "{:7.2f}".format(speed)
-    draw_nstr_7seg(screen, speedo_rect, 0xFFFFFF, nstr, seg_lw=5,
-        small_decimals=True)
-
-    digit_width = std_digit_width // 2
-    digit_height = 2 * digit_width
-
-    # Frames per second
-    cx = 0.005 * w
-    x = cx - 4 * 1.6 * digit_width
-    fps_rect = pg.Rect((x, 10), (digit_width, digit_height))
-    fps = 1.0 / delta_time
-    weight = 0.5
-    dampened_fps = dampened_fps + weight * (fps - dampened_fps)
-    nstr = "{:7.0f}".format(dampened_fps)
-    draw_nstr_7seg(screen, fps_rect, 0x0066FF, nstr, seg_lw=3,
-        small_decimals=True)
-
-    digit_width = std_digit_width
-    digit_height = 2 * digit_width
-
-    # Turning radius (metres)
-    if pv.instr_turn_centre is not None:
-      cx = 0.96 * w
-      x = cx - 4 * 1.6 * digit_width
-      trad_rect = pg.Rect((x, 10), (digit_width, digit_height))
-      r = la.norm(pv.instr_turn_centre - trac_c)
-      if abs(r) < 999.5:
-        nstr = "{:7.2f}".format(r)
-        draw_nstr_7seg(screen, trad_rect, 0x00BB00, nstr, seg_lw=4,
-            small_decimals=True)
-
-    # Angular speed (degrees per second)
-    # Though for right-handed land vehicle coordinates, positive rotation
-    # about the up vector corresponds to a left turn, the display is negated
-    # to reflect the rate of change of the more familiar nautical heading.
-    cx = 0.83 * w
-    x = cx - 4 * 1.6 * digit_width
-    speedo_rect = pg.Rect((x, 10), (digit_width, digit_height))
-    omega_deg = np.degrees(pv.instr_omega)
-    if omega_deg != 0.0: omega_deg = -omega_deg
-    nstr = "{:7.2f}".format(omega_deg)
-    draw_nstr_7seg(screen, speedo_rect, 0x00CCFF, nstr, seg_lw=4,
-        small_decimals=True)
-
-    # Lateral acceleration (metres per second per second)
-    cx = 0.68 * w
-    x = cx - 4 * 1.6 * digit_width
-    acc_rect = pg.Rect((x, 10), (digit_width, digit_height))
-    a = la.norm(pv.instr_lat_accel)
-    nstr = "{:7.2f}".format(a)
-    col = 0xFF0000
-    seg_lw = 4
-    if a > 2.0:
-      if ((anim_counter >> 7) & 1):
-        col, seg_lw = 0xFF0000, 6
-      else:
-        col, seg_lw = 0xFFDDDD, 4
-    draw_nstr_7seg(screen, acc_rect, col, nstr, seg_lw=seg_lw,
-        small_decimals=True)
-
-    # Acceleration (metres per second per second)
-    cx = 0.28 * w
-    x = cx - 4 * 1.6 * digit_width
-    acc_rect = pg.Rect((x, 10), (digit_width, digit_height))
-    a = la.norm(pv.instr_accel)
-    nstr = "{:7.2f}".format(a)
-    col = 0xCC6600
-    seg_lw = 4
-    if a > 9.81:
-      if ((anim_counter >> 7) & 1):
-        col, seg_lw = 0xFF6600, 6
-      else:
-        col, seg_lw = 0xFFEEDD, 4
-    draw_nstr_7seg(screen, acc_rect, col, nstr, seg_lw=seg_lw,
-        small_decimals=True)
-
-    if joydump and gamepad is not None and not do_exit:
-      m = ""
-      S = []
-      for i in range(gamepad.get_numaxes()):
-        a = gamepad.get_axis(i)
-        S.append("{:5.2f}".format(a))
-      axes = " ".join(S)
-      S = []
-      for i in range(gamepad.get_numbuttons()):
-        b = gamepad.get_button(i)
-        S.append((m[i] if i < len(m) else '1') if b else '-')
-      buttons = "".join(S)
-      S = []
-      for i in range(gamepad.get_numhats()):
-        h = gamepad.get_hat(i)
-        S.append("D-U"[h[1] + 1] + "L-R"[h[0] + 1])
-      hats = "".join(S)
-      print(axes, buttons, hats)
-
-    pg.display.update()
-    #print(len(mvm.stack))
-
-    dt_ms = clock.tick(max_fps)  # Frame rate in Hz
-    delta_time = dt_ms / 1000.0
-    anim_counter += dt_ms
-
-    turn_ctrl.advance(delta_time)
-
-    speed = 0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed)
-    pv.instr_last_vel = pv.ori[0] * speed
-
-    speed_ctrl.advance(delta_time)
-    lw_ctrl.v_pos_ctrl.integral = 0.0
-    rw_ctrl.v_pos_ctrl.integral = 0.0
-    lw_ctrl.advance(delta_time)
-    rw_ctrl.advance(delta_time)
-    if motors_are_magic:
-      lw_ctrl.current_speed = lw_ctrl.target_speed
-      rw_ctrl.current_speed = rw_ctrl.target_speed
-    pv.lw_state.ls_integral = lw_trim_factor * lw_ctrl.v_pos_ctrl.integral
-    pv.rw_state.ls_integral = rw_trim_factor * rw_ctrl.v_pos_ctrl.integral
-    pv.advance(delta_time)
-    pv.lw_state.linspeed = lw_trim_factor * lw_ctrl.current_speed
-    pv.rw_state.linspeed = rw_trim_factor * rw_ctrl.current_speed
-    speed = 0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed)
-    vel = pv.ori[0] * speed
-    pv.instr_accel = (vel - pv.instr_last_vel) / delta_time
+        screen.blit(brake_surface, brake_rect)
 
-    # Roughly model the scrubbing stress on the tires.
-    twist = 5.0 * pv.instr_omega * delta_time
-    f = 15.0
-    pv.lw_state.twist += twist
-    pv.rw_state.twist += twist
-    pv.lw_state.twist *= np.exp(-f * abs(pv.lw_state.linspeed) * delta_time)
-    pv.rw_state.twist *= np.exp(-f * abs(pv.rw_state.linspeed) * delta_time)
-    pv.lw_state.twist = np.clip(pv.lw_state.twist, -1.0, +1.0)
-    pv.rw_state.twist = np.clip(pv.rw_state.twist, -1.0, +1.0)
-
-    if zeroing_trim:
-      trim_v = 0.05
-      abs_delta_trim = trim_v * delta_time
-      if trim > 0.0:
-        trim = max(0.0, trim - abs_delta_trim)
-      elif trim < 0.0:
-        trim = min(0.0, trim + abs_delta_trim)
-      if trim == 0.0:
-        trim_v = 0.0
-    else:
-      trim += delta_time * trim_v
-      trim = np.clip(trim, -max_trim, +max_trim)
+      if ser is None:
+        # Steering wheel indicator
+        if turn_caps.reverse_turns:
+          effective = (sim.limit_turn_rate
+              and idm != InputDeviceMode.JOYSTICKS_HPAT)
+          swi_surface.set_alpha(instr_icon_alphas[effective])
+          screen.blit(swi_surface, swi_rect)
+
+        # Magic motor indicator
+        if sim.motors_are_magic:
+          screen.blit(mmi_surface, mmi_rect)
+
+        # Joy brake indicator
+        if speed_ctrl.enable_joy_brake:
+          effective = sim.soften_speed
+          jbi_surface.set_alpha(instr_icon_alphas[effective])
+          screen.blit(jbi_surface, jbi_rect)
+
+        # Throttle indicator
+        if sim.enable_throttle:
+          effective = sim.soften_speed
+          ti_surface.set_alpha(instr_icon_alphas[effective])
+          screen.blit(ti_surface, ti_rect)
+
+      # Flat tyre indicator
+      if sim.mistrim != 0.0:
+        effective = True
+        fti_surface.set_alpha(instr_icon_alphas[effective])
+        screen.blit(fti_surface, fti_rect)
+
+      # Battery indicator
+      if gamepad is not None:
+        if anim_counter & ((1 << 12) - 1) == 0:
+          s = gamepad.get_power_level()
+          levels = {
+            'empty': 0.0,
+            'low': 0.25,
+            'medium': 0.50,
+            'high': 0.75,
+            'full': 0.95,
+            'max': 1.0,
+          }
+          gamepad_bat_level = levels.get(s, -1.0)
+      if gamepad_bat_level >= 0.0:
+        draw_battery(screen, bat_rect, gamepad_bat_level)
+
+      # Numeric displays
+
+      w = screen.get_width()
+      std_digit_width = int(round(w * 20.0 / 1280.0))
+
+      # Speedometer (km/h)
+      digit_width = 3 * std_digit_width // 2
+      digit_height = 2 * digit_width
+      cx = 0.5 * w
+      x = cx - 4 * 1.6 * digit_width
+      speedo_rect = pg.Rect((x, 10), (digit_width, digit_height))
+      speed = 3.6 * (0.5 * (pv.lw_state.linspeed + pv.rw_state.linspeed))
+      nstr = "{:7.2f}".format(speed)
+      draw_nstr_7seg(screen, speedo_rect, 0xFFFFFF, nstr, seg_lw=5,
+          small_decimals=True)
 
-    pv.blinkers.advance(delta_time)
+      digit_width = std_digit_width // 2
+      digit_height = 2 * digit_width
 
-    # Update the (inverted) view distance.
-    vd_ctrl.advance(delta_time)
+      # Frames per second
+      cx = 0.005 * w
+      x = cx - 4 * 1.6 * digit_width
+      fps_rect = pg.Rect((x, 10), (digit_width, digit_height))
+      fps = 1.0 / delta_time
+      weight = 0.5
+      dampened_fps = dampened_fps + weight * (fps - dampened_fps)
+      nstr = "{:7.0f}".format(dampened_fps)
+      draw_nstr_7seg(screen, fps_rect, 0x0066FF, nstr, seg_lw=3,
+          small_decimals=True)
+
+      digit_width = std_digit_width
+      digit_height = 2 * digit_width
+
+      # Turning radius (metres)
+      if pv.instr_turn_centre is not None:
+        cx = 0.96 * w
+        x = cx - 4 * 1.6 * digit_width
+        trad_rect = pg.Rect((x, 10), (digit_width, digit_height))
+        r = la.norm(pv.instr_turn_centre - trac_c)
+        if abs(r) < 999.5:
+          nstr = "{:7.2f}".format(r)
+          draw_nstr_7seg(screen, trad_rect, 0x00BB00, nstr, seg_lw=4,
+              small_decimals=True)
+
+      # Angular speed (degrees per second)
+      # Though for right-handed land vehicle coordinates, positive rotation
+      # about the up vector corresponds to a left turn, the display is negated
+      # to reflect the rate of change of the more familiar nautical heading.
+      cx = 0.83 * w
+      x = cx - 4 * 1.6 * digit_width
+      speedo_rect = pg.Rect((x, 10), (digit_width, digit_height))
+      omega_deg = np.degrees(pv.instr_omega)
+      if omega_deg != 0.0: omega_deg = -omega_deg
+      nstr = "{:7.2f}".format(omega_deg)
+      draw_nstr_7seg(screen, speedo_rect, 0x00CCFF, nstr, seg_lw=4,
+          small_decimals=True)
+
+      # Lateral acceleration (metres per second per second)
+      cx = 0.68 * w
+      x = cx - 4 * 1.6 * digit_width
+      acc_rect = pg.Rect((x, 10), (digit_width, digit_height))
+      a = la.norm(pv.instr_lat_accel)
+      nstr = "{:7.2f}".format(a)
+      col = 0xFF0000
+      seg_lw = 4
+      if a > 2.0:
+        if ((anim_counter >> 7) & 1):
+          col, seg_lw = 0xFF0000, 6
+        else:
+          col, seg_lw = 0xFFDDDD, 4
+      draw_nstr_7seg(screen, acc_rect, col, nstr, seg_lw=seg_lw,
+          small_decimals=True)
 
-  if ser is not None:
-    ser.close();
+      # Acceleration (metres per second per second)
+      cx = 0.28 * w
+      x = cx - 4 * 1.6 * digit_width
+      acc_rect = pg.Rect((x, 10), (digit_width, digit_height))
+      a = la.norm(pv.instr_accel)
+      nstr = "{:7.2f}".format(a)
+      col = 0xCC6600
+      seg_lw = 4
+      if a > 9.81:
+        if ((anim_counter >> 7) & 1):
+          col, seg_lw = 0xFF6600, 6
+        else:
+          col, seg_lw = 0xFFEEDD, 4
+      draw_nstr_7seg(screen, acc_rect, col, nstr, seg_lw=seg_lw,
+          small_decimals=True)
+
+      if joydump and gamepad is not None and not do_exit:
+        m = ""
+        S = []
+        for i in range(gamepad.get_numaxes()):
+          a = gamepad.get_axis(i)
+          S.append("{:5.2f}".format(a))
+        axes = " ".join(S)
+        S = []
+        for i in range(gamepad.get_numbuttons()):
+          b = gamepad.get_button(i)
+          S.append((m[i] if i < len(m) else '1') if b else '-')
+        buttons = "".join(S)
+        S = []
+        for i in range(gamepad.get_numhats()):
+          h = gamepad.get_hat(i)
+          S.append("D-U"[h[1] + 1] + "L-R"[h[0] + 1])
+        hats = "".join(S)
+        print(axes, buttons, hats)
+
+      pg.display.update()
+      #print(mvm.depth)
+
+      dt_ms = clock.tick(max_fps)  # Frame rate in Hz
+      delta_time = dt_ms / 1000.0
+      anim_counter += dt_ms
+
+      # Update the (inverted) view distance.
+      vd_ctrl.advance(delta_time)
+
+  finally:
+    if ser is not None:
+      ser.close();
+    if recorder is not None:
+      recorder.f.close()
+      print("Recorded {} frames".format(recorder.num_frames))
 
 
 if __name__ == '__main__':
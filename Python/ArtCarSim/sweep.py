@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Parameter sweep over the vehicle properties of ArtCarSim
+#
+# Each case scales some of the hand-tuned properties of a vehicle in
+# vehicles_props and drives scripted manoeuvres with the headless
+# Simulation. The cases run in parallel on all cores and the results
+# are collected into one table, so that a new car can be tuned by
+# comparing numbers rather than by hours of driving.
+#
+# Examples:
+#   sweep.py --grid throttle_factor=0.5,1,2 --grid max_lat_accel=0.5,1
+#   sweep.py --vehicles 0,2 --random 200 --spread 2 --csv results.csv
+
+import os
+import argparse
+import csv
+import itertools
+import random
+import time
+import numpy as np
+import numpy.linalg as la
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from artcarsim import (
+  InputDeviceMode, MotorAccLimits, SimInputs, Simulation, vehicles_props
+)
+
+
+# Properties which may be swept. The MotorAccLimits ones scale all of
+# their accelerations and the jerk together.
+SWEEP_PARAMS = (
+  'throttle_factor',
+  'max_turn_rate',
+  'max_lat_accel',
+  'cruise_mal',
+  'braking_mal',
+  'wheel_mal',
+)
+
+PHYSICS_RATE = 100.0  # Hz
+TIME_LIMIT = 60.0  # s, for each phase of a manoeuvre
+
+
+def scaled_mal(mal, k):
+  return MotorAccLimits.full(
+    facc=k * mal.max_fwd_accel,
+    fdec=k * mal.max_fwd_decel,
+    racc=k * mal.max_rev_accel,
+    rdec=k * mal.max_rev_decel,
+    jerk=k * mal.max_jerk,
+  )
+
+
+def scaled_props(props, scales):
+  props = dict(props)
+  for name, k in scales.items():
+    if isinstance(props[name], MotorAccLimits):
+      props[name] = scaled_mal(props[name], k)
+    else:
+      props[name] = k * props[name]
+  return props
+
+
+def body_speed(sim):
+  return 0.5 * (sim.pv.lw_state.linspeed + sim.pv.rw_state.linspeed)
+
+
+def new_sim(props, use_exact_arcs):
+  sim = Simulation(props)
+  sim.physics_rate = PHYSICS_RATE
+  sim.use_exact_arcs = use_exact_arcs
+  sim.input_mode = InputDeviceMode.JOYSTICK_ISO
+  return sim
+
+
+def drive_to_speed(sim, inputs):
+  # Full forward stick from rest: Time to 90% of the maximum body speed
+  dt = 1.0 / sim.physics_rate
+  inputs.joystick = np.array([0.0, 1.0])
+  t0 = sim.time
+  while sim.time - t0 < TIME_LIMIT:
+    sim.step(inputs, dt)
+    if body_speed(sim) >= 0.9 * sim.max_body_speed:
+      return sim.time - t0
+  return np.inf
+
+
+def stopping_distance(sim, inputs):
+  # Centred stick and both brake triggers fully pressed
+  dt = 1.0 / sim.physics_rate
+  inputs.joystick = np.array([0.0, 0.0])
+  inputs.l_trigger = inputs.r_trigger = 1.0
+  start_pos = np.array(sim.pv.pos)
+  t0 = sim.time
+  while sim.time - t0 < TIME_LIMIT:
+    sim.step(inputs, dt)
+    if abs(body_speed(sim)) < 0.01:
+      return la.norm(sim.pv.pos - start_pos)
+  return np.inf
+
+
+def peak_lat_accel(sim, inputs, duration=5.0):
+  # Full right stick at full forward stick
+  dt = 1.0 / sim.physics_rate
+  inputs.joystick = np.array([1.0, 1.0])
+  peak = 0.0
+  t0 = sim.time
+  while sim.time - t0 < duration:
+    sim.step(inputs, dt)
+    peak = max(peak, la.norm(sim.pv.instr_lat_accel))
+  return peak
+
+
+def run_case(case):
+  vehicle_ix, scales, use_exact_arcs = case
+  props = scaled_props(vehicles_props[vehicle_ix], scales)
+  sim = new_sim(props, use_exact_arcs)
+  inputs = SimInputs()
+  tts = drive_to_speed(sim, inputs)
+  sd = stopping_distance(sim, inputs)
+  sim = new_sim(props, use_exact_arcs)
+  inputs = SimInputs()
+  drive_to_speed(sim, inputs)
+  pla = peak_lat_accel(sim, inputs)
+  return {
+    'max_body_speed': sim.max_body_speed,
+    'time_to_speed': tts,
+    'stopping_dist': sd,
+    'peak_lat_accel': pla,
+  }
+
+
+def parse_grid_arg(s):
+  name, _, values = s.partition("=")
+  if name not in SWEEP_PARAMS:
+    raise argparse.ArgumentTypeError(
+      "{} is not one of {}".format(name, ", ".join(SWEEP_PARAMS))
+    )
+  try:
+    return name, [float(x) for x in values.split(",")]
+  except ValueError:
+    raise argparse.ArgumentTypeError("Bad scale factors: " + values)
+
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description="Sweep ArtCarSim vehicle properties over scripted manoeuvres."
+  )
+  parser.add_argument("--vehicles", default=None,
+      help="comma separated indices into vehicles_props (default: all)")
+  parser.add_argument("--grid", metavar="PARAM=K1,K2,...",
+      type=parse_grid_arg, action="append", default=[],
+      help="scale factors for a property, may be repeated")
+  parser.add_argument("--random", metavar="N", type=int, default=0,
+      help="N random cases scaling every property instead of a grid")
+  parser.add_argument("--spread", type=float, default=2.0,
+      help="random scale factors are log-uniform in [1/spread, spread]")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--exact-arcs", action="store_true",
+      help="integrate each physics step piecewise exactly (slower)")
+  parser.add_argument("-j", "--jobs", type=int, default=None,
+      help="number of worker processes (default: all cores)")
+  parser.add_argument("--csv", metavar="FILE",
+      help="also write the results table to FILE")
+  args = parser.parse_args()
+
+  if args.vehicles is None:
+    vehicle_ixs = list(range(len(vehicles_props)))
+  else:
+    vehicle_ixs = [int(x) for x in args.vehicles.split(",")]
+
+  if args.random > 0:
+    params = list(SWEEP_PARAMS)
+    rng = random.Random(args.seed)
+    ln_spread = np.log(args.spread)
+    scale_sets = [
+      {p: float(np.exp(rng.uniform(-ln_spread, ln_spread))) for p in params}
+      for i in range(args.random)
+    ]
+  else:
+    params = [name for name, values in args.grid]
+    scale_sets = [
+      dict(zip(params, ks))
+      for ks in itertools.product(*[values for name, values in args.grid])
+    ]
+  cases = [(ix, scales, args.exact_arcs)
+           for ix in vehicle_ixs for scales in scale_sets]
+
+  t0 = time.perf_counter()
+  with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+    results = list(executor.map(run_case, cases, chunksize=4))
+  wall_time = time.perf_counter() - t0
+
+  metrics = ('max_body_speed', 'time_to_speed', 'stopping_dist',
+             'peak_lat_accel')
+  header = ["vehicle"] + params + list(metrics)
+  rows = []
+  for (ix, scales, use_exact_arcs), result in zip(cases, results):
+    rows.append(
+      [vehicles_props[ix].get('name', "Untitled")]
+      + ["{:.3f}".format(scales[p]) for p in params]
+      + ["{:.3f}".format(result[m]) for m in metrics]
+    )
+
+  widths = [max(len(str(row[i])) for row in [header] + rows)
+            for i in range(len(header))]
+  fmt = "  ".join(
+    ["{:<" + str(widths[0]) + "}"]
+    + ["{:>" + str(w) + "}" for w in widths[1:]]
+  )
+  print(fmt.format(*header))
+  for row in rows:
+    print(fmt.format(*row))
+  print("{} cases in {:.1f} s".format(len(cases), wall_time))
+
+  if args.csv is not None:
+    with open(args.csv, "w", newline="") as f:
+      csv.writer(f).writerows([header] + rows)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Fixed-point lookup tables of the TurnCaps curve for the ESP32
+#
+# TurnCaps::MaxTurnRateForSpeed() in turncaps.cpp evaluates the sigmoid
+# with expf() on every control step. This writes a C header with the
+# same curve as tables of unsigned 16-bit fractions of max_turn_rate,
+# one without and one with the reversing slope of reverse_turns mode,
+# and an inline lookup which interpolates linearly between entries.
+# The smallest table which keeps within the requested error is chosen,
+# and the maximum error of the lookup, evaluated in single precision
+# as on the microcontroller, is reported in the header.
+#
+# Examples:
+#   turncapslut.py -o ../../Arduino/esp32artcar/turncapslut.h
+#   turncapslut.py --vehicle 0 --max-error 1e-5
+
+import os
+import sys
+import argparse
+import numpy as np
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from artcarsim import TurnCaps, vehicles_props
+
+
+# The turning capabilities set by InitCar() in esp32artcar.ino
+ESP32_MAX_LAT_ACCEL = 2.0  # m/s^2
+ESP32_MAX_TURN_RATE_DEG = 12.5  # deg/s
+ESP32_REVERSING_OMEGA_SLOPE = 0.4
+
+TABLE_SIZES = (9, 17, 33, 65, 129, 257, 513, 1025, 2049, 4097)
+SAMPLES_PER_ENTRY = 32
+FIXED_ONE = 65535
+
+
+def table_speeds(size, c):
+  # Entries are uniform in u = |v| / (|v| + c), which maps all speeds
+  # into 0..1 with the finest steps around rest. The last entry is for
+  # an infinite speed.
+  u = np.linspace(0.0, 1.0, size)
+  with np.errstate(divide='ignore'):
+    return c * u / (1.0 - u)
+
+
+def fixed_table(turn_caps, size, c):
+  omega = turn_caps.max_turn_rate_formula(table_speeds(size, c))
+  q = np.rint(omega / turn_caps.max_turn_rate * FIXED_ONE)
+  return np.clip(q, 0, FIXED_ONE).astype(np.uint16)
+
+
+def lookup_f32(lut, v, c, max_turn_rate):
+  # The same arithmetic as TurnCapsLUTLookup() in the header
+  f32 = np.float32
+  a = np.abs(v.astype(f32))
+  with np.errstate(invalid='ignore'):
+    x = a / (a + f32(c)) * f32(len(lut) - 1)
+  x = np.where(x < f32(len(lut) - 1), x, f32(len(lut) - 1))
+  i = np.minimum(x.astype(np.int32), len(lut) - 2)
+  t = x - i.astype(f32)
+  w0 = lut[i].astype(f32)
+  w1 = lut[i + 1].astype(f32)
+  w = w0 + t * (w1 - w0)
+  return w * (f32(max_turn_rate) / f32(FIXED_ONE))
+
+
+def lookup_error(turn_caps, lut, c):
+  # Maximum absolute error over speeds at many points within each
+  # interval of the table, and the speed at which it occurs
+  n = (len(lut) - 1) * SAMPLES_PER_ENTRY
+  u = np.linspace(0.0, 1.0, n, endpoint=False)
+  v = c * u / (1.0 - u)
+  exact = turn_caps.max_turn_rate_formula(v)
+  err = np.abs(lookup_f32(lut, v, c, turn_caps.max_turn_rate) - exact)
+  i = int(np.argmax(err))
+  return float(err[i]), float(v[i])
+
+
+def c_array(name, values, per_line=8):
+  lines = []
+  for i in range(0, len(values), per_line):
+    lines.append("  " + ", ".join(
+      "{:5d}".format(int(x)) for x in values[i:i + per_line]
+    ) + ",")
+  return (
+    "const uint16_t {}[kTurnCapsLUTSize] = {{\n".format(name)
+    + "\n".join(lines) + "\n};\n"
+  )
+
+
+def c_header(turn_caps, c, luts, errors):
+  mla = turn_caps.max_lat_accel
+  mtr = turn_caps.max_turn_rate
+  ros = turn_caps.reversing_omega_slope
+  (err_fwd, v_fwd), (err_rev, v_rev) = errors
+  return """\
+#ifndef TURNCAPSLUT_H_
+#define TURNCAPSLUT_H_
+//-----------------------------------------------------------------------------
+// Turning capabilities as fixed-point lookup tables
+//-----------------------------------------------------------------------------
+
+
+// Generated by Python/ArtCarSim/turncapslut.py. Do not edit.
+//
+// max_lat_accel = {mla:.6g} m/s^2
+// max_turn_rate = {mtr:.6g} rad/s
+// reversing_omega_slope = {ros:.6g}
+//
+// Maximum error of TurnCapsLUTMaxTurnRate() against the exact curve,
+// as measured at {samples} speeds within each interval of the tables
+// (not a proven bound):
+//   {err_fwd:.3g} rad/s ({rel_fwd:.3g}% of max_turn_rate) at {v_fwd:.3g} m/s
+//   {err_rev:.3g} rad/s ({rel_rev:.3g}% of max_turn_rate) at {v_rev:.3g} m/s \
+with reverse_turns
+
+
+//-----------------------------------------------------------------------------
+
+
+#include <stdint.h>
+#include <math.h>
+
+
+//-----------------------------------------------------------------------------
+
+
+// Entries are uniform in u = |v| / (|v| + kTurnCapsLUTSpeedScale) from
+// rest (u = 0) to infinite speed (u = 1). Each entry is the turn rate
+// as a fraction of kTurnCapsLUTMaxTurnRate, with 65535 for 1.
+
+const int kTurnCapsLUTSize = {size};
+const float kTurnCapsLUTSpeedScale = {c:.9g}f;  // in m/s
+const float kTurnCapsLUTMaxTurnRate = {mtr:.9g}f;  // in rad/s
+
+{fwd_array}
+{rev_array}
+
+//-----------------------------------------------------------------------------
+
+
+inline float TurnCapsLUTLookup(const uint16_t* lut, float v) {{
+  float a = fabsf(v);
+  float x = a / (a + kTurnCapsLUTSpeedScale) * (float)(kTurnCapsLUTSize - 1);
+  // An infinite speed gives NaN, as does a NaN one. Both take the end
+  // of the table rather than an undefined conversion to int.
+  if (!(x < (float)(kTurnCapsLUTSize - 1))) x = (float)(kTurnCapsLUTSize - 1);
+  int i = (int)x;
+  if (i > kTurnCapsLUTSize - 2) i = kTurnCapsLUTSize - 2;
+  float t = x - (float)i;
+  float w = (float)lut[i] + t * ((float)lut[i + 1] - (float)lut[i]);
+  return w * (kTurnCapsLUTMaxTurnRate / 65535.0f);
+}}
+
+
+// A replacement for TurnCaps::MaxTurnRateForSpeed() with the parameters
+// above
+inline float TurnCapsLUTMaxTurnRate(float v, bool reverse_turns) {{
+  if (reverse_turns) {{
+    float omega = TurnCapsLUTLookup(kTurnCapsRevOmegaLUT, v);
+    return (v < 0.0f) ? -omega : omega;
+  }}
+  return TurnCapsLUTLookup(kTurnCapsOmegaLUT, v);
+}}
+
+
+//-----------------------------------------------------------------------------
+
+#endif  // TURNCAPSLUT_H_
+""".format(
+    mla=mla, mtr=mtr, ros=ros, c=c, size=len(luts[0]),
+    samples=SAMPLES_PER_ENTRY,
+    err_fwd=err_fwd, rel_fwd=100.0 * err_fwd / mtr, v_fwd=v_fwd,
+    err_rev=err_rev, rel_rev=100.0 * err_rev / mtr, v_rev=v_rev,
+    fwd_array=c_array("kTurnCapsOmegaLUT", luts[0]),
+    rev_array=c_array("kTurnCapsRevOmegaLUT", luts[1]),
+  )
+
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description="Write the TurnCaps curve as fixed-point C lookup tables."
+  )
+  parser.add_argument("--vehicle", type=int, default=None,
+      help="take the parameters from vehicles_props[VEHICLE] of ArtCarSim"
+           " (default: those set by InitCar() on the ESP32)")
+  parser.add_argument("--max-lat-accel", type=float, default=None,
+      help="in m/s^2")
+  parser.add_argument("--max-turn-rate", type=float, default=None,
+      help="in degrees per second")
+  parser.add_argument("--reversing-omega-slope", type=float, default=None)
+  parser.add_argument("--max-error", type=float, default=None,
+      help="largest acceptable error in rad/s"
+           " (default: 0.1%% of the maximum turn rate)")
+  parser.add_argument("-o", "--output", metavar="FILE",
+      help="write the header to FILE instead of standard output")
+  args = parser.parse_args()
+
+  T = TurnCaps()
+  if args.vehicle is not None:
+    props = vehicles_props[args.vehicle]
+    T.max_lat_accel = props['max_lat_accel']
+    T.max_turn_rate = props['max_turn_rate']
+    T.reversing_omega_slope = props['reversing_omega_slope']
+  else:
+    T.max_lat_accel = ESP32_MAX_LAT_ACCEL
+    T.max_turn_rate = np.radians(ESP32_MAX_TURN_RATE_DEG)
+    T.reversing_omega_slope = ESP32_REVERSING_OMEGA_SLOPE
+  if args.max_lat_accel is not None:
+    T.max_lat_accel = args.max_lat_accel
+  if args.max_turn_rate is not None:
+    T.max_turn_rate = np.radians(args.max_turn_rate)
+  if args.reversing_omega_slope is not None:
+    T.reversing_omega_slope = args.reversing_omega_slope
+  max_error = args.max_error
+  if max_error is None:
+    max_error = 1e-3 * T.max_turn_rate
+
+  c = T.max_lat_accel / T.max_turn_rate
+  for size in TABLE_SIZES:
+    luts = []
+    errors = []
+    for reverse_turns in (False, True):
+      T.reverse_turns = reverse_turns
+      luts.append(fixed_table(T, size, c))
+      errors.append(lookup_error(T, luts[-1], c))
+    if max(err for err, v in errors) <= max_error:
+      break
+  else:
+    raise SystemExit("No table of up to {} entries is within {} rad/s".format(
+        TABLE_SIZES[-1], max_error))
+
+  header = c_header(T, c, luts, errors)
+  if args.output is not None:
+    with open(args.output, "w") as f:
+      f.write(header)
+  else:
+    print(header, end="")
+
+  report = sys.stdout if args.output is not None else sys.stderr
+  print("{} entries per table, {} bytes".format(size, 4 * size), file=report)
+  for name, (err, v) in zip(("Forward", "Reverse turns"), errors):
+    print("{}: Maximum error {:.3g} rad/s ({:.3g}%) at {:.3g} m/s".format(
+        name, err, 100.0 * err / T.max_turn_rate, v), file=report)
+
+
+if __name__ == '__main__':
+  main()
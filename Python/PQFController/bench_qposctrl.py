@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Timing of the QPosCtrl engines in nanoseconds per controller advance
+#
+# Each engine advances controllers that start in random states (some
+# overspeeding, some needing to turn) towards random targets. The best
+# of several repeats is reported so that changes to qposctrl.py can be
+# compared by number rather than by feel.
+
+import argparse
+import timeit
+import numpy as np
+
+from qposctrl import QPosCtrl, QPosCtrlBank
+
+
+def random_bank(n, seed=0):
+  rng = np.random.default_rng(seed)
+  B = QPosCtrlBank(n)
+  B.x = rng.normal(0.0, 3.0, n)
+  B.v = rng.normal(0.0, 3.0, n)
+  B.target_x = rng.normal(0.0, 3.0, n)
+  B.max_fwd_v = rng.uniform(0.5, 4.0, n)
+  B.max_rev_v = rng.uniform(0.5, 4.0, n)
+  B.max_a = rng.uniform(0.5, 6.0, n)
+  return B
+
+
+def random_ctrls(n, use_float_engine, seed=0):
+  B = random_bank(n, seed)
+  ctrls = []
+  for i in range(n):
+    Q = QPosCtrl()
+    Q.x = float(B.x[i])
+    Q.v = float(B.v[i])
+    Q.target_x = float(B.target_x[i])
+    Q.max_fwd_v = float(B.max_fwd_v[i])
+    Q.max_rev_v = float(B.max_rev_v[i])
+    Q.max_a = float(B.max_a[i])
+    Q.use_float_engine = use_float_engine
+    ctrls.append(Q)
+  return ctrls
+
+
+def best_ns(fn, number, repeat):
+  return 1e9 * min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description="Time the QPosCtrl engines."
+  )
+  parser.add_argument("-r", "--repeat", type=int, default=5,
+      help="number of repeats, of which the best is reported")
+  args = parser.parse_args()
+
+  delta_time = 0.01
+  num_ctrls = 1000
+  results = []
+
+  for name, use_float_engine in (("float", True), ("numpy", False)):
+    ctrls = random_ctrls(num_ctrls, use_float_engine)
+    def advance_all():
+      for Q in ctrls:
+        Q.advance(delta_time)
+    ns = best_ns(advance_all, 10, args.repeat) / num_ctrls
+    results.append(("QPosCtrl.advance ({})".format(name), ns))
+
+  for n in (1, 100, 10000, 1000000):
+    B = random_bank(n)
+    number = max(1, 2000 // n)
+    ns = best_ns(lambda: B.advance(delta_time), number, args.repeat) / n
+    results.append(("QPosCtrlBank.advance (n = {})".format(n), ns))
+
+  ctrls = random_ctrls(num_ctrls, True)
+  def plan_all():
+    for Q in ctrls:
+      Q.plan()
+  ns = best_ns(plan_all, 2, args.repeat) / num_ctrls
+  results.append(("QPosCtrl.plan", ns))
+
+  num_samples = 100000
+  T = ctrls[0].plan()
+  t = np.linspace(0.0, 1.1 * T.time_to_rest, num_samples)
+  ns = best_ns(lambda: T.eval(t), 10, args.repeat) / num_samples
+  results.append(("QTrajectory.eval (per sample)", ns))
+
+  print("{:<36} {:>12}".format("Engine", "ns/advance"))
+  for name, ns in results:
+    print("{:<36} {:>12.1f}".format(name, ns))
+
+
+if __name__ == '__main__':
+  main()
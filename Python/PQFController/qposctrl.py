@@ -0,0 +1,631 @@
+# Quadratic position control, shared by ArtCarSim and the PQF plots
+#
+# QPosCtrl - A single controller with float and NumPy engines
+# QTrajectory - The whole piecewise quadratic trajectory of a QPosCtrl
+# QPosCtrlBank - Many controllers advanced together with array arithmetic
+
+
+import math
+import numpy as np
+
+
+def qkf_integral(t0, x0, v0, a, t1, delta_time):
+  # Contribution of one quadratic kinematic function piece to the
+  # integral of x accumulated by QPosCtrl.advance(delta_time). The
+  # piece begins at t0 and ends at t1.
+  if t0 < 0:
+    x0 += (0.5 * a * t0 - v0) * t0
+    v0 -= a * t0
+  sdt = min(delta_time, t1) - t0
+  return sdt * (x0 + sdt * (0.5 * v0 + sdt * (1.0/6.0) * a))
+
+
+class QPosCtrl (object):
+
+  def __init__(self):
+    self.x = 0.0
+    self.v = 0.0
+    self.target_x = 0.0
+    self.max_fwd_v = 1e6
+    self.max_rev_v = 1e6
+    self.max_a = 1e6
+    self.integral = 0.0
+    # The float engine gives identical results to the NumPy engine
+    # without the cost of building small arrays on every call.
+    self.use_float_engine = True
+
+  def advance(self, delta_time):
+    if self.use_float_engine:
+      self.advance_float(delta_time)
+    else:
+      self.advance_numpy(delta_time)
+
+  def advance_float(self, delta_time):
+
+    # This is the same algorithm as advance_numpy() but written with plain
+    # floats and the math module so that no arrays are built on each call.
+    # The arithmetic is performed in the same order, so the results for
+    # x, v and the integral are identical.
+
+    max_a = self.max_a
+    max_fwd_v = self.max_fwd_v
+    max_rev_v = self.max_rev_v
+    target_x = self.target_x
+
+    accel = math.copysign(max_a, self.v)
+    decel = -accel
+
+    # Rein
+    dv_rein = 0.0
+    if self.v > max_fwd_v:
+      dv_rein = max_fwd_v - self.v
+    elif self.v < -max_rev_v:
+      dv_rein = -max_rev_v - self.v
+    dt_rein = abs(dv_rein) / max_a
+    dx_rein = (self.v + 0.5 * decel * dt_rein) * dt_rein
+    rein_x = self.x
+    rein_v = self.v
+    rein_a = decel
+
+    # Turn
+    turn_t = dt_rein
+    turn_x = rein_x + dx_rein
+    turn_v = rein_v + dv_rein
+    turn_a = decel
+
+    dt_msd = abs(turn_v) / max_a
+    dx_msd = dt_msd * (turn_v + 0.5 * dt_msd * decel)
+    x_at_msd = turn_x + dx_msd
+
+    HeadingWrongWay = (target_x < turn_x) != (turn_v < 0)
+    WillOvershootAnyway = (target_x < x_at_msd) != (dx_msd < 0.0)
+
+    # Lurch
+    if HeadingWrongWay or WillOvershootAnyway:
+      lurch_t = turn_t + dt_msd
+      lurch_x = turn_x + dx_msd
+      lurch_v = 0.0
+      t_bplurch = lurch_t
+      x_bplurch = lurch_x
+    else:
+      lurch_t = turn_t
+      lurch_x = turn_x
+      lurch_v = turn_v
+      t_bplurch = lurch_t - dt_msd
+      x_bplurch = lurch_x - dx_msd
+
+    dx = target_x - x_bplurch
+    adx = abs(dx)
+    accel = math.copysign(max_a, dx)
+    decel = -accel
+    max_v = max_rev_v if dx <= 0.0 else max_fwd_v
+    max_dx_for_triangular_v = (max_v * max_v) / max_a
+
+    if adx <= max_dx_for_triangular_v:
+      dt_vramp = math.sqrt(adx / max_a)
+      dx_for_triangular_v = adx
+      lsd = 0.0
+      lst = 0.0
+      inflection_v = max_a * dt_vramp
+    else:
+      dt_vramp = max_v / max_a
+      dx_for_triangular_v = max_dx_for_triangular_v
+      lsd = adx - max_dx_for_triangular_v
+      lst = lsd / max(1e-12, max_v)
+      inflection_v = max_v
+
+    lurch_a = accel
+
+    # Cruise
+    cruise_t = t_bplurch + dt_vramp
+    cruise_x = x_bplurch + 0.5 * math.copysign(dx_for_triangular_v, dx)
+    cruise_v = brake_v = math.copysign(inflection_v, dx)
+
+    # Brake
+    brake_t = cruise_t + lst
+    brake_x = cruise_x + math.copysign(lsd, dx)
+    brake_a = decel
+
+    # Rest
+    rest_t = brake_t + dt_vramp
+    rest_x = target_x
+
+    if delta_time < lurch_t:
+      qkf_ix = 0 if delta_time < turn_t else 1
+    elif delta_time < brake_t:
+      qkf_ix = 2 if delta_time < cruise_t else 3
+    else:
+      qkf_ix = 4 if delta_time < rest_t else 5
+
+    # Integrate x piece by piece, stopping at the selected piece.
+    integral = self.integral
+    t0 = 0.0
+    if turn_t >= 0.0:
+      integral += qkf_integral(
+        t0, rein_x, rein_v, rein_a, turn_t, delta_time)
+    if qkf_ix >= 1:
+      if lurch_t >= 0.0:
+        t0 = turn_t
+        integral += qkf_integral(
+          t0, turn_x, turn_v, turn_a, lurch_t, delta_time)
+      if qkf_ix >= 2:
+        if cruise_t >= 0.0:
+          t0 = lurch_t
+          integral += qkf_integral(
+            t0, lurch_x, lurch_v, lurch_a, cruise_t, delta_time)
+        if qkf_ix >= 3:
+          if brake_t >= 0.0:
+            t0 = cruise_t
+            integral += qkf_integral(
+              t0, cruise_x, cruise_v, 0.0, brake_t, delta_time)
+          if qkf_ix >= 4:
+            if rest_t >= 0.0:
+              t0 = brake_t
+              integral += qkf_integral(
+                t0, brake_x, brake_v, brake_a, rest_t, delta_time)
+            if qkf_ix >= 5:
+              t1 = t0 + delta_time
+              if t1 >= 0.0:
+                integral += qkf_integral(
+                  rest_t, rest_x, 0.0, 0.0, t1, delta_time)
+    self.integral = integral
+
+    if qkf_ix == 0:
+      t0, x0, v0, a = 0.0, rein_x, rein_v, rein_a
+    elif qkf_ix == 1:
+      t0, x0, v0, a = turn_t, turn_x, turn_v, turn_a
+    elif qkf_ix == 2:
+      t0, x0, v0, a = lurch_t, lurch_x, lurch_v, lurch_a
+    elif qkf_ix == 3:
+      t0, x0, v0, a = cruise_t, cruise_x, cruise_v, 0.0
+    elif qkf_ix == 4:
+      t0, x0, v0, a = brake_t, brake_x, brake_v, brake_a
+    else:
+      t0, x0, v0, a = rest_t, rest_x, 0.0, 0.0
+
+    t = delta_time - t0
+    self.x = x0 + t * (v0 + 0.5 * t * a)
+    self.v = v0 + t * a
+
+  def plan(self):
+    # Return the whole trajectory that advance() would follow from the
+    # present state if the target and the limits were left unchanged.
+    return QTrajectory(*np.array(self.pieces()).T)
+
+  def advance_numpy(self, delta_time):
+
+    TIME = 0
+    POS = 1
+    VEL = 2
+    ACC = 3
+
+    qkfs = self.pieces()
+    rein, turn, lurch, cruise, brake, rest = qkfs
+
+    # Evaluate the piecewise quadratic function at t = dt.
+    if delta_time < lurch[TIME]:
+      if delta_time < turn[TIME]:
+        qkf_ix = 0  # rein
+      else:
+        qkf_ix = 1  # turn
+    elif delta_time < brake[TIME]:
+      if delta_time < cruise[TIME]:
+        qkf_ix = 2  # lurch
+      else:
+        qkf_ix = 3  # cruise
+    else:
+      if delta_time < rest[TIME]:
+        qkf_ix = 4  # brake
+      else:
+        qkf_ix = 5  # rest
+
+    # Bonus feature: x is integrated.
+    for i in range(0, qkf_ix + 1):
+      t1 = qkfs[i + 1][TIME] if i + 1 < len(qkfs) else t0 + delta_time
+      if t1 >= 0.0:
+        qkf = qkfs[i]
+        t0 = qkf[TIME]
+        x0 = qkf[POS]
+        v0 = qkf[VEL]
+        a = qkf[ACC]
+        if t0 < 0:
+          x0 += (0.5 * a * t0 - v0) * t0
+          v0 -= a * t0
+        sdt = min(delta_time, t1) - t0
+        self.integral += sdt * (x0 + sdt * (0.5 * v0 + sdt * (1.0/6.0) * a))
+
+    qkf = qkfs[qkf_ix]
+
+    t = delta_time - qkf[TIME]
+    # Horner's method avoids raising small numbers to high powers
+    # and halves the number of multiplications needed to evaluate
+    # a polynomial.
+    self.x = qkf[POS] + t * (qkf[VEL] + 0.5 * t * qkf[ACC])
+    self.v = qkf[VEL] + t * qkf[ACC]
+
+  def pieces(self):
+
+    # There are five segments of the piecewise quadratic kinematic function:
+    #
+    # Rein - Correct any overspeeding
+    # Turn - Quadratic (required to correct overshoot)
+    # Lurch - Quadratic (may be projected to have a past starting point)
+    # Cruise - Linear
+    # Brake - Quadratic
+    #
+    # A dummy "Rest" piece is appended to maintain consistent execution time.
+    #
+    # Each function curve piece is defined by a tuple of four values:
+    #   * Time (relative to "now") at the beginning of the curve;
+    #   * position (x) at the beginning of the curve;
+    #   * velocity, the derivative of x, at the beginning of the curve and
+    #   * acceleration, the second derivative of x. for the curve.
+    #
+    # In general, x(t) = x0 + v0 * (t - t0) + 0.5 * a * (t - t0)**2
+
+    rein = np.zeros([4])
+    turn = np.zeros([4])
+    lurch = np.zeros([4])
+    cruise = np.zeros([4])
+    brake = np.zeros([4])
+    rest = np.zeros([4])
+
+    TIME = 0
+    POS = 1
+    VEL = 2
+    ACC = 3
+
+    accel = np.copysign(self.max_a, self.v)
+    decel = -accel
+
+    # Rein in the current velocity if it is
+    # larger than the maximum velocity.
+    dv_rein = 0.0
+    if self.v > self.max_fwd_v:
+      dv_rein = self.max_fwd_v - self.v
+    elif self.v < -self.max_rev_v:
+      dv_rein = -self.max_rev_v - self.v
+    dt_rein = abs(dv_rein) / self.max_a
+    dx_rein = (self.v + 0.5 * decel * dt_rein) * dt_rein
+    rein[TIME] = 0.0
+    rein[POS] = self.x
+    rein[VEL] = self.v
+    rein[ACC] = decel
+    turn[TIME] = rein[TIME] + dt_rein
+    turn[POS] = rein[POS] + dx_rein
+    turn[VEL] = rein[VEL] + dv_rein
+    turn[ACC] = decel
+
+    # Now that any overspeeding has been corrected, consider
+    # (turn[TIME], turn[POS], turn[VEL]) to be the initial state.
+
+    # Find the minimum stopping time and the displacement
+    # at that time if full deceleration were applied.
+    dt_msd = abs(turn[VEL]) / self.max_a
+    dx_msd = dt_msd * (turn[VEL] + 0.5 * dt_msd * decel)
+    t_at_msd = turn[TIME] + dt_msd
+    x_at_msd = turn[POS] + dx_msd
+
+    HeadingWrongWay = (self.target_x < turn[POS]) != (turn[VEL] < 0)
+    WillOvershootAnyway = (self.target_x < x_at_msd) != (dx_msd < 0.0)
+
+    if HeadingWrongWay or WillOvershootAnyway:
+      # Decelerate to a stop and prepare to lurch
+      # in the other direction.
+      lurch[TIME] = turn[TIME] + dt_msd
+      lurch[POS] = turn[POS] + dx_msd
+      lurch[VEL] = 0.0
+      # The back-projected time of initial rest for the
+      # lurch is the same as for the beginning of the
+      # lurch segment.
+      t_bplurch = lurch[TIME]
+      x_bplurch = lurch[POS]
+    else:
+      # No turning is necessary.
+      # Proceed to lurch (or lurch even more).
+      lurch[TIME] = turn[TIME]
+      lurch[POS] = turn[POS]
+      lurch[VEL] = turn[VEL]
+      t_bplurch = lurch[TIME] - dt_msd
+      x_bplurch = lurch[POS] - dx_msd
+
+    # From here on, the position is a monotonic function.
+    # It is convenient to pretend that it is constant
+    # or monotonically increasing.
+    dx = self.target_x - x_bplurch
+    adx = abs(dx)
+    accel = np.copysign(self.max_a, dx)
+    decel = -accel
+    max_v = self.max_rev_v if dx <= 0.0 else self.max_fwd_v
+    max_dx_for_triangular_v = (max_v * max_v) / self.max_a
+
+    if adx <= max_dx_for_triangular_v:
+      # Maximum speed not required
+      dt_vramp = np.sqrt(adx / self.max_a)
+      dx_for_triangular_v = adx
+      lsd = 0.0
+      lst = 0.0
+      inflection_v = self.max_a * dt_vramp
+    else:
+      # Linear segment where maximum speed is sustained
+      dt_vramp = max_v / self.max_a
+      dx_for_triangular_v = max_dx_for_triangular_v
+      lsd = adx - max_dx_for_triangular_v
+      lst = lsd / max(1e-12, max_v)
+      inflection_v = max_v
+
+    # Acceleration
+    lurch[ACC] = accel
+
+    # Linear segment
+    cruise[TIME] = t_bplurch + dt_vramp
+    cruise[POS] = x_bplurch + 0.5 * np.copysign(dx_for_triangular_v, dx)
+    cruise[VEL] = brake[VEL] = np.copysign(inflection_v, dx)
+    cruise[ACC] = 0.0
+
+    # Deceleration
+    brake[TIME] = cruise[TIME] + lst
+    brake[POS] = cruise[POS] + np.copysign(lsd, dx)
+    brake[ACC] = decel
+
+    # Rest
+    rest[TIME] = brake[TIME] + dt_vramp
+    rest[POS] = self.target_x
+    rest[VEL] = 0.0
+    rest[ACC] = 0.0
+
+    return (rein, turn, lurch, cruise, brake, rest)
+
+
+class QTrajectory (object):
+
+  # An immutable piecewise quadratic function of time such as the one
+  # planned by QPosCtrl.plan(). Piece i begins at time t[i] (relative to
+  # the time of planning) with position x[i] and velocity v[i] and has a
+  # constant acceleration a[i]. The last piece extends indefinitely.
+  #
+  # Queries accept arrays of times or positions and locate the pieces
+  # by binary search.
+
+  def __init__(self, t, x, v, a):
+    # Rounding may leave a zero-length piece starting a hair too early.
+    self.t = np.maximum.accumulate(np.array(t, dtype=float))
+    self.x = np.array(x, dtype=float)
+    self.v = np.array(v, dtype=float)
+    self.a = np.array(a, dtype=float)
+    dt = np.diff(self.t)
+    x0, v0, a0 = self.x[:-1], self.v[:-1], self.a[:-1]
+    # Positions at the ends of the pieces
+    x_end = x0 + dt * (v0 + 0.5 * dt * a0)
+    # Integral of x from t = 0 to the beginning of each piece
+    I = dt * (x0 + dt * (0.5 * v0 + dt * (1.0/6.0) * a0))
+    self.start_integral = np.concatenate(([0.0], np.cumsum(I)))
+    # From piece mono_ix onwards, x is monotonic.
+    steps = np.sign(x_end - x0)
+    direction = 0.0
+    mono_ix = len(steps)
+    while mono_ix > 0 and steps[mono_ix - 1] * direction >= 0.0:
+      mono_ix -= 1
+      if steps[mono_ix] != 0.0:
+        direction = steps[mono_ix]
+    self.mono_ix = mono_ix
+    self.direction = direction if direction != 0.0 else 1.0
+    self.x_end = np.append(x_end, self.x[-1])
+    self.time_to_rest = self.t[-1]
+    for A in (self.t, self.x, self.v, self.a, self.x_end, self.start_integral):
+      A.flags.writeable = False
+
+  def __len__(self):
+    return len(self.t)
+
+  def piece_ix(self, t):
+    ix = np.searchsorted(self.t, t, side='right') - 1
+    return np.clip(ix, 0, len(self.t) - 1)
+
+  def eval(self, t):
+    # Return the position and velocity at each given time.
+    t = np.asarray(t, dtype=float)
+    i = self.piece_ix(t)
+    s = t - self.t[i]
+    x = self.x[i] + s * (self.v[i] + 0.5 * s * self.a[i])
+    v = self.v[i] + s * self.a[i]
+    return x, v
+
+  def integral(self, t):
+    # Return the integral of the position from time zero to each time.
+    t = np.asarray(t, dtype=float)
+    i = self.piece_ix(t)
+    s = t - self.t[i]
+    I = s * (self.x[i] + s * (0.5 * self.v[i] + s * (1.0/6.0) * self.a[i]))
+    return self.start_integral[i] + I
+
+  def time_to_reach(self, x):
+
+    # Return the earliest time at which each given position is reached,
+    # or infinity if it never is. Within each piece, the position is
+    # monotonic, so if the position lies between the ends of a piece,
+    # it is reached exactly once within that piece.
+
+    X = np.asarray(x, dtype=float)
+    n = len(self.t)
+    ix = np.full(X.shape, n)
+
+    # The few pieces before the trajectory becomes monotonic must be
+    # searched in order.
+    for i in range(self.mono_ix - 1, -1, -1):
+      d0 = self.x[i] - X
+      d1 = self.x_end[i] - X
+      ix = np.where((d0 <= 0.0) != (d1 < 0.0), i, ix)
+      ix = np.where(d0 == 0.0, i, ix)
+
+    # Binary search in the monotonic remainder
+    m = self.mono_ix
+    xb = self.direction * self.x[m:]
+    xe = self.direction * self.x_end[-1]
+    dX = self.direction * X
+    j = m + np.searchsorted(xb, dX, side='right') - 1
+    j = np.clip(j, m, n - 1)
+    in_tail = (xb[0] <= dX) & (dX <= xe)
+    ix = np.where((ix == n) & in_tail, j, ix)
+
+    # Solve x0 + v0 * s + 0.5 * a * s**2 = X for s within each piece.
+    found = ix < n
+    i = np.where(found, ix, 0)
+    d = X - self.x[i]
+    v0 = self.v[i]
+    a = self.a[i]
+    piece_dir = np.sign(self.x_end[i] - self.x[i])
+    disc = np.maximum(0.0, v0 * v0 + 2.0 * a * d)
+    denom = v0 + np.copysign(np.sqrt(disc), piece_dir)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      s = np.where(d == 0.0, 0.0, 2.0 * d / denom)
+    s_max = np.append(np.diff(self.t), np.inf)[i]
+    s = np.clip(np.nan_to_num(s), 0.0, s_max)
+    return np.where(found, self.t[i] + s, np.inf)
+
+
+class QPosCtrlBank (object):
+
+  # A bank of independent QPosCtrl-like controllers held as a structure
+  # of arrays, one element per controller. All controllers are advanced
+  # together: the branches of QPosCtrl.advance become masked selections
+  # so that the per-controller results match the scalar version.
+
+  def __init__(self, n):
+    self.x = np.zeros(n)
+    self.v = np.zeros(n)
+    self.target_x = np.zeros(n)
+    self.max_fwd_v = np.full(n, 1e6)
+    self.max_rev_v = np.full(n, 1e6)
+    self.max_a = np.full(n, 1e6)
+    self.integral = np.zeros(n)
+
+  def __len__(self):
+    return len(self.x)
+
+  def advance(self, delta_time):
+
+    # The pieces are the same as for QPosCtrl.advance: Rein, Turn, Lurch,
+    # Cruise, Brake and Rest. Here, qkfs[piece, quantity] is an array
+    # with one element per controller. The delta time may be a scalar or
+    # an array with one element per controller.
+
+    n = len(self.x)
+    qkfs = np.zeros((6, 4, n))
+    rein, turn, lurch, cruise, brake, rest = qkfs
+
+    TIME = 0
+    POS = 1
+    VEL = 2
+    ACC = 3
+
+    accel = np.copysign(self.max_a, self.v)
+    decel = -accel
+
+    # Rein in the current velocity where it is
+    # larger than the maximum velocity.
+    dv_rein = np.where(
+      self.v > self.max_fwd_v,
+      self.max_fwd_v - self.v,
+      np.where(self.v < -self.max_rev_v, -self.max_rev_v - self.v, 0.0),
+    )
+    dt_rein = np.abs(dv_rein) / self.max_a
+    dx_rein = (self.v + 0.5 * decel * dt_rein) * dt_rein
+    rein[TIME] = 0.0
+    rein[POS] = self.x
+    rein[VEL] = self.v
+    rein[ACC] = decel
+    turn[TIME] = rein[TIME] + dt_rein
+    turn[POS] = rein[POS] + dx_rein
+    turn[VEL] = rein[VEL] + dv_rein
+    turn[ACC] = decel
+
+    # Minimum stopping time and displacement from the turn state
+    dt_msd = np.abs(turn[VEL]) / self.max_a
+    dx_msd = dt_msd * (turn[VEL] + 0.5 * dt_msd * decel)
+    x_at_msd = turn[POS] + dx_msd
+
+    HeadingWrongWay = (self.target_x < turn[POS]) != (turn[VEL] < 0)
+    WillOvershootAnyway = (self.target_x < x_at_msd) != (dx_msd < 0.0)
+    MustTurn = HeadingWrongWay | WillOvershootAnyway
+
+    # Where turning, decelerate to a stop before lurching. Elsewhere,
+    # lurch from a back-projected state of rest.
+    lurch[TIME] = np.where(MustTurn, turn[TIME] + dt_msd, turn[TIME])
+    lurch[POS] = np.where(MustTurn, turn[POS] + dx_msd, turn[POS])
+    lurch[VEL] = np.where(MustTurn, 0.0, turn[VEL])
+    t_bplurch = np.where(MustTurn, lurch[TIME], lurch[TIME] - dt_msd)
+    x_bplurch = np.where(MustTurn, lurch[POS], lurch[POS] - dx_msd)
+
+    # From here on, the position is monotonic for each controller.
+    dx = self.target_x - x_bplurch
+    adx = np.abs(dx)
+    accel = np.copysign(self.max_a, dx)
+    decel = -accel
+    max_v = np.where(dx <= 0.0, self.max_rev_v, self.max_fwd_v)
+    max_dx_for_triangular_v = (max_v * max_v) / self.max_a
+
+    # Triangular velocity profiles do not reach the maximum speed.
+    triangular = adx <= max_dx_for_triangular_v
+    dt_vramp = np.where(
+      triangular,
+      np.sqrt(adx / self.max_a),
+      max_v / self.max_a,
+    )
+    dx_for_triangular_v = np.where(triangular, adx, max_dx_for_triangular_v)
+    lsd = np.where(triangular, 0.0, adx - max_dx_for_triangular_v)
+    lst = np.where(triangular, 0.0, lsd / np.maximum(1e-12, max_v))
+    inflection_v = np.where(triangular, self.max_a * dt_vramp, max_v)
+
+    # Acceleration
+    lurch[ACC] = accel
+
+    # Linear segment
+    cruise[TIME] = t_bplurch + dt_vramp
+    cruise[POS] = x_bplurch + 0.5 * np.copysign(dx_for_triangular_v, dx)
+    cruise[VEL] = brake[VEL] = np.copysign(inflection_v, dx)
+    cruise[ACC] = 0.0
+
+    # Deceleration
+    brake[TIME] = cruise[TIME] + lst
+    brake[POS] = cruise[POS] + np.copysign(lsd, dx)
+    brake[ACC] = decel
+
+    # Rest
+    rest[TIME] = brake[TIME] + dt_vramp
+    rest[POS] = self.target_x
+    rest[VEL] = 0.0
+    rest[ACC] = 0.0
+
+    # Select the piece in effect at t = dt for each controller.
+    qkf_ix = np.where(
+      delta_time < lurch[TIME],
+      np.where(delta_time < turn[TIME], 0, 1),
+      np.where(
+        delta_time < brake[TIME],
+        np.where(delta_time < cruise[TIME], 2, 3),
+        np.where(delta_time < rest[TIME], 4, 5),
+      ),
+    )
+
+    # Integrate x over each piece up to and including the selected one.
+    integral = np.array(self.integral)
+    t0_last = np.zeros(n)
+    for i in range(len(qkfs)):
+      t1 = qkfs[i + 1][TIME] if i + 1 < len(qkfs) else t0_last + delta_time
+      t0, x0, v0, a = qkfs[i]
+      active = (i <= qkf_ix) & (t1 >= 0.0)
+      past = t0 < 0
+      x0 = np.where(past, x0 + (0.5 * a * t0 - v0) * t0, x0)
+      v0 = np.where(past, v0 - a * t0, v0)
+      sdt = np.minimum(delta_time, t1) - t0
+      dxi = sdt * (x0 + sdt * (0.5 * v0 + sdt * (1.0/6.0) * a))
+      integral = np.where(active, integral + dxi, integral)
+      t0_last = np.where(active, t0, t0_last)
+    self.integral = integral
+
+    qkf = qkfs[qkf_ix, :, np.arange(n)]
+
+    t = delta_time - qkf[:, TIME]
+    self.x = qkf[:, POS] + t * (qkf[:, VEL] + 0.5 * t * qkf[:, ACC])
+    self.v = qkf[:, VEL] + t * qkf[:, ACC]
@@ -0,0 +1,60 @@
+# Bezier curve evaluation, shared by ArtCarSim and the turn rate plots
+#
+# eval_bezier - Points at one parameter or an array of parameters
+# eval_bezier_linspace - Points at a uniform sampling, with cached bases
+
+
+from functools import lru_cache
+from math import comb
+import numpy as np
+
+
+# Uniform samplings with up to this many parameters have their basis
+# matrices cached
+MAX_CACHED_BEZIER_SAMPLES = 1024
+
+
+def bernstein_basis(degree, t):
+  # The Bernstein basis polynomials of the given degree at each of the
+  # parameters t, along a new last axis, so that the points of a Bezier
+  # curve with control points C are bernstein_basis(...) @ C
+  t = np.asarray(t, dtype=float)[..., np.newaxis]
+  k = np.arange(degree + 1)
+  binomials = np.array([comb(degree, i) for i in k], dtype=float)
+  return binomials * t ** k * (1.0 - t) ** (degree - k)
+
+
+@lru_cache(maxsize=64)
+def linspace_bernstein_matrix(degree, num_samples, stop, endpoint):
+  M = bernstein_basis(degree, np.linspace(0.0, stop, num_samples,
+      endpoint=endpoint))
+  M.flags.writeable = False
+  return M
+
+
+def eval_bezier(C, t):
+  # A scalar t gives a single point by de Casteljau's algorithm. An
+  # array of parameters gives an array of points of the same shape in
+  # one product with the Bernstein basis.
+  if np.ndim(t) > 0:
+    return np.tensordot(bernstein_basis(len(C) - 1, t),
+        np.asanyarray(C), axes=1)
+  while len(C) > 1:
+    A = C[:-1]
+    B = C[1:]
+    C = A + np.subtract(B, A) * t
+  return C[0]
+
+
+def eval_bezier_linspace(C, num_samples, stop=1.0, endpoint=True):
+  # The points at the parameters np.linspace(0, stop, num_samples,
+  # endpoint=endpoint), with the basis matrix cached per degree and
+  # sampling so that a fixed tessellation costs only the product
+  degree = len(C) - 1
+  if num_samples <= MAX_CACHED_BEZIER_SAMPLES:
+    M = linspace_bernstein_matrix(degree, num_samples, float(stop),
+        bool(endpoint))
+  else:
+    M = bernstein_basis(degree, np.linspace(0.0, stop, num_samples,
+        endpoint=endpoint))
+  return M @ np.asanyarray(C)
@@ -1,20 +1,11 @@
 #!/usr/bin/env python3
 
 import numpy as np
-from matplotlib import pyplot as plt
 
 
 STD_GRAVITY = 9.80665  # in metres per second per second
 
 
-def eval_bezier(C, t):
-  while len(C) > 1:
-    A = C[:-1]
-    B = C[1:]
-    C = A + np.subtract(B, A) * t
-  return C[0]
-
-
 def bzt_turn_radius(left_speed, right_speed, axle_width):
   avg_speed = 0.5 * (right_speed + left_speed)
   diff_speed = (right_speed - left_speed)
@@ -25,17 +16,106 @@ def bzt_turn_radius(left_speed, right_speed, axle_width):
   return radius
 
 
+def qr(a, b, c):
+  det = b * b - 4 * a * c
+  if det >= 0.0:
+    r1 = 0.5 * (-b - np.sqrt(det)) / a
+    r2 = 0.5 * (-b + np.sqrt(det)) / a
+  else:
+    r1 = None
+    r2 = None
+  return r1, r2
+
+
+# Each curve family maps an array of speeds v (of any shape) to the
+# hardest turn rates omega and the lateral accelerations a = omega * v
+# for the maximum lateral acceleration mla, the maximum turn rate
+# max_omega, the top speed max_speed and the reversing slope ros.
+
+
+def safe_omega(a, v, omega_at_rest):
+  # a / v, with the limit at v = 0 given
+  return np.divide(a, v, out=np.full_like(a, omega_at_rest), where=(v != 0))
+
+
+def adhoc_curve(v, mla, max_omega, max_speed, ros):
+  v = np.asarray(v, dtype=float)
+  kappa = 1.2
+  rho = 0.25
+  rtss_multiplier = 4.0 * max_omega
+  tss = np.exp(-((v/kappa)**2))
+  r = np.tanh(0.5 * (v/max_speed)/(kappa * rho))
+  omega = tss * r * rtss_multiplier
+  return omega, omega * v
+
+
+def osculating_knee(mla, max_omega):
+  # Speed at which the parabola meets the hyperbola, or None if they
+  # never touch
+  return qr(0.5 * mla, -max_omega, mla)[0]
+
+
+def osculating_curve(v, mla, max_omega, max_speed, ros):
+  # Osculating parabola and hyperbola for omega (numerically unstable)
+  v = np.asarray(v, dtype=float)
+  omega = np.clip(mla / np.maximum(1e-9, np.abs(v)), -max_omega, max_omega)
+  v1 = osculating_knee(mla, max_omega)
+  if v1 is not None:
+    c = 0.5 * mla / v1
+    omega = np.where(np.abs(v) < v1, max_omega - c * v ** 2, omega)
+  # r = v / omega
+  # a = omega**2 * r
+  return omega, omega * v
+
+
+def parabolic_knee(mla, max_omega):
+  c = 0.5 * max_omega ** 2 / mla
+  return max_omega / c
+
+
+def parabolic_flat_curve(v, mla, max_omega, max_speed, ros):
+  # Parabola and flatline for accel (kinked at v = 0)
+  v = np.asarray(v, dtype=float)
+  c = 0.5 * max_omega ** 2 / mla
+  v1 = parabolic_knee(mla, max_omega)
+  sgn_v = np.where(v < 0, -1.0, 1.0)
+  abs_v = np.minimum(np.abs(v), v1)
+  a = sgn_v * (mla - 0.5 * c * (abs_v - v1) ** 2)
+  omega = np.clip(safe_omega(a, v, max_omega), 0, 4.5 * max_omega)
+  return omega, a
+
+
+def sigmoid_a_curve(v, mla, max_omega, max_speed, ros):
+  # Sigmoid for accel (excellent for BZT steering and for cars)
+  v = np.asarray(v, dtype=float)
+  a = mla * np.tanh(max_omega / mla * v)
+  omega = np.clip(safe_omega(a, v, max_omega), 0, 4.5 * max_omega)
+  return omega, a
+
+
+def sigmoid_a_omega_curve(v, mla, max_omega, max_speed, ros):
+  # Sigmoid for accel and omega (excellent for joystick cars)
+  v = np.asarray(v, dtype=float)
+  omega, a = sigmoid_a_curve(v, mla, max_omega, max_speed, ros)
+  omega = omega * np.tanh(ros * v)
+  return omega, omega * v
+
+
+# The sigmoids -1 + 2/(1 + exp(-2x)) of the original plots are written
+# as tanh(x), which is the same curve without overflowing exp() at
+# large negative speeds.
+curve_families = {
+  'ad-hoc': adhoc_curve,
+  'osculating': osculating_curve,
+  'parabolic-flat': parabolic_flat_curve,
+  'sigmoid-a': sigmoid_a_curve,
+  'sigmoid-a-omega': sigmoid_a_omega_curve,
+}
+
+
 def main():
 
-  def qr(a, b, c):
-    det = b * b - 4 * a * c
-    if det >= 0.0:
-      r1 = 0.5 * (-b - np.sqrt(det)) / a
-      r2 = 0.5 * (-b + np.sqrt(det)) / a
-    else:
-      r1 = None
-      r2 = None
-    return r1, r2
+  from matplotlib import pyplot as plt
 
   max_speed = 6 + 0.0 * 27.777778  # metres per second
   max_lat_accel = 2.0 # (1.47m/s/s standard max. for highways)
@@ -44,98 +124,37 @@ def main():
   #max_omega = np.radians(162.05695) # Osculating P-H failure
   #max_braking_decel = 0.62 * STD_GRAVITY  # (0.47g to 0.62g for cars)
 
-  v1 = qr(0.5 * max_lat_accel, -max_omega, max_lat_accel)[0]
-  c = 1.0
-  if v1 is not None:
-    c = 0.5 * max_lat_accel / v1
+  mla = max_lat_accel
 
   fig = plt.figure()
   ax = fig.subplots()
 
   v = np.linspace(-max_speed, max_speed, num=500)
-  a = np.full_like(v, max_lat_accel)
-
-  mla = max_lat_accel
 
-  if 1:
-    # Ad-hoc
-
-    kappa = 1.2
-    rho = 0.25
-    rtss_multiplier = 4.0 * max_omega
-    tss = np.exp(-((v/kappa)**2))
-    r = 2.0 / (1.0 + np.exp(-(v/max_speed)/(kappa * rho))) - 1.0
-    if 1:
-      tss *= r * rtss_multiplier
-
-    omega = tss
-
-    a = omega * v
-
-    ax.plot(v, omega, c='lime', ls='--', label="$\omega$ (Ad-hoc $\omega$)")
-    ax.plot(v, a, c='brown', ls='--', label="$a$ (Ad-hoc $\omega$)")
-
-  if 1:
-    # Osculating parabola and hyperbola for omega (numerically unstable)
-
-    omega = np.clip(mla / np.maximum(1e-9, np.abs(v)), -max_omega, max_omega)
-
-    if v1 is not None:
-      for i, v_i in enumerate(v):
-        if -v1 < v_i < v1:
-          omega[i] = max_omega - c * v_i ** 2
-
-    # r = v / omega
-    # a = omega**2 * r
-    a = omega * v
-
-    ax.plot(v, omega, c='y', ls='--',
-        label="$\omega$ (Osculating trash $\omega$)")
-    ax.plot(v, a, c='pink', ls='--',
-        label="$a$ (Osculating trash $\omega$)")
-    if v1 is not None:
-      ax.axvline(v1, c='y', ls='--', lw=0.5)
-
-  if 1:
-    # Parabola and flatline for accel (kinked at v = 0)
-
-    a[:] = mla
-    c = 0.5 * max_omega ** 2 / mla
-    v1 = max_omega / c
-    for i, v_i in enumerate(v):
-      if v_i < 0:
-        a[i] = -a[i]
-      if -v1 < v_i < v1:
-        abs_v_i = abs(v_i)
-        sgn_v_i = -1 if v_i < 0 else 1
-        a[i] = sgn_v_i * (mla - 0.5 * c * ((abs_v_i - v1)) ** 2)
-    omega = np.clip(a / v, 0, 4.5 * max_omega)
-
-    ax.plot(v, omega, c='green', label="$\omega$ (Parabolic & flat $a$)")
-    ax.plot(v, a, c='magenta', label="$a$ (Parabolic & flat $a$)")
-    if v1 is not None:
-      ax.axvline(v1, c='magenta', lw=0.5)
-
-  if 1:
-    # Sigmoid for accel (excellent for BZT steering and for cars)
-    mla = mla
-    a[:] = mla * (-1.0 + 2.0 / (1.0 + np.exp(-2 * max_omega / mla * v)))
-    omega = np.clip(a / v, 0, 4.5 * max_omega)
-
-    ax.plot(v, omega, c='#8800FF', label="$\omega$ (Sigmoid $a$)", lw=2)
-    ax.plot(v, a, c='orange', label="$a$ (Sigmoid $a$)", lw=2)
-
-  if 1:
-    # Sigmoid for accel and omega (excellent for joystick cars)
-
-    a[:] = mla * (-1.0 + 2.0 / (1.0 + np.exp(-2 * max_omega / mla * v)))
-    omega = np.clip(a / v, 0, 4.5 * max_omega)
-    s = (-1.0 + 2.0 / (1.0 + np.exp(-2 * omega_reversing_slope * v)))
-    omega *= s
-    a = omega * v
-
-    ax.plot(v, omega, c='blue', label="$\omega$ (Sigmoid $a, \omega$)", lw=2)
-    ax.plot(v, a, c='red', label="$a$ (Sigmoid $a, \omega$)", lw=2)
+  # Family, omega style, a style, label, line width and knee speed
+  plots = (
+    ('ad-hoc', dict(c='lime', ls='--'), dict(c='brown', ls='--'),
+        "Ad-hoc $\\omega$", None, None),
+    ('osculating', dict(c='y', ls='--'), dict(c='pink', ls='--'),
+        "Osculating trash $\\omega$", None,
+        (osculating_knee(mla, max_omega), dict(c='y', ls='--', lw=0.5))),
+    ('parabolic-flat', dict(c='green'), dict(c='magenta'),
+        "Parabolic & flat $a$", None,
+        (parabolic_knee(mla, max_omega), dict(c='magenta', lw=0.5))),
+    ('sigmoid-a', dict(c='#8800FF'), dict(c='orange'),
+        "Sigmoid $a$", 2, None),
+    ('sigmoid-a-omega', dict(c='blue'), dict(c='red'),
+        "Sigmoid $a, \\omega$", 2, None),
+  )
+
+  for name, omega_style, a_style, label, lw, knee in plots:
+    omega, a = curve_families[name](
+        v, mla, max_omega, max_speed, omega_reversing_slope)
+    ax.plot(v, omega, lw=lw, label="$\\omega$ ({})".format(label),
+        **omega_style)
+    ax.plot(v, a, lw=lw, label="$a$ ({})".format(label), **a_style)
+    if knee is not None and knee[0] is not None:
+      ax.axvline(knee[0], **knee[1])
 
   ax.set_title("Hardest Turning Rates for Various Speeds", size=14)
   ax.set_xlabel("Speed (ms⁻¹)")